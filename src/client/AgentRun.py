@@ -18,36 +18,64 @@ import localServiceProber
 
 import commManager
 import probeAgent
+import peerProber
+import bwTester
+import agentGovernor
+import adaptiveInterval
+import reportForwarder
 import BgCtrl as bg
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 def initGlobalVal():
     if gv.gBgctrl: gv.iBgctrler = bg.BgController("ProgAgent")
+    gv.iGovernor = agentGovernor.OverheadGovernor(cpuBudget=gv.gCpuBudget)
     gv.iNetProbeDriver = networkServiceProber.networkServiceProber(debugLogger=Log)
     gv.iLocalProbeDriver = localServiceProber.localServiceProber(gv.gOwnID, debugLogger=Log)
+    gv.iLocalProbeDriver.getSampler()  # start sampling before the first probe cycle.
+    gv.iPeerProber = peerProber.PeerProber(gv.gOwnID)
+    gv.iBwTester = bwTester.BandwidthTester()
     gv.iCommMgr = commManager.commManager()
     gv.iCommMgr.initUDPServer(gv.UDP_PORT)
     gv.iCommMgr.start()
+    if gv.gHubReport:
+        gv.iReportFwd = reportForwarder.ReportForwarder(gv.gSpoolDir, gv.iCommMgr.sendReport, 
+                                                        maxSize=gv.gSpoolMaxSz)
+        gv.iReportFwd.start()
 
 #-----------------------------------------------------------------------------
 def initProbers(agent):
     gv.gDebugPrint('Start to init the probers', logType=gv.LOG_INFO)
      # add a prober to check the Forni
     prober1 = probeAgent.Prober('Internet', target='8.8.8.8')
-    prober1.addProbAction(gv.iNetProbeDriver.checkPing)
+    # probe faster when the ping RTT(avg) jumps or the target is lost.
+    pingAdaptive = adaptiveInterval.AdaptiveInterval(gv.gTimeInterval, valueFunc=lambda rst: rst['ping'][1], 
+                                                     stableTol=5)
+    prober1.addProbAction(gv.iNetProbeDriver.checkPing, adaptive=pingAdaptive)
     agent.addProber(prober1)
 
+    # add a prober to check the latency to the peer agents in the hub's roster.
+    prober2 = probeAgent.Prober('Peers', target='peers')
+    prober2.addProbAction(gv.iPeerProber.probePeers)
+    agent.addProber(prober2)
+
     prober15 = probeAgent.Prober('local', target='Local')
     def porbAction_151(target):
         configDict =  {
-                'cpu': {'interval': 0.5, 'percpu': True},
+                'cpu': {'window': None, 'percpu': True},
                 'ram': 0,
+                'stats': ['cpu', 'ram'],
+                'netio': 0,
+                'diskio': 0,
+                'process': {'count': 0, 'top': 5},
             }
         if gv.iLocalProbeDriver: 
             gv.iLocalProbeDriver.updateResUsage(configDict=configDict)
             return gv.iLocalProbeDriver.getLastResult()
-    prober15.addProbAction(porbAction_151)
+    # probe faster when the ram usage over 90% or changes sharply.
+    localAdaptive = adaptiveInterval.AdaptiveInterval(gv.gTimeInterval, valueFunc=lambda rst: rst['ram'], 
+                                                      threshold=90, stableTol=1)
+    prober15.addProbAction(porbAction_151, adaptive=localAdaptive)
     agent.addProber(prober15)
 
 #-----------------------------------------------------------------------------
@@ -58,6 +86,7 @@ def main():
     print("startRun")
     agent.startRun()
     print('Finish')
+    if gv.iReportFwd: gv.iReportFwd.stop()
     gv.iCommMgr.disconnect()
 
 #-----------------------------------------------------------------------------
@@ -0,0 +1,107 @@
+#-----------------------------------------------------------------------------
+# Name:        adaptiveInterval.py
+#
+# Purpose:     This module provides the adaptive execution interval of a probe
+#              action driven by the volatility of the value it measures:
+#              - the EWMA of the value change between two runs is tracked.
+#              - stable value (change not bigger than the EWMA): the interval
+#                grows step by step to the max interval.
+#              - threshold reached, the value changed more than <varianceK> x
+#                the EWMA or the value appears/disappears: the interval drops
+#                to the min interval at once.
+#              Every interval change is logged.
+#
+# Author:      Yuancheng Liu
+#
+# Version:     v_0.1
+# Created:     2023/04/19
+# Copyright:   n.a
+# License:     n.a
+#-----------------------------------------------------------------------------
+
+import probeGlobal as gv
+
+GROW_FACTOR = 1.5       # interval multiplier every stable run.
+EWMA_ALPHA = 0.3        # smoothing factor of the value change EWMA.
+VARIANCE_K = 3          # change bigger than K x EWMA triggers the min interval.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class AdaptiveInterval(object):
+    """ Calculate the next run interval of a probe action from its result.
+        Example:
+            adaptive = AdaptiveInterval(60, minInterval=10, maxInterval=300,
+                                        valueFunc=lambda rst: rst['ram'], threshold=90)
+            prober.addProbAction(probeFunc, adaptive=adaptive)
+    """
+    def __init__(self, baseInterval, minInterval=None, maxInterval=None, valueFunc=None,
+                 threshold=None, stableTol=0.0, varianceK=VARIANCE_K, alpha=EWMA_ALPHA,
+                 growFactor=GROW_FACTOR) -> None:
+        """ Init the obj.
+            Args:
+                baseInterval (float): start interval (sec).
+                minInterval (float, optional): interval when triggered. Defaults to baseInterval/4.
+                maxInterval (float, optional): interval limit when stable. Defaults to baseInterval*4.
+                valueFunc (function, optional): get the watched value (float/None) from the
+                    probe action result dict. Defaults to None (the result is the value).
+                threshold (float, optional): value reaches the threshold triggers. Defaults to None.
+                stableTol (float, optional): value change not bigger than it is noise. Defaults to 0.
+        """
+        self.baseInterval = float(baseInterval)
+        self.minInterval = float(minInterval) if minInterval is not None else self.baseInterval/4
+        self.maxInterval = float(maxInterval) if maxInterval is not None else self.baseInterval*4
+        self.valueFunc = valueFunc
+        self.threshold = threshold
+        self.stableTol = stableTol
+        self.varianceK = varianceK
+        self.alpha = alpha
+        self.growFactor = growFactor
+        self.interval = self.baseInterval
+        self.ewmaChange = None
+        self.lastVal = None
+        self.runCount = 0
+
+#-----------------------------------------------------------------------------
+    def _getValue(self, result):
+        try:
+            val = self.valueFunc(result) if self.valueFunc else result
+            return None if val is None else float(val)
+        except Exception as err:
+            return None
+
+    def update(self, result, actId=''):
+        """ Update with the probe action's result.
+            Returns:
+                float: the next run interval (sec).
+        """
+        val = self._getValue(result)
+        lastVal, self.lastVal = self.lastVal, val
+        self.runCount += 1
+        if self.runCount == 1: return self.interval
+        reason = None
+        if (lastVal is None) != (val is None):
+            reason = 'value %s' %('lost' if val is None else 'back')
+            change = None
+        else:
+            change = 0.0 if val is None else abs(val - lastVal)
+            if self.threshold is not None and val is not None and val >= self.threshold:
+                reason = 'value %s reached threshold %s' %(str(val), str(self.threshold))
+            elif self.ewmaChange is not None and change > self.varianceK * max(self.ewmaChange, self.stableTol):
+                reason = 'change %.3f > %s x EWMA %.3f' %(change, str(self.varianceK), self.ewmaChange)
+        if reason:
+            newInterval = self.minInterval
+        elif self.ewmaChange is None or change <= max(self.ewmaChange, self.stableTol):
+            newInterval = min(self.maxInterval, self.interval * self.growFactor)
+            reason = 'stable'
+        else:
+            newInterval = self.interval
+        if change is not None:
+            self.ewmaChange = change if self.ewmaChange is None else self.ewmaChange + self.alpha * (change - self.ewmaChange)
+        if newInterval != self.interval:
+            gv.gDebugPrint("Probe action %s interval %.1f -> %.1f sec: %s" %(str(actId), self.interval, newInterval, reason),
+                           logType=gv.LOG_INFO)
+            self.interval = newInterval
+        return self.interval
+
+    def getState(self):
+        return {'interval': self.interval, 'ewma': self.ewmaChange, 'value': self.lastVal}
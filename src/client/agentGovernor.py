@@ -0,0 +1,143 @@
+#-----------------------------------------------------------------------------
+# Name:        agentGovernor.py
+#
+# Purpose:     This module measures the monitor agent's own overhead (process
+#              CPU time, RSS and each probe action's wall/CPU cost) and keeps
+#              the agent under a CPU budget (percent of one core):
+#              1. Over budget: stretch the probe cycle interval step by step.
+#              2. Still over budget at the max stretch: disable the probe action
+#                 with the highest CPU cost (one per cycle).
+#              3. Under half of the budget for 3 cycles: enable the disabled probe
+#                 actions back then shrink the interval to the configured one.
+#              The overhead figures are added in the agent report.
+#
+# Author:      Yuancheng Liu
+#
+# Version:     v_0.1
+# Created:     2023/04/18
+# Copyright:   n.a
+# License:     n.a
+#-----------------------------------------------------------------------------
+
+import time
+import threading
+
+import psutil
+
+import probeGlobal as gv
+
+CPU_BUDGET = 1.0        # default budget: percent of one core.
+STRETCH_STEP = 1.5      # interval multiplier applied every over budget cycle.
+STRETCH_MAX = 8         # max interval multiplier.
+COST_ALPHA = 0.3        # EWMA smoothing factor of the probe actions cost.
+RECOVER_RATIO = 0.5     # relax the limits when the usage is under this part of the budget
+RECOVER_CYCLES = 3      # for this number of continuous cycles.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class OverheadGovernor(object):
+    """ Record the probe actions' cost and evaluate the agent's CPU usage once
+        per probe cycle.
+        Example:
+            governor = OverheadGovernor(cpuBudget=1.0)
+            startT = governor.startProbe()
+            ... run the probe action ...
+            governor.endProbe(actId, startT)
+            governor.evaluate() # at the end of the cycle.
+            governor.getInterval(60) -> stretched interval.
+    """
+    def __init__(self, cpuBudget=CPU_BUDGET) -> None:
+        self.cpuBudget = float(cpuBudget)
+        self.stretch = 1.0
+        self.disabledList = []  # disabled probe action ids, last disabled at the end.
+        self.probeCostDict = {} # actId -> {'wall': <ms>, 'cpu': <ms>, 'wallAvg': <ms>, 'cpuAvg': <ms>}
+        self.process = psutil.Process()
+        self.lastCpuUsage = None
+        self._underCount = 0    # continuous cycles under the recover threshold.
+        self._lastEval = (time.monotonic(), time.process_time())
+        self._lock = threading.Lock()
+
+#-----------------------------------------------------------------------------
+    def isEnabled(self, actId):
+        return actId not in self.disabledList
+
+    def startProbe(self):
+        """ Return the (wall time, thread cpu time) at the probe action start."""
+        return (time.perf_counter(), time.thread_time())
+
+    def endProbe(self, actId, startT):
+        """ Record the probe action's cost, the cpu time is the calling thread's."""
+        wallT = (time.perf_counter() - startT[0]) * 1000
+        cpuT = (time.thread_time() - startT[1]) * 1000
+        with self._lock:
+            costDict = self.probeCostDict.get(actId)
+            if costDict is None:
+                self.probeCostDict[actId] = {'wall': wallT, 'cpu': cpuT, 'wallAvg': wallT, 'cpuAvg': cpuT}
+                return
+            costDict['wall'], costDict['cpu'] = wallT, cpuT
+            costDict['wallAvg'] += COST_ALPHA * (wallT - costDict['wallAvg'])
+            costDict['cpuAvg'] += COST_ALPHA * (cpuT - costDict['cpuAvg'])
+
+#-----------------------------------------------------------------------------
+    def evaluate(self):
+        """ Calculate the agent process cpu usage since the last evaluation and
+            adjust the interval stretch / disabled probes.
+            Returns:
+                float: the agent cpu usage (percent of one core).
+        """
+        now, cpuTime = time.monotonic(), time.process_time()
+        lastT, lastCpuTime = self._lastEval
+        self._lastEval = (now, cpuTime)
+        if now <= lastT: return self.lastCpuUsage
+        self.lastCpuUsage = cpuUsage = (cpuTime - lastCpuTime) / (now - lastT) * 100
+        with self._lock:
+            self._underCount = self._underCount + 1 if cpuUsage < self.cpuBudget * RECOVER_RATIO else 0
+            if cpuUsage > self.cpuBudget:
+                if self.stretch < STRETCH_MAX:
+                    self.stretch = min(STRETCH_MAX, self.stretch * STRETCH_STEP)
+                    gv.gDebugPrint("Agent cpu %.2f%% over budget %.2f%%, stretch interval x%.2f"
+                                   %(cpuUsage, self.cpuBudget, self.stretch), logType=gv.LOG_WARN)
+                else:
+                    actId = self._getMostExpensive()
+                    if actId:
+                        self.disabledList.append(actId)
+                        gv.gDebugPrint("Agent cpu %.2f%% over budget %.2f%%, disable probe %s"
+                                       %(cpuUsage, self.cpuBudget, actId), logType=gv.LOG_WARN)
+            elif self._underCount >= RECOVER_CYCLES:
+                self._underCount = 0
+                if self.disabledList:
+                    actId = self.disabledList.pop()
+                    gv.gDebugPrint("Agent cpu %.2f%% under budget, enable probe %s" %(cpuUsage, actId),
+                                   logType=gv.LOG_INFO)
+                elif self.stretch > 1:
+                    self.stretch = max(1.0, self.stretch / STRETCH_STEP)
+        return cpuUsage
+
+    def _getMostExpensive(self):
+        """ Get the enabled probe action id with the highest average cpu cost."""
+        costList = [(costDict['cpuAvg'], actId) for actId, costDict in self.probeCostDict.items()
+                    if actId not in self.disabledList]
+        return max(costList)[1] if costList else None
+
+    def getInterval(self, interval):
+        return interval * self.stretch
+
+#-----------------------------------------------------------------------------
+    def getReport(self):
+        """ Returns:
+                dict: {'cpu': <percent of one core in the last cycle>, 'cpuTime': <total sec>,
+                       'rss': <bytes>, 'budget': <percent>, 'stretch': <interval multiplier>,
+                       'disabled': [actId, ...], 'probes': {'<actId>': {'wall': <ms>, 'cpu': <ms>, ...}}}
+        """
+        try:
+            rss = self.process.memory_info().rss
+        except psutil.Error:
+            rss = None
+        with self._lock:
+            return {'cpu': self.lastCpuUsage,
+                    'cpuTime': time.process_time(),
+                    'rss': rss,
+                    'budget': self.cpuBudget,
+                    'stretch': self.stretch,
+                    'disabled': list(self.disabledList),
+                    'probes': {actId: dict(costDict) for actId, costDict in self.probeCostDict.items()}}
@@ -0,0 +1,224 @@
+#-----------------------------------------------------------------------------
+# Name:        bwTester.py
+#
+# Purpose:     This module provides an iperf-like UDP throughput test between
+#              two agents built on the <udpCom> sockets. The test work flow:
+#              1. Hub sends 'GET;bwtest;{"peer": [ip, port], "duration": <sec>,
+#                 "rate": <Mbit/s>}' to the sender agent.
+#              2. Sender agent asks the peer agent to open a receiver by
+#                 'POST;bwrecv;{"id": <testId>, "duration": <sec>}'.
+#              3. Sender blasts paced sequenced datagrams to the receiver port.
+#              4. Sender fetches the received bytes, loss and reordering by
+#                 'GET;bwreport;{"id": <testId>, "sent": <datagrams sent>}'.
+#              5. Hub fetches the result by 'GET;bwtest;{}'.
+#
+# Author:      Yuancheng Liu
+#
+# Version:     v_0.1
+# Created:     2023/04/10
+# Copyright:
+# License:
+#-----------------------------------------------------------------------------
+
+import time
+import json
+import socket
+import struct
+import threading
+
+import probeGlobal as gv
+import udpCom
+
+BW_FLG = b'BW'              # flag to identify the bandwidth test datagram.
+BW_HEADER_FMT = '!2sII'     # flag, test id, sequence number
+BW_PKT_SZ = 1200            # default datagram size (bytes).
+BW_MAX_DURATION = 60        # max test duration (sec).
+BW_MAX_RATE = 1000          # max test rate (Mbit/s).
+BW_GRACE_TIME = 0.5         # sec waiting the last datagrams arrive before fetching the report.
+BW_RECV_EXTRA_TIME = 5      # sec the receiver keeps open after the test duration if no report request.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class BwTestReceiver(threading.Thread):
+    """ Receiver thread opens a udpCom server on a random port and counts the
+        test datagrams till the report is requested or the timeout.
+    """
+    def __init__(self, testId, duration) -> None:
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.testId = int(testId)
+        self.udpServer = udpCom.udpServer(None, 0)
+        self.port = self.udpServer.server.getsockname()[1]
+        self.endTime = time.monotonic() + duration + BW_RECV_EXTRA_TIME
+        self.recvCount = 0
+        self.recvBytes = 0
+        self.reorderCount = 0
+        self.duplicateCount = 0
+        self.maxSeq = -1
+        self.seqSet = set()
+        self.firstT = self.lastT = None
+        self.terminate = False
+
+    def run(self):
+        recvSock = self.udpServer.server
+        headerSz = struct.calcsize(BW_HEADER_FMT)
+        while not self.terminate:
+            remainT = self.endTime - time.monotonic()
+            if remainT <= 0: break
+            recvSock.settimeout(min(remainT, 0.5))
+            try:
+                data, _ = recvSock.recvfrom(udpCom.BUFFER_SZ)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if len(data) < headerSz: continue
+            flg, testId, seq = struct.unpack_from(BW_HEADER_FMT, data)
+            if flg != BW_FLG or testId != self.testId: continue
+            self.lastT = time.monotonic()
+            if self.firstT is None: self.firstT = self.lastT
+            if seq in self.seqSet:
+                self.duplicateCount += 1
+                continue
+            self.seqSet.add(seq)
+            self.recvCount += 1
+            self.recvBytes += len(data)
+            if seq < self.maxSeq:
+                self.reorderCount += 1
+            else:
+                self.maxSeq = seq
+        recvSock.close()
+
+    def getReport(self, sentCount=None):
+        """ Stop the receiver and return the statistic dict."""
+        self.terminate = True
+        self.join(1)
+        sentCount = int(sentCount) if sentCount is not None else self.maxSeq + 1
+        recvTime = (self.lastT - self.firstT) if self.recvCount > 1 else 0
+        return {'recv': self.recvCount,
+                'recvBytes': self.recvBytes,
+                'recvRate': self.recvBytes*8/recvTime/1e6 if recvTime > 0 else None,
+                'loss': 1 - self.recvCount/sentCount if sentCount > 0 else None,
+                'reorder': self.reorderCount,
+                'duplicate': self.duplicateCount}
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class BandwidthTester(object):
+    """ Manage the bandwidth tests this agent sends (one at a time) and the
+        receivers opened for the peer agents' tests.
+    """
+    def __init__(self) -> None:
+        self.receiverDict = {}  # testId -> BwTestReceiver
+        self.testId = int(time.time()) & 0xFFFFFF
+        self.lastResult = {'state': 'idle'}
+        self.senderThread = None
+        self._lock = threading.Lock()
+
+#-----------------------------------------------------------------------------
+    def startTest(self, peer, duration=5, rate=10, pktSize=BW_PKT_SZ):
+        """ Start a throughput test to the peer agent in background.
+            Args:
+                peer (list): [ip, udpPort] of the peer agent.
+                duration (float, optional): test duration (sec). Defaults to 5.
+                rate (float, optional): sending rate (Mbit/s). Defaults to 10.
+                pktSize (int, optional): datagram size(bytes). Defaults to BW_PKT_SZ.
+            Returns:
+                dict: {'id': <testId>, 'state': 'running'/'busy'/'error'}
+        """
+        with self._lock:
+            if self.senderThread and self.senderThread.is_alive():
+                return {'id': self.lastResult.get('id'), 'state': 'busy'}
+            try:
+                peer = (str(peer[0]), int(peer[1]))
+                duration = min(max(float(duration), 0.1), BW_MAX_DURATION)
+                rate = min(max(float(rate), 0.001), BW_MAX_RATE)
+                pktSize = min(max(int(pktSize), struct.calcsize(BW_HEADER_FMT)), udpCom.BUFFER_SZ)
+            except Exception as err:
+                gv.gDebugPrint("startTest(): invalid bwtest parameters: %s" %str(err), logType=gv.LOG_WARN)
+                return {'id': None, 'state': 'error'}
+            self.testId = (self.testId + 1) & 0xFFFFFFFF
+            self.lastResult = {'id': self.testId, 'state': 'running', 'peer': list(peer),
+                               'duration': duration, 'rate': rate, 'size': pktSize}
+            self.senderThread = threading.Thread(target=self.runTest, daemon=True,
+                                                 args=(self.testId, peer, duration, rate, pktSize))
+            self.senderThread.start()
+            return {'id': self.testId, 'state': 'running'}
+
+    def getResult(self):
+        return dict(self.lastResult)
+
+#-----------------------------------------------------------------------------
+    def runTest(self, testId, peer, duration, rate, pktSize):
+        """ Run the sender side of a test (blocking), the result is saved in the
+            lastResult dict.
+        """
+        resultDict = dict(self.lastResult)
+        client = udpCom.udpClient(peer)
+        client.setTimeOut(3)
+        try:
+            # Ask the peer to open a receiver.
+            msg = ';'.join(('POST', 'bwrecv', json.dumps({'id': testId, 'duration': duration})))
+            resp = client.sendMsg(msg, resp=True)
+            if resp is None: raise ConnectionError("peer %s not response." %str(peer))
+            reqKey, reqType, reqJsonStr = resp.decode(udpCom.CODE_FMT).split(';', 2)
+            if reqKey != 'REP' or reqType != 'bwrecv': raise ConnectionError("peer %s deny the test." %str(peer))
+            recvAddr = (peer[0], int(json.loads(reqJsonStr)['port']))
+            # Blast the paced datagrams.
+            padding = b'x' * (pktSize - struct.calcsize(BW_HEADER_FMT))
+            pktInterval = pktSize*8/(rate*1e6)
+            sendSock = client.client
+            seq = 0
+            startT = time.monotonic()
+            endT = startT + duration
+            while True:
+                now = time.monotonic()
+                if now >= endT: break
+                # send all the datagrams scheduled before now, then sleep a short while.
+                dueCount = int((now - startT)/pktInterval) + 1
+                while seq < dueCount:
+                    try:
+                        sendSock.sendto(struct.pack(BW_HEADER_FMT, BW_FLG, testId, seq) + padding, recvAddr)
+                    except OSError:
+                        pass # send buffer full, the datagram is counted as lost.
+                    seq += 1
+                time.sleep(min(0.001, max(0, startT + seq*pktInterval - time.monotonic())))
+            sendTime = time.monotonic() - startT
+            resultDict.update({'sent': seq,
+                               'sentBytes': seq*pktSize,
+                               'sendRate': seq*pktSize*8/sendTime/1e6})
+            time.sleep(BW_GRACE_TIME)
+            # Fetch the receiver report.
+            msg = ';'.join(('GET', 'bwreport', json.dumps({'id': testId, 'sent': seq})))
+            resp = client.sendMsg(msg, resp=True)
+            if resp is None: raise ConnectionError("peer %s report not response." %str(peer))
+            _, _, reqJsonStr = resp.decode(udpCom.CODE_FMT).split(';', 2)
+            resultDict.update(json.loads(reqJsonStr))
+            resultDict['state'] = 'finished'
+        except Exception as err:
+            gv.gDebugPrint("Bandwidth test to %s failed: %s" %(str(peer), str(err)), logType=gv.LOG_WARN)
+            resultDict['state'] = 'error'
+        finally:
+            client.client.close()
+        resultDict['time'] = time.time()
+        self.lastResult = resultDict
+        return resultDict
+
+#-----------------------------------------------------------------------------
+    def openReceiver(self, testId, duration):
+        """ Open a receiver for the peer's test, return the receiver UDP port."""
+        duration = min(max(float(duration), 0.1), BW_MAX_DURATION)
+        with self._lock:
+            # clean up the finished receivers.
+            for key in [key for key, receiver in self.receiverDict.items() if not receiver.is_alive()]:
+                self.receiverDict.pop(key)
+            receiver = BwTestReceiver(testId, duration)
+            self.receiverDict[receiver.testId] = receiver
+        receiver.start()
+        return receiver.port
+
+    def getReport(self, testId, sentCount=None):
+        """ Stop the receiver and return its report, None if the test not found."""
+        with self._lock:
+            receiver = self.receiverDict.pop(int(testId), None)
+        return receiver.getReport(sentCount=sentCount) if receiver else None
@@ -6,6 +6,7 @@
 #              - UDP server for data fetch request. 
 #              - UDP client for data auto-submission. 
 #              - HTTP/HTTPS client for data submittion.
+#              - Store and forward of the reports by the report forwarder.
 #              
 # Author:      Yuancheng Liu 
 #
@@ -22,8 +23,13 @@ import threading
 
 import probeGlobal as gv
 import udpCom
+import metricStats
 import Log
 
+ECHO_REQ_PREFIX = b'GET;echo;'
+ECHO_REP_PREFIX = b'REP;echo;'
+REPORT_TIMEOUT = 10 # http report timeout (sec).
+
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class udpManager(threading.Thread):
@@ -96,6 +102,16 @@ class commManager(udpManager):
     def __init__(self) -> None:
         super().__init__()
 
+    #-----------------------------------------------------------------------------
+    def run(self):
+        """ Thread run() function will be called by start(). """
+        time.sleep(1)
+        if self.udpServer:
+            gv.gDebugPrint("Comm manager: udp server started.", logType=gv.LOG_INFO)
+            # the peers' echo requests are not logged.
+            self.udpServer.serverStart(handler=self.msgHandler, quietPrefix=ECHO_REQ_PREFIX)
+        gv.gDebugPrint("Comm manager: udp server closed.", logType=gv.LOG_INFO)
+
     #-----------------------------------------------------------------------------
     def msgHandler(self, msg):
         """ Function to handle the data-fetch/control request from the monitor-hub.
@@ -104,33 +120,110 @@ class commManager(udpManager):
             Returns:
                 bytes: message bytes reply to the monitor hub side.
         """
+        # Peer agent's latency echo request, reply it directly without logging.
+        if isinstance(msg, bytes) and msg.startswith(ECHO_REQ_PREFIX):
+            return ECHO_REP_PREFIX + msg[len(ECHO_REQ_PREFIX):]
         gv.gDebugPrint("Incomming message: %s" % str(msg), logType=gv.LOG_INFO)
         resp = b'REP;deny;{}'
         (reqKey, reqType, reqJsonStr) = self._parseIncomeMsg(msg)
-        if reqKey=='GET':
+        if reqKey == 'POST':
+            if reqType == 'roster':
+                # Peers for the latency probe, request: POST;roster;{"peers": [[ip, port], ...]}
+                reqDict = self._loadReqJson(reqJsonStr)
+                peerCount = gv.iPeerProber.setRoster(reqDict.get('peers', [])) if gv.iPeerProber else 0
+                resp = ';'.join(('REP', 'roster', json.dumps({'count': peerCount})))
+            elif reqType == 'bwrecv' and gv.iBwTester:
+                # Open a bandwidth test receiver, request: POST;bwrecv;{"id": <testId>, "duration": <sec>}
+                reqDict = self._loadReqJson(reqJsonStr)
+                try:
+                    port = gv.iBwTester.openReceiver(reqDict['id'], reqDict.get('duration', 5))
+                    resp = ';'.join(('REP', 'bwrecv', json.dumps({'port': port})))
+                except Exception as err:
+                    gv.gDebugPrint("Open bandwidth test receiver error: %s" %str(err), logType=gv.LOG_ERR)
+        elif reqKey=='GET':
             if reqType == 'data':
                 rstStr = json.dumps(gv.iDataMgr.getResultDict())
                 resp = ';'.join(('REP', 'data', rstStr))
+            elif reqType == 'history':
+                # Results history to backfill the gaps: GET;history;{"from": <timestamp>, "to": <timestamp>,
+                # "fields": ["<field>", ...], "limit": <max points>}, fetch the next page from the reply's "next".
+                reqDict = self._loadReqJson(reqJsonStr)
+                try:
+                    rstDict = gv.iDataMgr.getHistory(startT=reqDict.get('from'), endT=reqDict.get('to'),
+                                                     fieldList=reqDict.get('fields'),
+                                                     limit=reqDict.get('limit', metricStats.HISTORY_MAX_POINTS))
+                    resp = ';'.join(('REP', 'history', json.dumps(rstDict)))
+                except Exception as err:
+                    gv.gDebugPrint("Get results history error: %s" %str(err), logType=gv.LOG_ERR)
+            elif reqType == 'tcpHist':
+                # TCP connect latency histograms, request: GET;tcpHist;{"reset": <bool>}
+                reqDict = self._loadReqJson(reqJsonStr)
+                rstStr = json.dumps(gv.iNetProbeDriver.getTcpLatencyHist(
+                    resetFlg=bool(reqDict.get('reset', False)))) if gv.iNetProbeDriver else '{}'
+                resp = ';'.join(('REP', 'tcpHist', rstStr))
+            elif reqType == 'bwtest' and gv.iBwTester:
+                # Start a bandwidth test: GET;bwtest;{"peer": [ip, port], "duration": <sec>, "rate": <Mbit/s>}
+                # or fetch the last test result: GET;bwtest;{}
+                reqDict = self._loadReqJson(reqJsonStr)
+                if 'peer' in reqDict:
+                    rstDict = gv.iBwTester.startTest(reqDict['peer'], duration=reqDict.get('duration', 5), 
+                                                     rate=reqDict.get('rate', 10))
+                else:
+                    rstDict = gv.iBwTester.getResult()
+                resp = ';'.join(('REP', 'bwtest', json.dumps(rstDict)))
+            elif reqType == 'bwreport' and gv.iBwTester:
+                # Bandwidth test receiver report: GET;bwreport;{"id": <testId>, "sent": <datagrams sent>}
+                reqDict = self._loadReqJson(reqJsonStr)
+                rstDict = gv.iBwTester.getReport(reqDict.get('id', -1), sentCount=reqDict.get('sent'))
+                if rstDict is not None: resp = ';'.join(('REP', 'bwreport', json.dumps(rstDict)))
         return resp
+
+    #-----------------------------------------------------------------------------
+    def _loadReqJson(self, reqJsonStr):
+        """ Load the request's json parameters, return {} if the format is incorrect."""
+        try:
+            reqDict = json.loads(reqJsonStr) if reqJsonStr else {}
+            return reqDict if isinstance(reqDict, dict) else {}
+        except Exception as err:
+            Log.error('_loadReqJson(): The request json string is incorrect: %s' %str(reqJsonStr))
+            return {}
     
     #-----------------------------------------------------------------------------
     def postData(self, postUrl, jsonDict):
+        """ Returns:
+                bool: True if the http server accepted the data.
+        """
         try:
-            res = requests.post(postUrl, json=jsonDict)
+            res = requests.post(postUrl, json=jsonDict, timeout=REPORT_TIMEOUT)
             if res.ok: gv.gDebugPrint("http server reply: %s" %str(res.json()), logType=gv.LOG_INFO)
+            return res.ok
         except Exception as err:
             gv.gDebugPrint("http server not reachable, error: %s" %str(err), logType=gv.LOG_ERR)
+            return False
 
     #-----------------------------------------------------------------------------
     def reportTohub(self, jsonDict, udpMode=True):
+        """ Report the data to the monitor hub, if the report forwarder is inited
+            the data is spooled and sent (resent till acknowledged) by the 
+            forwarder thread so the caller is not blocked.
+        """
+        if gv.iReportFwd:
+            gv.iReportFwd.put(jsonDict, udpMode=udpMode)
+        else:
+            self.sendReport(jsonDict, udpMode=udpMode)
 
+    def sendReport(self, jsonDict, udpMode=True):
+        """ Send the data to the monitor hub.
+            Returns:
+                bool: True if the hub acknowledged (replied) the report.
+        """
         if udpMode and self.udpClient:
             ipaddress = (gv.gMonitorHubAddr['ipaddr'], gv.gMonitorHubAddr['udpPort'])
             reportStr = ';'.join(('POST', 'data', json.dumps(jsonDict)))
-            self.udpClient.sendMsg(reportStr, resp=True, ipAddr=ipaddress)
+            return self.udpClient.sendMsg(reportStr, resp=True, ipAddr=ipaddress) is not None
         else:
             reportUrl = "http://%s:%s/dataPost/" % (gv.gMonitorHubAddr['ipaddr'], str(gv.gMonitorHubAddr['httpPort']))
-            reportUrl += str(jsonDict['id'])
+            reportUrl += str(jsonDict.get('id', gv.gOwnID))
             jsonDict = {"rawData":json.dumps(jsonDict)}
             gv.gDebugPrint("Start to report monitorHub[%s]" %str(gv.gMonitorHubAddr['ipaddr']), logType=gv.LOG_INFO)
-            self.postData(reportUrl, jsonDict)
+            return self.postData(reportUrl, jsonDict)
@@ -4,6 +4,9 @@
 # Purpose:     Data manager class used to provide specific data fetch and process 
 #              functions and init the local data storage/DB. This manager is used 
 #              by the scheduler(<actionScheduler>) obj.
+#              The numeric results are also kept in a tiered in-memory history
+#              (raw 1 hour, 1 min rollups 24 hours, 10 min rollups 7 days) so 
+#              the monitor hub can backfill the gaps after an outage.
 #              
 # Author:      Yuancheng Liu 
 #
@@ -15,11 +18,32 @@
 
 import time
 import json
+from fnmatch import fnmatchcase
 
 from datetime import datetime
 
 import probeGlobal as gv
 import Log
+import metricStats
+
+# metric fields kept in the history, patterns of the flattened result path:
+# '<proberId>.<actionId>.result.<key>.<sub key/list idx>...', a numbers list 
+# matching a pattern is recorded as its mean.
+HISTORY_FIELDS = (
+    '*.result.ping.1',              # ping avg RTT
+    '*.result.*:*.rtt.1',           # peer avg RTT
+    '*.result.*:*.loss',            # peer echo loss
+    '*.result.cpu',                 # total cpu usage (the mean of the per cpu list)
+    '*.result.ram',
+    '*.result.stats.*.mean',        # cpu/ram window stats
+    '*.result.stats.*.max',
+    '*.result.disk.*',              # configured disks usage
+    '*.result.network.connCount',
+    '*.result.process.count',
+    '*.result.process.churn.new',
+    '*.result.process.churn.exited',
+    'overhead.cpu',                 # agent own cpu usage
+)
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
@@ -28,19 +52,71 @@ class DataManager(object):
         handle the data-IO with dataBase and the monitor hub's data fetching/
         changing request.
     """
-    def __init__(self, parent, fetchMode=True) -> None:
+    def __init__(self, parent, fetchMode=True, historyFields=HISTORY_FIELDS) -> None:
         self.parent = parent
         self.terminate = False
         self.fetchMode = fetchMode
         self.reportInterval = 0
         self.lastUpdate = datetime.now()
         self.resultDict = {}
+        self.history = metricStats.tieredHistory()
+        self.historyFields = historyFields
+        self.actTimeDict = {}   # probe action path -> run time of its result last recorded.
     
     #-----------------------------------------------------------------------------
     def archiveResult(self, resultDict):
+        """ Archive the result and add its metric fields in the history, call it
+            once per probe cycle.
+        """
         self.resultDict = resultDict
         gv.gDebugPrint(json.dumps(resultDict), prt=False, logType=gv.LOG_INFO)
+        self.addHistory(resultDict)
         return None
+
+    #-----------------------------------------------------------------------------
+    def _isHistoryField(self, path):
+        return any(fnmatchcase(path, pattern) for pattern in self.historyFields)
+
+    def _flattenResult(self, data, prefix, valDict):
+        """ Flatten the allowed numeric leaves of the result to {'<key1>.<key2>.<idx>': val},
+            the probe actions not executed since the last call are skipped.
+        """
+        isNumber = lambda val: isinstance(val, (int, float)) and not isinstance(val, bool)
+        if isinstance(data, dict):
+            if 'time' in data and 'result' in data:
+                # probe action result {'time':, 'result':}, record it once per run.
+                if self.actTimeDict.get(prefix) == data['time']: return valDict
+                self.actTimeDict[prefix] = data['time']
+            for key, val in data.items():
+                self._flattenResult(val, '%s.%s' %(prefix, key) if prefix else str(key), valDict)
+        elif isinstance(data, (list, tuple)):
+            if data and all(isNumber(val) for val in data) and self._isHistoryField(prefix):
+                valDict[prefix] = sum(data) / len(data)
+                return valDict
+            for idx, val in enumerate(data):
+                self._flattenResult(val, '%s.%d' %(prefix, idx), valDict)
+        elif isNumber(data):
+            if self._isHistoryField(prefix): valDict[prefix] = data
+        return valDict
+
+    def addHistory(self, resultDict, timestamp=None):
+        """ Add the result's metric fields (HISTORY_FIELDS) values in the history."""
+        timestamp = time.time() if timestamp is None else timestamp
+        try:
+            droppedCount = len(self.history.droppedSet)
+            self.history.add(timestamp, self._flattenResult(resultDict, '', {}))
+            if len(self.history.droppedSet) > droppedCount:
+                gv.gDebugPrint("History fields over the limit %d are not recorded: %s" 
+                               %(self.history.maxFields, str(sorted(self.history.droppedSet))), logType=gv.LOG_WARN)
+        except Exception as err:
+            gv.gDebugPrint("Add result history error: %s" %str(err), logType=gv.LOG_EXCEPT)
+
+    def getHistory(self, startT=None, endT=None, fieldList=None, limit=metricStats.HISTORY_MAX_POINTS):
+        """ Get the history of the fields in the time range, refer to 
+            metricStats.tieredHistory.query() for the result format.
+        """
+        if endT is None: endT = time.time()
+        return self.history.query(startT=startT, endT=endT, fieldList=fieldList, limit=limit)
     
     #-----------------------------------------------------------------------------
     def getResultDict(self):
@@ -0,0 +1,133 @@
+#-----------------------------------------------------------------------------
+# Name:        peerProber.py
+#
+# Purpose:     This module is used to measure the east-west network quality
+#              between the cluster nodes: the agent sends timestamped echo
+#              datagrams (udpCom message format) to every peer agent's UDP
+#              server in the roster pushed by the monitor hub, and calculates
+#              the per-peer RTT, jitter and loss.
+#
+# Author:      Yuancheng Liu
+#
+# Version:     v_0.1
+# Created:     2023/04/08
+# Copyright:
+# License:
+#-----------------------------------------------------------------------------
+
+import os
+import time
+import json
+import socket
+import threading
+
+import probeGlobal as gv
+import udpCom
+
+ECHO_COUNT = 5      # echo datagrams sent to each peer per probe round.
+ECHO_TIMEOUT = 1    # sec waiting for the replies after the last echo sent.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class PeerProber(object):
+    """ Send echo request 'GET;echo;{"id":<id>, "seq":<seq>}' to all the peers
+        in one round, the peer agent's commManager replies 'REP;echo;<same json>'
+        and the replies are matched by the prober id + sequence number.
+    """
+    def __init__(self, ownID, count=ECHO_COUNT, timeout=ECHO_TIMEOUT) -> None:
+        self.ownID = ownID
+        self.count = count
+        self.timeout = timeout
+        self.peerList = []      # [(ip, udpPort), ...]
+        self._echoId = os.getpid() & 0xFFFF
+        self._lock = threading.Lock()
+
+#-----------------------------------------------------------------------------
+    def setRoster(self, peerList):
+        """ Set the peers list (the agent itself is excluded).
+            Args:
+                peerList (list): [[ip, udpPort], ...]
+            Returns:
+                int: number of peers will be probed.
+        """
+        rosterList = []
+        for peer in peerList:
+            try:
+                ipAddr, port = str(peer[0]), int(peer[1])
+            except Exception as err:
+                gv.gDebugPrint("Invalid peer in roster: %s" %str(peer), logType=gv.LOG_WARN)
+                continue
+            if ipAddr == str(self.ownID) and port == gv.UDP_PORT: continue
+            rosterList.append((ipAddr, port))
+        with self._lock:
+            self.peerList = rosterList
+        return len(rosterList)
+
+#-----------------------------------------------------------------------------
+    def probePeers(self, target=None):
+        """ Probe all the peers in the roster, can be added as a prober action.
+            Returns:
+                dict: {'target': 'peers',
+                       '<ip>:<port>': {'rtt': [min(ms), avg(ms), max(ms)] or None,
+                                       'jitter': <mean RTT variation(ms)> or None,
+                                       'loss': <lost echo percent 0.0-1.0>}, ...}
+        """
+        with self._lock:
+            peerList = list(self.peerList)
+        resultDict = {'target': 'peers'}
+        if not peerList: return resultDict
+        self._echoId = (self._echoId + 1) & 0xFFFF
+        echoId = self._echoId
+        rttDict = {peer: [None]*self.count for peer in peerList}
+        pendingDict = {}    # seq -> (peer, round idx, send time)
+        echoSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            seq = 0
+            for idx in range(self.count):
+                for peer in peerList:
+                    seq += 1
+                    msg = ';'.join(('GET', 'echo', json.dumps({'id': echoId, 'seq': seq})))
+                    try:
+                        pendingDict[seq] = (peer, idx, time.monotonic())
+                        echoSock.sendto(msg.encode(udpCom.CODE_FMT), peer)
+                    except OSError as err:
+                        pendingDict.pop(seq, None)
+                        gv.gDebugPrint("Echo to peer %s failed: %s" %(str(peer), str(err)), logType=gv.LOG_WARN)
+            deadline = time.monotonic() + self.timeout
+            while pendingDict:
+                remainT = deadline - time.monotonic()
+                if remainT <= 0: break
+                echoSock.settimeout(remainT)
+                try:
+                    data, _ = echoSock.recvfrom(udpCom.BUFFER_SZ)
+                except socket.timeout:
+                    break
+                except OSError:
+                    continue # ICMP port unreachable from a down peer.
+                recvT = time.monotonic()
+                try:
+                    reqKey, reqType, reqJsonStr = data.decode(udpCom.CODE_FMT).split(';', 2)
+                    echoDict = json.loads(reqJsonStr)
+                    if reqKey != 'REP' or reqType != 'echo' or echoDict['id'] != echoId: continue
+                    peer, idx, sendT = pendingDict.pop(echoDict['seq'])
+                except Exception:
+                    continue
+                rttDict[peer][idx] = (recvT - sendT)*1000
+        finally:
+            echoSock.close()
+        for peer, rttList in rttDict.items():
+            resultDict[':'.join((peer[0], str(peer[1])))] = self._summarize(rttList)
+        return resultDict
+
+    def _summarize(self, rttList):
+        """ Calculate the RTT (min, avg, max), jitter (mean of the RTT difference
+            between the consecutive echoes) and loss of a peer.
+        """
+        validList = [rtt for rtt in rttList if rtt is not None]
+        peerDict = {'rtt': None, 'jitter': None, 'loss': 1 - len(validList)/len(rttList)}
+        if validList:
+            peerDict['rtt'] = [min(validList), sum(validList)/len(validList), max(validList)]
+        if len(validList) > 1:
+            diffList = [abs(validList[i] - validList[i-1]) for i in range(1, len(validList))]
+            peerDict['jitter'] = sum(diffList)/len(diffList)
+        return peerDict
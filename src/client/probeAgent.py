@@ -41,38 +41,73 @@ class Prober(object):
         self.target = target
         self.functionCount = 0
         self.probActionDict = OrderedDict()
+        self.adaptiveDict = {}  # actId -> AdaptiveInterval
+        self.nextRunDict = {}   # actId -> next run monotonic time
         self.crtResultDict = {'target': self.target}
         self.timeInterval = timeInterval
         self.terminate = False
 
 #-----------------------------------------------------------------------------
-    def addProbAction(self, probActionRef):
+    def addProbAction(self, probActionRef, adaptive=None):
         """ Add a probAction functino in the prober.    
             Args:
                 probActionRef (_type_): function reference.
+                adaptive (AdaptiveInterval, optional): adaptive run interval of the 
+                    action. Defaults to None (run every agent cycle).
         """
         self.functionCount += 1
         actId = '-'.join((str(self.probId), str(self.functionCount)))
         self.probActionDict[actId] = probActionRef
+        if adaptive: self.adaptiveDict[actId] = adaptive
+        self.nextRunDict[actId] = 0
         self.crtResultDict[actId] = {
             'time': time.time(),
             'result': {} }
 
 #-----------------------------------------------------------------------------
-    def executeProbeAction(self):
+    def executeProbeAction(self, interval=None):
+        """ Execute the probe actions.
+            Args:
+                interval (float, optional): run interval (sec) of the not adaptive 
+                    actions, only the actions due are executed. Defaults to None 
+                    (execute all the actions).
+        """
         if self.terminate: return 
         for probSet in self.probActionDict.items():
             actId, probAct = probSet
+            if interval is not None and self.nextRunDict[actId] > time.monotonic(): continue
+            if gv.iGovernor and not gv.iGovernor.isEnabled(actId):
+                # check again after the (stretched) interval, not in the next second.
+                if interval is not None: self.nextRunDict[actId] = time.monotonic() + interval
+                continue
             gv.gDebugPrint('Execute probe action: %s' %str(actId), logType=gv.LOG_INFO)
             self.crtResultDict[actId]['time'] = time.time()
+            startT = gv.iGovernor.startProbe() if gv.iGovernor else None
             try:
                 rst = probAct(self.target)
-                if isinstance(rst, dict): self.crtResultDict[actId]['result'].update(rst)
+                # replace the last result so the keys gone (such as the peers left the roster) are not kept.
+                if isinstance(rst, dict): self.crtResultDict[actId]['result'] = rst
             except Exception as err:
                 Log.exception(err)
                 self.crtResultDict[actId]['result'] = None
+            if gv.iGovernor: gv.iGovernor.endProbe(actId, startT)
+            if interval is not None:
+                actInterval = interval
+                if actId in self.adaptiveDict:
+                    actInterval = self.adaptiveDict[actId].update(self.crtResultDict[actId]['result'], actId=actId)
+                    if gv.iGovernor: actInterval = gv.iGovernor.getInterval(actInterval)
+                self.nextRunDict[actId] = time.monotonic() + actInterval
             if self.timeInterval > 0: time.sleep(self.timeInterval)
 
+#-----------------------------------------------------------------------------
+    def getNextRunTime(self):
+        """ Return the monotonic time the first enabled action will be due, None 
+            if no action.
+        """
+        nextRunList = [nextRun for actId, nextRun in self.nextRunDict.items() 
+                       if not gv.iGovernor or gv.iGovernor.isEnabled(actId)]
+        return min(nextRunList) if nextRunList else None
+
 #-----------------------------------------------------------------------------
     def getResult(self):
         """ Return all the probeAction executed result. Example of result dict:
@@ -113,10 +148,14 @@ class ProbeAgent(object):
 #-----------------------------------------------------------------------------
     def executeProbers(self):
         if self.terminate: return 
+        interval = gv.iGovernor.getInterval(self.timeInterval) if gv.iGovernor else self.timeInterval
         for proberSet in self.proberDict.items():
             pId, prober = proberSet
-            prober.executeProbeAction()
+            prober.executeProbeAction(interval=interval)
             self.crtResultDict[pId] = prober.getResult()
+        if gv.iGovernor:
+            gv.iGovernor.evaluate()
+            self.crtResultDict['overhead'] = gv.iGovernor.getReport()
         gv.iDataMgr.archiveResult(self.crtResultDict)
 
 #-----------------------------------------------------------------------------     
@@ -135,7 +174,15 @@ class ProbeAgent(object):
                     with open(testFile, 'r') as f:
                         data = json.load(f)
                         gv.iDataMgr.archiveResult(data)
-                else:
-                    gv.iDataMgr.archiveResult(self.crtResultDict)
-                #gv.iCommMgr.reportTohub(gv.iDataMgr.getResultDict(), udpMode=False)
-            time.sleep(self.timeInterval)
+                # the probers' result is archived (once per cycle) by executeProbers().
+                if gv.iReportFwd: gv.iCommMgr.reportTohub(gv.iDataMgr.getResultDict(), udpMode=False)
+            time.sleep(self._getSleepTime())
+
+#-----------------------------------------------------------------------------
+    def _getSleepTime(self):
+        """ Sleep till the first probe action due (min 1 sec, max the cycle interval)."""
+        interval = gv.iGovernor.getInterval(self.timeInterval) if gv.iGovernor else self.timeInterval
+        nextRunList = [prober.getNextRunTime() for prober in self.proberDict.values()]
+        nextRunList = [nextRun for nextRun in nextRunList if nextRun is not None]
+        if not nextRunList: return interval
+        return min(interval, max(1, min(nextRunList) - time.monotonic()))
@@ -82,6 +82,13 @@ gOwnID = gGetConfigVal('OWN_ID', defaultVal='localhost')
 gTestMode = gGetConfigVal('Test_Mode', defaultVal=False)
 gTimeInterval = int(gGetConfigVal('TIME_INV', defaultVal=60))
 gBgctrl = gGetConfigVal('BG_CTRL', defaultVal=False)
+gCpuBudget = float(gGetConfigVal('CPU_BUDGET', defaultVal=1.0)) # agent cpu budget (percent of one core)
+gMonitorHubAddr = {'ipaddr': gGetConfigVal('Hub_Addr', defaultVal='127.0.0.1'),
+                   'httpPort': int(gGetConfigVal('Hub_Http_Port', defaultVal=5000)),
+                   'udpPort': int(gGetConfigVal('Hub_Udp_Port', defaultVal=3001))}
+gHubReport = gGetConfigVal('HUB_REPORT', defaultVal=False) # report the results to the hub.
+gSpoolDir = os.path.join(dirpath, gGetConfigVal('SPOOL_DIR', defaultVal='Spool'))
+gSpoolMaxSz = int(gGetConfigVal('SPOOL_MAX_MB', defaultVal=64))*1024*1024
 
 #-------<GLOBAL INSTANCES (start with "i")>-------------------------------------
 iCommMgr = None
@@ -89,4 +96,8 @@ iBgctrler = None
 iDataMgr = None
 iPortScanner = None
 iNetProbeDriver = None
-iLocalProbeDriver= None
\ No newline at end of file
+iLocalProbeDriver= None
+iPeerProber = None
+iBwTester = None
+iGovernor = None
+iReportFwd = None
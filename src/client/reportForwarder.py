@@ -0,0 +1,141 @@
+#-----------------------------------------------------------------------------
+# Name:        reportForwarder.py
+#
+# Purpose:     This module provides the store and forward of the agent reports
+#              to the monitor hub. The probe loop only puts the report in an
+#              in-memory queue, the forwarder thread:
+#              1. Appends the queued reports in the on-disk spool (reportSpool).
+#              2. Sends the not acknowledged reports from the replay cursor in
+#                 batches, rate-limited so a recovered hub is not flooded.
+#              3. Backs off (doubled till BACKOFF_MAX) if the hub is not
+#                 reachable, the reports stay in the spool. A report which can
+#                 never be sent (broken record/content) is dropped and logged.
+#
+# Author:      Yuancheng Liu
+#
+# Version:     v_0.1
+# Created:     2023/04/21
+# Copyright:   n.a
+# License:     n.a
+#-----------------------------------------------------------------------------
+
+import json
+import time
+import threading
+from collections import deque
+
+import probeGlobal as gv
+import reportSpool
+
+QUEUE_MAX = 1000        # max reports waiting to be spooled (the oldest dropped).
+BATCH_SZ = 20           # max reports sent in one batch.
+RESEND_RATE = 10        # max reports sent per sec.
+BACKOFF_MIN = 1         # retry interval (sec) after a send failure
+BACKOFF_MAX = 60        # doubled till this limit.
+MODE_UDP = b'U'
+MODE_HTTP = b'H'
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class ReportForwarder(threading.Thread):
+    """ Spool the reports and forward them to the hub by the send function.
+        Example:
+            forwarder = ReportForwarder(spoolDir, sendFunc=lambda jsonDict, udpMode: <True if acknowledged>)
+            forwarder.start()
+            forwarder.put(resultDict, udpMode=False) # return at once.
+    """
+    def __init__(self, spoolDir, sendFunc, maxSize=reportSpool.SPOOL_MAX_SZ,
+                 rate=RESEND_RATE, batchSize=BATCH_SZ) -> None:
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sendFunc = sendFunc
+        self.rate = float(rate)
+        self.batchSize = batchSize
+        self.spool = reportSpool.reportSpool(spoolDir, maxSize=maxSize,
+            debugPrint=lambda msg: gv.gDebugPrint(msg, logType=gv.LOG_WARN))
+        self.queue = deque()
+        self.dropCount = 0
+        self.sentCount = 0
+        self.backoff = 0
+        self.nextSendT = 0
+        self.terminate = False
+        self._event = threading.Event()
+
+    #-----------------------------------------------------------------------------
+    def put(self, jsonDict, udpMode=True):
+        """ Queue a report to be spooled and sent (not blocking), the report is 
+            serialized here as the caller may change the dict after.
+        """
+        if len(self.queue) >= QUEUE_MAX:
+            self.queue.popleft()
+            self.dropCount += 1
+        self.queue.append((MODE_UDP if udpMode else MODE_HTTP) + json.dumps(jsonDict).encode('utf-8'))
+        self._event.set()
+
+    #-----------------------------------------------------------------------------
+    def run(self):
+        """ Thread run() function will be called by start(). """
+        gv.gDebugPrint("Report forwarder started, pending %d bytes." %self.spool.getPendingSize(),
+                       logType=gv.LOG_INFO)
+        while not self.terminate:
+            self._event.wait(timeout=min(reportSpool.FSYNC_INV, max(0, self.nextSendT - time.monotonic())))
+            self._event.clear()
+            try:
+                self._spoolQueue()
+                self.spool.sync()
+                if time.monotonic() >= self.nextSendT: self._forward()
+            except Exception as err:
+                gv.gDebugPrint("Report forwarder error: %s" %str(err), logType=gv.LOG_EXCEPT)
+                self.nextSendT = time.monotonic() + BACKOFF_MAX
+        self._spoolQueue()
+        self.spool.close()
+
+    def _spoolQueue(self):
+        while self.queue: self.spool.append(self.queue.popleft())
+
+    def _forward(self):
+        """ Send a batch from the replay cursor, move the cursor after the
+            acknowledged reports.
+        """
+        recordList = self.spool.readBatch(self.batchSize)
+        if not recordList:
+            self.nextSendT = time.monotonic() + reportSpool.FSYNC_INV
+            return
+        ackCursor = None
+        for cursor, data in recordList:
+            try:
+                ackFlg = self.sendFunc(json.loads(data[1:].decode('utf-8')), data[:1] == MODE_UDP)
+                if ackFlg: self.sentCount += 1
+            except OSError as err:
+                # transport failure, keep the report and retry after the back off.
+                gv.gDebugPrint("Send the spooled report error: %s" %str(err), logType=gv.LOG_WARN)
+                ackFlg = False
+            except Exception as err:
+                # the report can never be sent (broken record, missing key ...), drop it.
+                gv.gDebugPrint("Drop the spooled report can not be sent: %s" %repr(err), logType=gv.LOG_ERR)
+                self.dropCount += 1
+                ackFlg = True
+            if not ackFlg: break
+            ackCursor = cursor
+        if ackCursor: self.spool.commit(ackCursor)
+        now = time.monotonic()
+        if ackCursor == recordList[-1][0]:
+            self.backoff = 0
+            # rate limit: the next batch after the time this one is allowed to take.
+            self.nextSendT = now + len(recordList) / self.rate
+        else:
+            self.backoff = min(BACKOFF_MAX, self.backoff * 2) if self.backoff else BACKOFF_MIN
+            self.nextSendT = now + self.backoff
+            gv.gDebugPrint("Hub not acknowledged the report, retry after %d sec." %self.backoff,
+                           logType=gv.LOG_WARN)
+
+    #-----------------------------------------------------------------------------
+    def getState(self):
+        stateDict = self.spool.getState()
+        stateDict.update({'queued': len(self.queue), 'dropped': self.dropCount,
+                          'sent': self.sentCount, 'backoff': self.backoff})
+        return stateDict
+
+    def stop(self):
+        self.terminate = True
+        self._event.set()
@@ -0,0 +1,258 @@
+#-----------------------------------------------------------------------------
+# Name:        dirWatcher.py
+#
+# Purpose:     This module keeps an in-memory index of the watched directories'
+#              entries and reports the entries added/removed since the last
+#              report with the entries count and a content hash, so the agent
+#              does not list the whole directory every probe cycle.
+#              - Linux: the directory changes are read from inotify (by ctypes).
+#              - Other platforms or the file systems inotify not work (such as
+#                a NFS mount changed by other hosts): os.scandir() polling.
+#
+# Author:      Yuancheng Liu
+#
+# Version:     v_0.1
+# Created:     2023/04/16
+# Copyright:   n.a
+# License:     n.a
+#-----------------------------------------------------------------------------
+
+import os
+import errno
+import struct
+import hashlib
+import threading
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# inotify flags (linux/inotify.h)
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER_FMT = 'iIII'   # wd, mask, cookie, name length
+EVENT_BUF_SZ = 64*1024
+MODE_INOTIFY = 'inotify'
+MODE_POLL = 'poll'
+
+#-----------------------------------------------------------------------------
+def getNameHash(name):
+    """ 64 bits hash of an entry name, the directory content hash is the XOR of
+        all the entries' hashes so it is updated in O(1) per added/removed entry.
+    """
+    return int.from_bytes(hashlib.blake2b(name.encode('utf-8', 'surrogateescape'), digest_size=8).digest(), 'big')
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class dirIndex(object):
+    """ Entries index of one directory with the changes not reported yet."""
+    def __init__(self, path, mode) -> None:
+        self.path = path
+        self.mode = mode
+        self.wd = None          # inotify watch descriptor
+        self.entrySet = None    # None if the directory does not exist.
+        self.contentHash = 0
+        self.addedSet = set()
+        self.removedSet = set()
+
+    def reset(self, entrySet):
+        """ Set the baseline entries (no change reported)."""
+        self.entrySet = set(entrySet)
+        self.contentHash = 0
+        for name in self.entrySet: self.contentHash ^= getNameHash(name)
+        self.addedSet.clear()
+        self.removedSet.clear()
+
+    def add(self, name):
+        if name in self.entrySet: return
+        self.entrySet.add(name)
+        self.contentHash ^= getNameHash(name)
+        if name in self.removedSet:
+            self.removedSet.discard(name)
+        else:
+            self.addedSet.add(name)
+
+    def remove(self, name):
+        if name not in self.entrySet: return
+        self.entrySet.discard(name)
+        self.contentHash ^= getNameHash(name)
+        if name in self.addedSet:
+            self.addedSet.discard(name)
+        else:
+            self.removedSet.add(name)
+
+    def sync(self, entrySet):
+        """ Apply the difference between the index and the scanned entries."""
+        for name in entrySet - self.entrySet: self.add(name)
+        for name in self.entrySet - entrySet: self.remove(name)
+
+    def getReport(self, fullFlg=False):
+        """ Returns:
+                dict: {'mode':, 'count':, 'hash':, 'added': [...], 'removed': [...],
+                       'files': [...] only if fullFlg}
+        """
+        reportDict = {'mode': self.mode,
+                      'count': len(self.entrySet),
+                      'hash': '%016x' %self.contentHash,
+                      'added': sorted(self.addedSet),
+                      'removed': sorted(self.removedSet)}
+        if fullFlg: reportDict['files'] = sorted(self.entrySet)
+        self.addedSet.clear()
+        self.removedSet.clear()
+        return reportDict
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class dirWatcher(object):
+    """ Watch a list of directories, the inotify events are read (non-blocking)
+        when the report is requested, no background thread is needed.
+        Example:
+            watcher = dirWatcher()
+            watcher.getReport(['/tmp']) -> first call builds the index: {'/tmp': {'count': 10, 'added': [], ...}}
+            watcher.getReport(['/tmp']) -> {'/tmp': {'count': 11, 'added': ['new.txt'], 'removed': [], ...}}
+    """
+    def __init__(self, debugPrint=None) -> None:
+        self.indexDict = {}     # path -> dirIndex
+        self.wdDict = {}        # watch descriptor -> dirIndex
+        self._debugPrint = debugPrint if debugPrint else print
+        self._lock = threading.Lock()
+        self._libc = None
+        self._inotifyFd = None
+        self._initInotify()
+
+    def _initInotify(self):
+        if ctypes is None or not hasattr(os, 'uname') or os.uname().sysname != 'Linux': return
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0: raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+            self._inotifyFd = fd
+        except (OSError, AttributeError) as err:
+            self._debugPrint("inotify not available, use scandir polling: %s" %str(err))
+            self._libc = self._inotifyFd = None
+
+    def close(self):
+        if self._inotifyFd is not None:
+            os.close(self._inotifyFd)
+            self._inotifyFd = None
+
+#-----------------------------------------------------------------------------
+    def _scanDir(self, path):
+        with os.scandir(path) as entries:
+            return set(entry.name for entry in entries)
+
+    def _addWatch(self, index):
+        """ Add the inotify watch of the directory, return False if failed."""
+        if self._inotifyFd is None: return False
+        wd = self._libc.inotify_add_watch(self._inotifyFd, os.fsencode(index.path), WATCH_MASK)
+        if wd < 0:
+            self._debugPrint("inotify watch [%s] failed, use scandir polling: %s"
+                             %(index.path, os.strerror(ctypes.get_errno())))
+            return False
+        if wd in self.wdDict and self.wdDict[wd] is not index:
+            return False    # same directory watched by another path, poll this one.
+        index.wd = wd
+        self.wdDict[wd] = index
+        return True
+
+    def _openIndex(self, index):
+        """ (Re)build the index baseline of an existing directory."""
+        if index.mode == MODE_INOTIFY and index.wd is None and not self._addWatch(index):
+            index.mode = MODE_POLL
+        # watch first then scan, the entries changed in between are in both.
+        index.reset(self._scanDir(index.path))
+
+    def _readEvents(self):
+        """ Read all the queued inotify events and update the indexes."""
+        while True:
+            try:
+                data = os.read(self._inotifyFd, EVENT_BUF_SZ)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK): return
+                raise
+            if not data: return
+            headerSz = struct.calcsize(EVENT_HEADER_FMT)
+            pos = 0
+            while pos + headerSz <= len(data):
+                wd, mask, _, nameLen = struct.unpack_from(EVENT_HEADER_FMT, data, pos)
+                name = os.fsdecode(data[pos + headerSz:pos + headerSz + nameLen].rstrip(b'\0'))
+                pos += headerSz + nameLen
+                if mask & IN_Q_OVERFLOW:
+                    # events lost, sync all the indexes by scanning.
+                    for index in self.indexDict.values(): self._syncIndex(index)
+                    continue
+                index = self.wdDict.get(wd)
+                if index is None or index.entrySet is None: continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    index.add(name)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    index.remove(name)
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    self._closeWatch(index)
+
+    def _closeWatch(self, index):
+        """ The watched directory is removed/moved, drop the watch and rebuild
+            the index when the path exists again.
+        """
+        if index.wd is not None:
+            self.wdDict.pop(index.wd, None)
+            if self._inotifyFd is not None: self._libc.inotify_rm_watch(self._inotifyFd, index.wd)
+            index.wd = None
+        index.entrySet = None
+
+    def _syncIndex(self, index):
+        if index.entrySet is None: return
+        try:
+            index.sync(self._scanDir(index.path))
+        except OSError:
+            self._closeWatch(index)
+
+#-----------------------------------------------------------------------------
+    def getReport(self, pathList, fullFlg=False, pollFlg=False):
+        """ Get the changes of the directories since the last report.
+            Args:
+                pathList (list): directory paths.
+                fullFlg (bool, optional): add the full entries list. Defaults to False.
+                pollFlg (bool, optional): force scandir polling for the new
+                    watched directories. Defaults to False.
+            Returns:
+                dict: {'<path>': {'mode':, 'count':, 'hash':, 'added': [...], 'removed': [...]}
+                       or None if the directory not exists, ...}
+                The first report of a directory is the baseline (nothing added),
+                the directories not in the pathList are not watched any more.
+        """
+        resultDict = {}
+        with self._lock:
+            if self._inotifyFd is not None: self._readEvents()
+            for path in pathList:
+                index = self.indexDict.get(path)
+                if index is None:
+                    mode = MODE_POLL if pollFlg or self._inotifyFd is None else MODE_INOTIFY
+                    index = self.indexDict[path] = dirIndex(path, mode)
+                resultDict[path] = None
+                try:
+                    if index.entrySet is None:
+                        if not os.path.isdir(path): continue
+                        self._openIndex(index)
+                    elif index.mode == MODE_POLL:
+                        index.sync(self._scanDir(path))
+                    resultDict[path] = index.getReport(fullFlg=fullFlg)
+                except OSError as err:
+                    self._debugPrint("Error to watch dir [%s] : %s" %(path, err))
+                    self._closeWatch(index)
+            # drop the watches of the directories not requested any more.
+            for path in self.indexDict.keys() - set(pathList):
+                self._closeWatch(self.indexDict.pop(path))
+        return resultDict
@@ -2,21 +2,75 @@
 # Name:        localServiceProber.py
 #
 # Purpose:     This module is a untility module of the lib <python- psutil> to 
-#              provide some extend function. 
+#              provide some extend function. The CPU usage is calculated from the
+#              time counters read by a background sampler thread, so the probe 
+#              never blocks to measure it. The sampler also records the cheap 
+#              metrics (cpu, ram) at ~1Hz in ring buffers and each report carries 
+#              the min/mean/max/p95 of the report window. On linux the memory usage
+#              and the connections count are parsed from /proc directly (psutil 
+#              is used as fallback). The process table is tracked incrementally,
+#              only the new and exited PIDs are processed every cycle, and the 
+#              top N CPU/RSS consumers are selected from the cached processes.
+#              The directories are watched by <dirWatcher> (inotify) and only 
+#              the changed entries are reported. The network interfaces and disks
+#              I/O counters are also read by the background sampler and reported
+#              as the rates of the report window. The cgroup v2 groups (containers,
+#              systemd slices) resource usage is read from the cgroupfs. The 
+#              slow-changing fields are cached in a per field TTL registry.
 #              psutil doc link: https://psutil.readthedocs.io/en/latest/#system-related-functions
 #
 # Author:      Yuancheng Liu
 #
-# Version:     v_0.1.1
+# Version:     v_0.1.2
 # Created:     2023/03/14
 # Copyright:   n.a
 # License:     n.a
 #-----------------------------------------------------------------------------
 
 import os 
+import re
+import glob
 import time
+import heapq
+import socket
+import threading
+from collections import deque, Counter
+
 import psutil
 
+from metricStats import ringBuffer, summarize, getCounterDelta
+from dirWatcher import dirWatcher
+
+SAMPLE_INV = 1          # sec interval the background sampler reads the counters.
+SAMPLE_HISTORY_SZ = 3600 # number of counter samples kept (1 hour with 1 sec interval).
+CPU_MIN_WINDOW = 0.5     # min sec of a cpu usage window.
+SAMPLE_METRICS = ('cpu', 'ram') # metrics recorded in the ring buffers every sample.
+PROC_BUF_SZ = 64*1024   # initial size of the reused /proc file read buffer.
+PROC_NET_FILES = ('tcp', 'tcp6', 'udp', 'udp6')
+# socket state code in /proc/net/<proto> (include/net/tcp_states.h).
+CONN_STATES = {b'01': 'ESTABLISHED', b'02': 'SYN_SENT', b'03': 'SYN_RECV', b'04': 'FIN_WAIT1', 
+               b'05': 'FIN_WAIT2', b'06': 'TIME_WAIT', b'07': 'CLOSE', b'08': 'CLOSE_WAIT', 
+               b'09': 'LAST_ACK', b'0A': 'LISTEN', b'0B': 'CLOSING', b'0C': 'NEW_SYN_RECV'}
+PSUTIL_STATES = {'NONE': 'CLOSE', 'SYN_RECV': 'SYN_RECV'} # psutil status name -> CONN_STATES name
+CONN_STATE_RE = re.compile(rb'^ *\d+: [0-9A-F]+:[0-9A-F]{4} [0-9A-F]+:[0-9A-F]{4} ([0-9A-F]{2}) ', re.M)
+NET_IO_FIELDS = ('rxBytes', 'rxPackets', 'rxErrs', 'rxDrop', 'txBytes', 'txPackets', 'txErrs', 'txDrop')
+DISK_IO_FIELDS = ('reads', 'readBytes', 'writes', 'writeBytes', 'busyTime')
+DISK_SECTOR_SZ = 512    # /proc/diskstats sectors are always 512 bytes.
+DISK_SKIP_PREFIX = ('loop', 'ram')
+CGROUP_ROOT = '/sys/fs/cgroup'
+CGROUP_FILES = ('cpu.stat', 'memory.current', 'io.stat', 'pids.current')
+CGROUP_RESCAN_INV = 60  # sec interval to expand the cgroup glob patterns again.
+CGROUP_BUF_SZ = 4096
+# sec a result field is cached by updateResUsage(), the fields not listed are updated every call
+# ('process' is not cached by default so a dead process is reported at once, set its TTL by 
+# the config key 'ttl' if needed).
+METRIC_TTL = {'user': 300, 'disk': 300, 'network': 10}
+RES_FIELDS = ('cpu', 'ram', 'user', 'disk', 'stats', 'netio', 'diskio', 'cgroup', 'network')
+FIELD_OPTIONS = {'dir': ('dirFull', 'dirPoll')} # extra config keys used by a field.
+BASE_FIELDS = ('process', 'dir')   # fields always in the result ({} if not configured).
+PROC_TOP_N = 5          # default number of the top resource consumer processes reported.
+MEMINFO_RE = re.compile(rb'^(MemTotal|MemAvailable):\s+(\d+)', re.M)
+
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class Prober(object):
@@ -42,6 +96,619 @@ class Prober(object):
         elif logType == self._logInfo:
             self._debugLogger.info(msg)
 
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class procFileReader(object):
+    """ Keep a /proc (or /sys) file opened and read the whole content by pread 
+        into a reused buffer (grown when the file is bigger), no file open, seek
+        and buffer allocation per read.
+    """
+    def __init__(self, path, bufSz=PROC_BUF_SZ) -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buf = bytearray(bufSz)
+
+    def read(self):
+        """ Returns:
+                memoryview: the file content, valid till the next read().
+        """
+        pos = 0
+        while True:
+            if pos == len(self.buf): self.buf = self.buf + bytes(len(self.buf))
+            count = os.preadv(self.fd, [memoryview(self.buf)[pos:]], pos)
+            if count == 0: break
+            pos += count
+        return memoryview(self.buf)[:pos]
+
+    def close(self):
+        os.close(self.fd)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class procCollector(object):
+    """ Fast collectors parse the /proc files directly instead of building the 
+        psutil objects (psutil.net_connections() creates an object per socket 
+        and maps the inodes to the pids), psutil is used if /proc is not available.
+        One collector should only be used by one thread (the readers share the 
+        file offset).
+    """
+    def __init__(self) -> None:
+        self.connReaders = {}
+        self.memReader = None
+        try:
+            for proto in PROC_NET_FILES:
+                path = os.path.join('/proc/net', proto)
+                if os.path.exists(path): self.connReaders[proto] = procFileReader(path)
+            self.memReader = procFileReader('/proc/meminfo')
+        except OSError:
+            self.memReader = None
+        self.netDevReader = self._openReader('/proc/net/dev')
+        self.diskStatsReader = self._openReader('/proc/diskstats')
+
+    def _openReader(self, path):
+        try:
+            return procFileReader(path) if os.path.exists(path) else None
+        except OSError:
+            return None
+
+    def getMemPercent(self):
+        """ Get the used ram percent, calculated same as psutil: (total - available)/total."""
+        if self.memReader:
+            memDict = dict(MEMINFO_RE.findall(self.memReader.read()))
+            if b'MemTotal' in memDict and b'MemAvailable' in memDict:
+                total, avail = int(memDict[b'MemTotal']), int(memDict[b'MemAvailable'])
+                return round((total - avail) / total * 100, 1) if total else 0.0
+        return psutil.virtual_memory().percent
+
+    def getConnStates(self):
+        """ Count the inet sockets by protocol and state.
+            Returns:
+                dict: {'connCount': <total sockets>, 
+                       'tcp': {'<state>': <count>, ...}, 'udp': {'<state>': <count>, ...}}
+        """
+        if not self.connReaders: return self._getConnStatesPsutil()
+        resultDict = {'connCount': 0, 'tcp': Counter(), 'udp': Counter()}
+        for proto, reader in self.connReaders.items():
+            stateCounter = Counter(CONN_STATE_RE.findall(reader.read()))
+            protoCounter = resultDict['udp' if proto.startswith('udp') else 'tcp']
+            for code, count in stateCounter.items():
+                protoCounter[CONN_STATES.get(code, code.decode())] += count
+                resultDict['connCount'] += count
+        resultDict['tcp'], resultDict['udp'] = dict(resultDict['tcp']), dict(resultDict['udp'])
+        return resultDict
+
+    def _getConnStatesPsutil(self):
+        resultDict = {'connCount': 0, 'tcp': Counter(), 'udp': Counter()}
+        for conn in psutil.net_connections(kind='inet'):
+            protoKey = 'udp' if conn.type == socket.SOCK_DGRAM else 'tcp'
+            state = PSUTIL_STATES.get(conn.status, conn.status)
+            # psutil reports the udp sockets state as NONE, use the remote address as /proc.
+            if protoKey == 'udp': state = 'ESTABLISHED' if conn.raddr else 'CLOSE'
+            resultDict[protoKey][state] += 1
+            resultDict['connCount'] += 1
+        resultDict['tcp'], resultDict['udp'] = dict(resultDict['tcp']), dict(resultDict['udp'])
+        return resultDict
+
+    def getNetCounters(self):
+        """ Read the network interfaces' raw I/O counters.
+            Returns:
+                dict: {'<interface>': (<counter of NET_IO_FIELDS>, ...), ...}
+        """
+        resultDict = {}
+        if self.netDevReader is None:
+            for nic, counters in psutil.net_io_counters(pernic=True).items():
+                resultDict[nic] = (counters.bytes_recv, counters.packets_recv, counters.errin, counters.dropin,
+                                   counters.bytes_sent, counters.packets_sent, counters.errout, counters.dropout)
+            return resultDict
+        for line in bytes(self.netDevReader.read()).split(b'\n')[2:]:
+            nic, sep, data = line.partition(b':')
+            if not sep: continue
+            fieldList = data.split()
+            # rx: bytes packets errs drop fifo frame compressed multicast, tx: bytes packets errs drop ...
+            resultDict[nic.strip().decode()] = tuple(int(fieldList[idx]) for idx in (0, 1, 2, 3, 8, 9, 10, 11))
+        return resultDict
+
+    def getDiskCounters(self):
+        """ Read the disks' raw I/O counters (the loop and ram devices are skipped).
+            Returns:
+                dict: {'<disk>': (<counter of DISK_IO_FIELDS>, ...), ...}
+        """
+        resultDict = {}
+        if self.diskStatsReader is None:
+            for disk, counters in psutil.disk_io_counters(perdisk=True).items():
+                if disk.startswith(DISK_SKIP_PREFIX): continue
+                resultDict[disk] = (counters.read_count, counters.read_bytes, counters.write_count, 
+                                    counters.write_bytes, getattr(counters, 'busy_time', 0))
+            return resultDict
+        for line in bytes(self.diskStatsReader.read()).split(b'\n'):
+            fieldList = line.split()
+            if len(fieldList) < 14: continue
+            disk = fieldList[2].decode()
+            if disk.startswith(DISK_SKIP_PREFIX): continue
+            # reads, sectors read, writes, sectors written, io ticks(ms)
+            resultDict[disk] = (int(fieldList[3]), int(fieldList[5]) * DISK_SECTOR_SZ, int(fieldList[7]),
+                                int(fieldList[9]) * DISK_SECTOR_SZ, int(fieldList[12]))
+        return resultDict
+
+    def close(self):
+        for reader in self.connReaders.values(): reader.close()
+        for reader in (self.memReader, self.netDevReader, self.diskStatsReader):
+            if reader: reader.close()
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class cgroupCollector(object):
+    """ Read the cgroup v2 groups' cpu.stat, memory.current, io.stat and pids.current
+        with the kept opened files, the cpu usage and io rates are calculated 
+        from the counters increase since the last collect() call.
+        Example:
+            collector = cgroupCollector()
+            collector.collect(['system.slice/*.service', 'docker/*'])
+    """
+    def __init__(self, root=CGROUP_ROOT) -> None:
+        self.root = root
+        self.readerDict = {}    # cgroup path -> {'<file>': procFileReader}
+        self.lastDict = {}      # cgroup path -> (monotonic time, {'usage':, 'throttled':, 'rbytes':, ...})
+        self._expandDict = {}   # pattern -> (expand time, [cgroup path])
+
+    def _expand(self, pattern):
+        """ Expand a cgroup path/glob pattern (relative to the root), the result
+            is cached for CGROUP_RESCAN_INV sec.
+        """
+        now = time.monotonic()
+        expandT, pathList = self._expandDict.get(pattern, (None, None))
+        if expandT is None or now - expandT > CGROUP_RESCAN_INV:
+            pathList = sorted(path for path in glob.glob(os.path.join(self.root, pattern.lstrip('/')))
+                              if os.path.isdir(path))
+            self._expandDict[pattern] = (now, pathList)
+        return pathList
+
+    def _getReaders(self, path):
+        if path not in self.readerDict:
+            readers = {}
+            for fileName in CGROUP_FILES:
+                try:
+                    readers[fileName] = procFileReader(os.path.join(path, fileName), bufSz=CGROUP_BUF_SZ)
+                except OSError:
+                    pass    # controller not enabled in this group.
+            self.readerDict[path] = readers
+        return self.readerDict[path]
+
+    def _closePath(self, path):
+        for reader in self.readerDict.pop(path, {}).values(): reader.close()
+        self.lastDict.pop(path, None)
+
+    def _readCounters(self, readers):
+        """ Returns:
+                dict: {'usage': <cpu usec>, 'throttled': <usec>, 'mem': <bytes>, 'pids': <int>,
+                       'rbytes':, 'wbytes':, 'rios':, 'wios': <sum of all devices>}
+        """
+        counterDict = {}
+        if 'cpu.stat' in readers:
+            for line in bytes(readers['cpu.stat'].read()).split(b'\n'):
+                key, _, val = line.partition(b' ')
+                if key == b'usage_usec': counterDict['usage'] = int(val)
+                elif key == b'throttled_usec': counterDict['throttled'] = int(val)
+        if 'memory.current' in readers: counterDict['mem'] = int(bytes(readers['memory.current'].read()))
+        if 'pids.current' in readers: counterDict['pids'] = int(bytes(readers['pids.current'].read()))
+        if 'io.stat' in readers:
+            ioDict = {'rbytes': 0, 'wbytes': 0, 'rios': 0, 'wios': 0}
+            # line: '<major>:<minor> rbytes=<n> wbytes=<n> rios=<n> wios=<n> dbytes=<n> dios=<n>'
+            for line in bytes(readers['io.stat'].read()).split(b'\n'):
+                for item in line.split()[1:]:
+                    key, _, val = item.partition(b'=')
+                    key = key.decode()
+                    if key in ioDict: ioDict[key] += int(val)
+            counterDict.update(ioDict)
+        return counterDict
+
+    def collect(self, patternList):
+        """ Collect the resource usage of the cgroups matched the patterns.
+            Returns:
+                dict: {'<cgroup path relative to root>': {'cpu': <percent, 100 = one core>, 
+                        'throttled': <throttled percent>, 'mem': <bytes>, 'pids': <int>, 
+                        'readBps':, 'writeBps':, 'readIops':, 'writeIops':}, ...}
+                      The rates are None at the first collect of a group.
+        """
+        resultDict = {}
+        pathSet = set()
+        for pattern in patternList: pathSet.update(self._expand(pattern))
+        for path in list(self.readerDict.keys()):
+            if path not in pathSet: self._closePath(path)
+        for path in sorted(pathSet):
+            try:
+                counterDict = self._readCounters(self._getReaders(path))
+            except (OSError, ValueError):
+                self._closePath(path)   # the group is removed.
+                continue
+            now = time.monotonic()
+            lastT, lastDict = self.lastDict.get(path, (None, {}))
+            self.lastDict[path] = (now, counterDict)
+            groupDict = {'mem': counterDict.get('mem'), 'pids': counterDict.get('pids')}
+            elapsed = now - lastT if lastT else 0
+            for resKey, counterKey, scale in (('cpu', 'usage', 1e-4), ('throttled', 'throttled', 1e-4),
+                                              ('readBps', 'rbytes', 1), ('writeBps', 'wbytes', 1),
+                                              ('readIops', 'rios', 1), ('writeIops', 'wios', 1)):
+                groupDict[resKey] = None
+                if elapsed > 0 and counterKey in counterDict and counterKey in lastDict:
+                    # usec/sec*1e-4 = percent.
+                    groupDict[resKey] = max(0, counterDict[counterKey] - lastDict[counterKey]) * scale / elapsed
+            resultDict[os.path.relpath(path, self.root)] = groupDict
+        return resultDict
+
+    def close(self):
+        for path in list(self.readerDict.keys()): self._closePath(path)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class processTracker(object):
+    """ PID indexed process cache, every update() only reads the info of the 
+        PIDs appeared since the last update and drops the exited ones, so the 
+        cost is proportional to the process churn instead of the table size.
+        Example:
+            tracker = processTracker()
+            tracker.update() -> {'new': <count>, 'exited': <count>}
+            tracker.getByNames(['python']) -> {'python': [{'pid':, 'name':, 'username':}, ...]}
+    """
+    def __init__(self) -> None:
+        self.procDict = {}      # pid -> psutil.Process
+        self.infoDict = {}      # pid -> {'pid':, 'name':, 'username':}
+        self.nameIndex = {}     # lower case name -> set(pid)
+        self.churnDict = {'new': 0, 'exited': 0, 'totalNew': 0, 'totalExited': 0}
+        self._filterCache = {}  # filter name tuple -> frozenset of lower case names
+        self._recentSet = set() # pids added in the last update
+        self._baselineFlg = False   # the first update() loaded the existing processes.
+        self.statDict = {}      # pid -> (monotonic time, cpu time(sec), rss(bytes)) of the last getTopN()
+        self._procStatFlg = os.path.exists('/proc/self/stat')
+        self._clockTicks = os.sysconf('SC_CLK_TCK') if self._procStatFlg else 100
+        self._pageSz = os.sysconf('SC_PAGE_SIZE') if self._procStatFlg else 4096
+
+    def update(self):
+        """ Sync the cache with the current pids, the first call loads the 
+            existing processes as the baseline and reports no churn.
+            Returns:
+                dict: process churn {'new': <count>, 'exited': <count>, 
+                                     'totalNew': <count>, 'totalExited': <count>}
+        """
+        pidSet = set(psutil.pids())
+        exitedSet = self.procDict.keys() - pidSet
+        for pid in exitedSet: self._removePid(pid)
+        # A just forked process may exec() a new program after it was cached, 
+        # read the last cycle's new processes again once.
+        for pid in self._recentSet & pidSet:
+            stat = self.statDict.get(pid)
+            self._removePid(pid)
+            if self._addPid(pid) and stat: self.statDict[pid] = stat
+        newSet = pidSet - self.procDict.keys()
+        newCount = 0
+        for pid in newSet:
+            if self._addPid(pid): newCount += 1
+        if not self._baselineFlg:
+            self._baselineFlg = True
+            newCount = 0
+            newSet = set()
+        self._recentSet = newSet
+        self.churnDict['new'], self.churnDict['exited'] = newCount, len(exitedSet)
+        self.churnDict['totalNew'] += newCount
+        self.churnDict['totalExited'] += len(exitedSet)
+        return dict(self.churnDict)
+
+    def _addPid(self, pid):
+        try:
+            proc = psutil.Process(pid)
+            with proc.oneshot():
+                name = proc.name()
+                try:
+                    username = proc.username()
+                except (psutil.AccessDenied, KeyError):
+                    username = None
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return False    # exited after the pids() call.
+        except psutil.AccessDenied:
+            name, username = None, None
+        self.procDict[pid] = proc
+        self.infoDict[pid] = {'pid': pid, 'name': name, 'username': username}
+        self.nameIndex.setdefault(str(name).lower(), set()).add(pid)
+        return True
+
+    def _removePid(self, pid):
+        self.procDict.pop(pid, None)
+        self.statDict.pop(pid, None)
+        info = self.infoDict.pop(pid, None)
+        if info is None: return
+        pidSet = self.nameIndex.get(str(info['name']).lower())
+        if pidSet is not None:
+            pidSet.discard(pid)
+            if not pidSet: self.nameIndex.pop(str(info['name']).lower())
+
+#-----------------------------------------------------------------------------
+    def _readStat(self, pid):
+        """ Read the process (cpu time(sec), rss(bytes)), from /proc/<pid>/stat 
+            in one read on linux or the psutil process obj on other platforms.
+        """
+        if self._procStatFlg:
+            with open('/proc/%d/stat' %pid, 'rb') as fh:
+                data = fh.read()
+            # the process name (field 2) can have spaces, split after its ')'.
+            fieldList = data[data.rfind(b')') + 2:].split()
+            return ((int(fieldList[11]) + int(fieldList[12])) / self._clockTicks, 
+                    int(fieldList[21]) * self._pageSz)
+        proc = self.procDict[pid]
+        with proc.oneshot():
+            cpuTimes = proc.cpu_times()
+            return (cpuTimes.user + cpuTimes.system, proc.memory_info().rss)
+
+    def getTopN(self, topN=PROC_TOP_N):
+        """ Read the cpu time and rss of the cached processes, calculate the cpu 
+            percent (100 = one core) since the last call and select the top N
+            by cpu and by rss with a bounded heap.
+            Returns:
+                dict: {'cpu': [{'pid':, 'name':, 'cpu': <percent>, 'rss': <bytes>, 'rssDelta': <bytes>}, ...],
+                       'rss': [{...same...}, ...]}
+        """
+        statList = []
+        for pid in list(self.procDict.keys()):
+            try:
+                cpuTime, rss = self._readStat(pid)
+            except (OSError, IndexError, ValueError, psutil.Error):
+                continue    # exited or no permission, cleaned by the next update.
+            now = time.monotonic()
+            prevStat = self.statDict.get(pid)
+            self.statDict[pid] = (now, cpuTime, rss)
+            cpuPct = rssDelta = None
+            if prevStat and now > prevStat[0]:
+                cpuPct = round((cpuTime - prevStat[1]) / (now - prevStat[0]) * 100, 1)
+                rssDelta = rss - prevStat[2]
+            statList.append((pid, cpuPct, rss, rssDelta))
+        topCpuList = heapq.nlargest(topN, (stat for stat in statList if stat[1] is not None), key=lambda stat: stat[1])
+        topRssList = heapq.nlargest(topN, statList, key=lambda stat: stat[2])
+        return {'cpu': [self._getStatInfo(stat) for stat in topCpuList],
+                'rss': [self._getStatInfo(stat) for stat in topRssList]}
+
+    def _getStatInfo(self, stat):
+        pid, cpuPct, rss, rssDelta = stat
+        return {'pid': pid, 'name': self.infoDict[pid]['name'], 'cpu': cpuPct, 'rss': rss, 'rssDelta': rssDelta}
+
+#-----------------------------------------------------------------------------
+    def getCount(self):
+        return len(self.procDict)
+
+    def getByNames(self, nameList):
+        """ Get the processes info of the names (not case sensitive).
+            Returns:
+                dict: {'<lower case name>': [{'pid':, 'name':, 'username':}, ...], ...}
+        """
+        filterKey = tuple(nameList)
+        if filterKey not in self._filterCache:
+            self._filterCache[filterKey] = frozenset(str(name).lower() for name in nameList)
+        return {name: [self.infoDict[pid] for pid in sorted(self.nameIndex.get(name, ()))]
+                for name in self._filterCache[filterKey]}
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class metricRegistry(object):
+    """ Cache the result fields with a TTL per field: the cheap volatile fields 
+        (TTL 0) are updated every call, the expensive stable fields are only 
+        updated when their TTL expired. The cache is indexed by the field and 
+        its config, so a config change updates the field immediately.
+        Example:
+            registry = metricRegistry({'user': 300})
+            registry.get('user', None, lambda: getUsers()) -> (update time, value)
+    """
+    def __init__(self, ttlDict=None) -> None:
+        self.ttlDict = dict(METRIC_TTL)
+        if ttlDict: self.ttlDict.update(ttlDict)
+        self.valueDict = {}     # field -> (config repr, update time, value)
+
+    def setTtl(self, field, ttl):
+        self.ttlDict[field] = ttl
+
+    def get(self, field, config, updateFunc):
+        """ Get the field value, call updateFunc() if the cache expired.
+            Returns:
+                tuple: (update time of the value, value)
+        """
+        now = time.time()
+        configRepr = repr(config)
+        cached = self.valueDict.get(field)
+        if cached and cached[0] == configRepr and now - cached[1] < self.ttlDict.get(field, 0):
+            return cached[1], cached[2]
+        value = updateFunc()
+        self.valueDict[field] = (configRepr, now, value)
+        return now, value
+
+    def invalidate(self, field=None):
+        """ Drop the cached value of a field (all the fields if None)."""
+        if field is None:
+            self.valueDict.clear()
+        else:
+            self.valueDict.pop(field, None)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class backgroundSampler(threading.Thread):
+    """ Background thread reads the cumulative per-CPU time counters every 
+        <interval> sec, the usage over any window is calculated from the counter
+        deltas between the window start sample and a fresh sample read at the 
+        request time, so the caller never waits. Every sample the total cpu 
+        and ram percent are also added in the ring buffers.
+        Example:
+            sampler = backgroundSampler(interval=1)
+            sampler.start()
+            sampler.getCpuUsage() -> usage since the last getCpuUsage() call.
+            sampler.getCpuUsage(window=10, percpu=True) -> usage of the last 10 sec.
+            sampler.getWindowStats() -> {'cpu': {'min':..}, 'ram': {..}} since the last call.
+    """
+    def __init__(self, interval=SAMPLE_INV, historySz=SAMPLE_HISTORY_SZ) -> None:
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.cpuSamples = deque(maxlen=historySz)   # (monotonic time, [(busy, total) per cpu])
+        self.ringDict = {name: ringBuffer(size=historySz) for name in SAMPLE_METRICS}
+        self._cursorDict = {name: 0 for name in SAMPLE_METRICS}  # ring buffer read cursors of getWindowStats()
+        self.collector = procCollector()
+        self.ioReaderDict = {'net': self.collector.getNetCounters, 'disk': self.collector.getDiskCounters}
+        self._ioRawDict = {group: {} for group in self.ioReaderDict}   # group -> {name: last raw counters}
+        self._ioTotalDict = {group: {} for group in self.ioReaderDict} # group -> {name: [wraparound safe totals]}
+        self._ioSampleTime = {group: None for group in self.ioReaderDict}
+        self._lastIoRead = {}   # group -> (time, {name: totals}) at the last getIoRates() call
+        self._lock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self._sampleCpu()
+        self._lastCpuRead = self.cpuSamples[-1]
+        self._sampleIo()
+
+    def run(self):
+        while not self._stopEvent.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """ Read the counters and add the cheap metrics in the ring buffers."""
+        now = time.time()
+        prevSample = self.cpuSamples[-1]
+        crtSample = self._sampleCpu()
+        cpuPct = self._getPercent(sum(crt[0] - prev[0] for prev, crt in zip(prevSample[1], crtSample[1])),
+                                  sum(crt[1] - prev[1] for prev, crt in zip(prevSample[1], crtSample[1])))
+        ramPct = self.collector.getMemPercent()
+        with self._lock:
+            self.ringDict['cpu'].add(cpuPct, now)
+            self.ringDict['ram'].add(ramPct, now)
+        self._sampleIo()
+
+    def _sampleIo(self):
+        """ Read the I/O counters and add the increase (wraparound handled) since
+            the last sample to the totals, the counters are sampled every interval
+            so a 32 bits counter can not wrap twice between two samples.
+        """
+        for group, reader in self.ioReaderDict.items():
+            try:
+                crtDict = reader()
+            except Exception as err:
+                continue
+            now = time.monotonic()
+            with self._lock:
+                rawDict, totalDict = self._ioRawDict[group], self._ioTotalDict[group]
+                for name, counters in crtDict.items():
+                    prevCounters = rawDict.get(name)
+                    if prevCounters is None:
+                        totalDict[name] = [0] * len(counters)
+                        continue
+                    totals = totalDict[name]
+                    for idx, val in enumerate(counters):
+                        totals[idx] += getCounterDelta(val, prevCounters[idx])
+                for name in rawDict.keys() - crtDict.keys(): totalDict.pop(name, None)
+                self._ioRawDict[group] = crtDict
+                self._ioSampleTime[group] = now
+
+    def stop(self):
+        self._stopEvent.set()
+
+#-----------------------------------------------------------------------------
+    def _readCpuTimes(self):
+        """ Read the (busy, total) time of each cpu, same calculation as psutil:
+            the guest time is already counted in the user time and the iowait 
+            is idle time.
+        """
+        timesList = []
+        for cpuTimes in psutil.cpu_times(percpu=True):
+            total = sum(cpuTimes) - getattr(cpuTimes, 'guest', 0) - getattr(cpuTimes, 'guest_nice', 0)
+            idle = cpuTimes.idle + getattr(cpuTimes, 'iowait', 0)
+            timesList.append((total - idle, total))
+        return timesList
+
+    def _sampleCpu(self):
+        sample = (time.monotonic(), self._readCpuTimes())
+        with self._lock:
+            self.cpuSamples.append(sample)
+        return sample
+
+#-----------------------------------------------------------------------------
+    def getCpuUsage(self, window=None, percpu=False):
+        """ Get the cpu usage percent over a time window.
+            Args:
+                window (float, optional): window length (sec) ending now, the 
+                    oldest kept sample is used if the history is shorter. 
+                    Defaults to None (since the last getCpuUsage() call).
+                percpu (bool, optional): return the percent of each cpu. Defaults to False.
+            Returns:
+                float or list: total usage percent or [percent of each cpu], None
+                    if the window is shorter than CPU_MIN_WINDOW.
+        """
+        crtSample = (time.monotonic(), self._readCpuTimes())
+        with self._lock:
+            if window is None:
+                startSample = self._lastCpuRead
+            else:
+                startSample = self.cpuSamples[0]
+                for sample in reversed(self.cpuSamples):
+                    if sample[0] <= crtSample[0] - max(window, CPU_MIN_WINDOW):
+                        startSample = sample
+                        break
+            # no real sampling window yet (sampler just started).
+            if crtSample[0] - startSample[0] < CPU_MIN_WINDOW: return None
+            self._lastCpuRead = crtSample
+        deltaList = [(crtBusy - startBusy, crtTotal - startTotal) for (startBusy, startTotal), (crtBusy, crtTotal) 
+                     in zip(startSample[1], crtSample[1])]
+        if percpu: return [self._getPercent(busy, total) for busy, total in deltaList]
+        return self._getPercent(sum(delta[0] for delta in deltaList), sum(delta[1] for delta in deltaList))
+
+    def _getPercent(self, busy, total):
+        if total <= 0: return 0.0
+        return round(min(100.0, max(0.0, busy / total * 100)), 1)
+
+#-----------------------------------------------------------------------------
+    def getIoRates(self, group):
+        """ Get the I/O rates from the last call to the latest background sample.
+            Args:
+                group (str): 'net' or 'disk'.
+            Returns:
+                dict: net: {'<interface>': {'rxBps':, 'txBps':, 'rxPps':, 'txPps':, 
+                                            'rxErrs':, 'txErrs':, 'rxDrop':, 'txDrop':}, ...}
+                      disk: {'<disk>': {'readIops':, 'writeIops':, 'readBps':, 'writeBps':, 'util': <busy %>}, ...}
+                      (the errors/drops are counts in the window, the rates are per sec)
+                      {} for the first call.
+        """
+        with self._lock:
+            crtTime = self._ioSampleTime[group]
+            crtTotalDict = {name: list(totals) for name, totals in self._ioTotalDict[group].items()}
+        lastTime, lastTotalDict = self._lastIoRead.get(group, (None, {}))
+        self._lastIoRead[group] = (crtTime, crtTotalDict)
+        resultDict = {}
+        if lastTime is None or crtTime is None or crtTime <= lastTime: return resultDict
+        elapsed = crtTime - lastTime
+        fieldList = NET_IO_FIELDS if group == 'net' else DISK_IO_FIELDS
+        for name, totals in crtTotalDict.items():
+            if name not in lastTotalDict: continue
+            deltaDict = dict(zip(fieldList, (crt - last for crt, last in zip(totals, lastTotalDict[name]))))
+            if group == 'net':
+                resultDict[name] = {'rxBps': deltaDict['rxBytes'] / elapsed, 
+                                    'txBps': deltaDict['txBytes'] / elapsed,
+                                    'rxPps': deltaDict['rxPackets'] / elapsed, 
+                                    'txPps': deltaDict['txPackets'] / elapsed,
+                                    'rxErrs': deltaDict['rxErrs'], 'txErrs': deltaDict['txErrs'],
+                                    'rxDrop': deltaDict['rxDrop'], 'txDrop': deltaDict['txDrop']}
+            else:
+                resultDict[name] = {'readIops': deltaDict['reads'] / elapsed, 
+                                    'writeIops': deltaDict['writes'] / elapsed,
+                                    'readBps': deltaDict['readBytes'] / elapsed, 
+                                    'writeBps': deltaDict['writeBytes'] / elapsed,
+                                    'util': round(min(100.0, deltaDict['busyTime'] / (elapsed * 10)), 1)}
+        return resultDict
+
+#-----------------------------------------------------------------------------
+    def getWindowStats(self, nameList=SAMPLE_METRICS, pct=95):
+        """ Summarize the samples recorded since the last call of each metric.
+            Returns:
+                dict: {'<metric>': {'count':, 'min':, 'mean':, 'max':, 'p<pct>':}, ...}
+        """
+        resultDict = {}
+        for name in nameList:
+            if name not in self.ringDict: continue
+            with self._lock:
+                vals, self._cursorDict[name] = self.ringDict[name].getValues(self._cursorDict[name])
+            resultDict[name] = summarize(vals, pct=pct)
+        return resultDict
+
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class localServiceProber(Prober):
@@ -51,6 +718,12 @@ class localServiceProber(Prober):
         super().__init__(debugLogger=debugLogger)
         self.id = id
         self.resultDict = {}
+        self.sampler = None
+        self.collector = procCollector()
+        self.procTracker = processTracker()
+        self.dirWatcher = dirWatcher(debugPrint=self._debugPrint)
+        self.cgroupCollector = cgroupCollector()
+        self.registry = metricRegistry()
         self._initResultDict()
         
     def _initResultDict(self):
@@ -61,33 +734,61 @@ class localServiceProber(Prober):
     def getLastResult(self):
         return self.resultDict
 
+    def getSampler(self):
+        """ Get the background sampler, start it at the first call."""
+        if self.sampler is None:
+            self.sampler = backgroundSampler()
+            self.sampler.start()
+        return self.sampler
+
+    def stop(self):
+        if self.sampler: self.sampler.stop()
+        self.collector.close()
+        self.dirWatcher.close()
+        self.cgroupCollector.close()
+
 #-----------------------------------------------------------------------------
     def getResUsage(self, configDict=None):
         """ Get the cpu, ram, login user, disk and network connction state
             Args:
                 configDict (dict, optional): result config dictionary, example:
                 configDict = {
-                    'cpu': {'interval': 0.1, 'percpu': False},
+                    'cpu': {'window': None, 'percpu': False},
                     'ram': 0,
                     'user': None,
                     'disk': ['C:'],
-                    'network': {'connCount': 0}
+                    'network': {'connCount': 0},
+                    'stats': ['cpu', 'ram'],
+                    'netio': 0,
+                    'diskio': 0,
+                    'cgroup': ['system.slice/*.service']
                 } .Defaults to None.
+                'netio' and 'diskio' return the interfaces/disks I/O rates since
+                the previous call (the counters are read by the background sampler).
+                'cgroup' returns the cgroup v2 groups (path/glob relative to /sys/fs/cgroup)
+                resource usage.
+                'stats' returns the min/mean/max/p95 of the metrics sampled at 
+                ~1Hz since the previous call. The cpu usage is calculated over the last <window> sec, or since 
+                the previous call if window is None ('interval' is accepted as 'window').
 
         Returns:
             dict() : The usage dict, example:
             resultDict = {
-                'cpu': <total percent or percent list>,
+                'cpu': <total percent or percent list, None before the first sample window>,
                 'ram': %,
                 'user': user list,
                 'dist': {'C:' %}
-                'network': {'connCount': int }
+                'network': {'connCount': int, 'tcp': {'<state>': int}, 'udp': {'<state>': int}},
+                'stats': {'cpu': {'count':, 'min':, 'mean':, 'max':, 'p95':}, 'ram': {...}},
+                'netio': {'<interface>': {'rxBps':, 'txBps':, 'rxPps':, 'txPps':, ...}},
+                'diskio': {'<disk>': {'readIops':, 'writeIops':, 'readBps':, 'writeBps':, 'util':}},
+                'cgroup': {'<cgroup>': {'cpu':, 'throttled':, 'mem':, 'pids':, 'readBps':, 'writeBps':, ...}}
             }
         """
         resultDict ={}
         if configDict is None: 
             configDict = {
-                'cpu': {'interval': 0.1, 'percpu': False},
+                'cpu': {'window': None, 'percpu': False},
                 'ram': 0,
                 'user': None,
                 'disk': [],
@@ -95,14 +796,14 @@ class localServiceProber(Prober):
             }
         # Check CPU:
         if 'cpu' in configDict.keys():
-            interval = configDict['cpu']['interval'] if 'interval' in configDict['cpu'].keys() else None
+            # 'interval' (the old blocking sample time) is accepted as the window.
+            window = configDict['cpu'].get('window', configDict['cpu'].get('interval'))
             percpuFlg = configDict['cpu']['percpu'] if 'percpu' in configDict['cpu'].keys() else False
-            resultDict['cpu'] = psutil.cpu_percent(interval=interval, percpu=percpuFlg)
+            resultDict['cpu'] = self.getSampler().getCpuUsage(window=window, percpu=percpuFlg)
         
         # Check Mem usage percent
         if 'ram' in configDict.keys():
-            data = psutil.virtual_memory()
-            resultDict['ram'] = data.percent
+            resultDict['ram'] = self.collector.getMemPercent()
 
         # Check current user
         if 'user' in configDict.keys():
@@ -114,10 +815,23 @@ class localServiceProber(Prober):
             for diskTag in configDict['disk']:
                 resultDict['disk'][diskTag] = psutil.disk_usage(diskTag).percent if os.path.exists(diskTag) else 0
         
+        # Summary of the high frequency samples in the report window
+        if 'stats' in configDict.keys():
+            resultDict['stats'] = self.getSampler().getWindowStats(nameList=configDict['stats'])
+
+        # Network interfaces and disks I/O rates
+        if 'netio' in configDict.keys():
+            resultDict['netio'] = self.getSampler().getIoRates('net')
+        if 'diskio' in configDict.keys():
+            resultDict['diskio'] = self.getSampler().getIoRates('disk')
+
+        # cgroups resource usage
+        if 'cgroup' in configDict.keys():
+            resultDict['cgroup'] = self.cgroupCollector.collect(configDict['cgroup'])
+
         # Check network conntion
         if 'network' in configDict.keys():
-            resultDict['network'] = {} 
-            resultDict['network']['connCount'] = len(psutil.net_connections())
+            resultDict['network'] = self.collector.getConnStates()
 
         return resultDict
 
@@ -129,12 +843,19 @@ class localServiceProber(Prober):
                  configDict = {
                     'process': {
                         'count': 0,
-                        'filter': ['python.exe']
+                        'filter': ['python.exe'],
+                        'top': 5
                     }
                 } . Defaults to None.
+                'top' reports the N processes using most cpu (since the last 
+                call) and most rss memory.
 
             Returns:
-                dict() : _description_
+                dict() : {'process': {'count': <int>, 
+                                      'filter': {'<lower case name>': [{'pid':, 'name':, 'username':}, ...]},
+                                      'churn': {'new':, 'exited':, 'totalNew':, 'totalExited':},
+                                      'top': {'cpu': [{'pid':, 'name':, 'cpu':, 'rss':, 'rssDelta':}, ...], 
+                                              'rss': [...]}}}
         """
         resultDict = {'process': {}}
         if configDict is None:
@@ -145,30 +866,35 @@ class localServiceProber(Prober):
                 }
             }
         if 'process' in configDict.keys():
+            resultDict['process']['churn'] = self.procTracker.update()
             # Check total process 
             if 'count' in configDict['process'].keys():
-                resultDict['process']['count'] = len(psutil.pids())
+                resultDict['process']['count'] = self.procTracker.getCount()
             # Check the filtered process we want to check
             if 'filter' in configDict['process'].keys():
-                filterDict = {}
-                for key in configDict['process']['filter']:
-                    filterDict[str(key).lower()] = []
-                for proc in psutil.process_iter(['pid', 'name', 'username']):
-                    infoName = proc.info['name']
-                    if str(infoName).lower() in filterDict.keys():
-                         filterDict[str(infoName).lower()].append(proc.info)
-                resultDict['process']['filter'] = filterDict
+                resultDict['process']['filter'] = self.procTracker.getByNames(configDict['process']['filter'])
+            # Check the top resource consumer processes
+            if 'top' in configDict['process'].keys():
+                topN = configDict['process']['top'] or PROC_TOP_N
+                resultDict['process']['top'] = self.procTracker.getTopN(topN=int(topN))
 
         return resultDict
     
 #-----------------------------------------------------------------------------
     def getDirFiles(self, configDict=None):
-        """ Get the folder contents.
+        """ Get the folder contents changes since the last call.
             Args:
-                configDict (_type_, optional): _description_. Defaults to None.
+                configDict (dict, optional): example:
+                configDict = {
+                    'dir': ['/var/log'],
+                    'dirFull': False,   # add the full entries list in the result.
+                    'dirPoll': False    # use scandir polling instead of inotify.
+                }. Defaults to None.
 
             Returns:
-                _type_: _description_
+                dict: {'dir': {'<path>': {'mode': 'inotify'/'poll', 'count': <entries count>,
+                                          'hash': <content hash>, 'added': [...], 'removed': [...],
+                                          'files': [...] if dirFull} or None if not exist, ...}}
         """
         resultDict ={'dir':{}}
         if configDict is None: 
@@ -176,13 +902,13 @@ class localServiceProber(Prober):
                 'dir': []
             }
         if 'dir' in configDict.keys():
-            for dirPath in configDict['dir']:
-                dirPath = r'{}'.format(dirPath)
-                try:
-                    resultDict['dir'][dirPath] = None
-                    if os.path.exists(dirPath): resultDict['dir'][dirPath] = os.listdir(dirPath)
-                except Exception as err:
-                    self._debugPrint("Error to ls dir [%s] : %s" %(dirPath, err), logType=self._logException)
+            pathList = [r'{}'.format(dirPath) for dirPath in configDict['dir']]
+            fullFlg = configDict['dirFull'] if 'dirFull' in configDict.keys() else False
+            pollFlg = configDict['dirPoll'] if 'dirPoll' in configDict.keys() else False
+            try:
+                resultDict['dir'] = self.dirWatcher.getReport(pathList, fullFlg=fullFlg, pollFlg=pollFlg)
+            except Exception as err:
+                self._debugPrint("Error to watch dirs %s : %s" %(str(pathList), err), logType=self._logException)
         return resultDict
 
 #-----------------------------------------------------------------------------
@@ -193,10 +919,32 @@ class localServiceProber(Prober):
 
 #-----------------------------------------------------------------------------
     def updateResUsage(self, configDict=None):
+        """ Update the result dict, each field is updated by its TTL tier in the 
+            registry (the config key 'ttl': {'<field>': <sec>} changes the TTL),
+            and its update time is saved in the result 'fresh' dict: 
+            {'<field>': <timestamp>, ...}.
+        """
         self.resultDict['time'] = time.time()
-        self.resultDict.update(self.getResUsage(configDict=configDict))
-        self.resultDict.update(self.getProcessState(configDict=configDict))
-        self.resultDict.update(self.getDirFiles(configDict=configDict))
+        if configDict is None:
+            self.resultDict.update(self.getResUsage(configDict=configDict))
+            self.resultDict.update(self.getProcessState(configDict=configDict))
+            self.resultDict.update(self.getDirFiles(configDict=configDict))
+            self.resultDict['fresh'] = {key: self.resultDict['time'] for key in self.resultDict.keys() 
+                                        if key not in ('target', 'time', 'fresh')}
+            return
+        if 'ttl' in configDict.keys():
+            for field, ttl in configDict['ttl'].items(): self.registry.setTtl(field, ttl)
+        freshDict = {}
+        fieldList = [(field, self.getResUsage) for field in RES_FIELDS]
+        fieldList += [('process', self.getProcessState), ('dir', self.getDirFiles)]
+        for field, getFunc in fieldList:
+            if field not in configDict.keys(): 
+                if field in BASE_FIELDS: self.resultDict[field] = {}
+                continue
+            subConfig = {key: configDict[key] for key in (field,) + FIELD_OPTIONS.get(field, ()) if key in configDict.keys()}
+            freshDict[field], self.resultDict[field] = self.registry.get(
+                field, subConfig, lambda: getFunc(configDict=subConfig)[field])
+        self.resultDict['fresh'] = freshDict
 
 #----------------------------------------------------------------------------- 
 #-----------------------------------------------------------------------------
@@ -219,7 +967,7 @@ def testCase(mode):
     driver = localServiceProber('127.0.0.1')
     if mode == 0:
         configDict =  {
-                'cpu': {'interval': 0.1, 'percpu': False},
+                'cpu': {'window': None, 'percpu': False},
                 'ram': 0,
                 'user': None,
                 'disk': ['C:'],
@@ -237,9 +985,50 @@ def testCase(mode):
             'dir': [r'C:\Works\NCL\Project\Openstack_Config\GPU', 'M:'],
         }
         result = driver.getDirFiles(configDict=configDict)
+    elif mode == 4:
+        driver.getResUsage(configDict={'cpu': {}})
+        for _ in range(3):
+            time.sleep(2)
+            print(driver.getResUsage(configDict={'cpu': {'percpu': True}}))
+        result = driver.getResUsage(configDict={'cpu': {'window': 5}, 'stats': ['cpu', 'ram']})
+    elif mode == 5:
+        # Benchmark the /proc connections count against psutil with many open sockets.
+        sockList = []
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(4096)
+        for _ in range(5000):
+            client = socket.create_connection(server.getsockname())
+            sockList.extend([client, server.accept()[0]])
+        for name, func in (('proc', driver.collector.getConnStates), ('psutil', driver.collector._getConnStatesPsutil)):
+            startT = time.perf_counter()
+            for _ in range(10): result = func()
+            print("%s: %.2f ms per call, %s" %(name, (time.perf_counter() - startT)*100, str(result)))
+            # both ends of the 5000 connections are counted.
+            assert result['tcp'].get('ESTABLISHED', 0) >= 10000, "%s missed the connections" %name
+            assert result['connCount'] == sum(result['tcp'].values()) + sum(result['udp'].values())
+        for sock in sockList: sock.close()
+    elif mode == 6:
+        # Collect a synthetic cgroupfs tree.
+        import tempfile
+        rootDir = tempfile.mkdtemp()
+        def writeGroup(name, usage, mem, rbytes):
+            os.makedirs(os.path.join(rootDir, name), exist_ok=True)
+            for fileName, data in (('cpu.stat', 'usage_usec %d\nuser_usec 0\nsystem_usec 0\nthrottled_usec 0\n' %usage),
+                                   ('memory.current', '%d\n' %mem), ('pids.current', '3\n'),
+                                   ('io.stat', '8:0 rbytes=%d wbytes=0 rios=10 wios=0 dbytes=0 dios=0\n' %rbytes)):
+                with open(os.path.join(rootDir, name, fileName), 'w') as fh: fh.write(data)
+        collector = cgroupCollector(root=rootDir)
+        for idx in range(2):
+            for name in ('system.slice/a.service', 'system.slice/b.service'):
+                writeGroup(name, 1000000*idx, 1024*1024*(idx + 1), 4096*idx)
+            print(collector.collect(['system.slice/*.service']))
+            time.sleep(1)
+        collector.close()
+        result = None
     elif mode == 3:
         configDict =  {
-                'cpu': {'interval': 0.1, 'percpu': True},
+                'cpu': {'window': None, 'percpu': True},
                 'ram': 0,
                 'user': None,
                 'disk': ['C:'],
@@ -0,0 +1,450 @@
+#-----------------------------------------------------------------------------
+# Name:        metricStats.py
+#
+# Purpose:     This module provides the light weight statistic containers used
+#              by the probers to summarize the measured metrics inside the agent
+#              before they are reported to the monitor hub.
+#              - rollingWindow: keep the last N samples and calculate percentiles.
+#              - logLinearHistogram: fixed buckets histogram with constant memory
+#                which can be merged cheaply across agents.
+#              - ringBuffer: preallocated array('d') ring buffer of the high 
+#                frequency samples, summarized as min/mean/max/p95 per window.
+#              - getCounterDelta: wraparound safe delta of the kernel counters.
+#              - tieredHistory: bounded memory metrics history with the raw 
+#                samples and the min/mean/max rollup tiers.
+#
+# Author:      Yuancheng Liu
+#
+# Version:     v_0.1
+# Created:     2023/04/05
+# Copyright:   n.a
+# License:     n.a
+#-----------------------------------------------------------------------------
+
+import math
+from array import array
+from collections import deque
+
+DEF_WINDOW_SZ = 60
+DEF_PERCENTILES = (50, 90, 99)
+DEF_RING_SZ = 3600  # 1 hour of 1 Hz samples.
+# history tiers: (name, rollup step sec (0: raw), slots, retention sec)
+HISTORY_TIERS = (('raw', 0, 3600, 3600), ('1m', 60, 1440, 86400), ('10m', 600, 1008, 604800))
+HISTORY_MAX_FIELDS = 128
+HISTORY_MAX_POINTS = 1000 # max points returned by one query.
+HIST_MIN_EXP = -3   # smallest decade of the histogram: 10^-3 (0.001 ms).
+HIST_MAX_EXP = 5    # biggest decade of the histogram: 10^5 (100 sec).
+HIST_BUCKETS_PER_DECADE = 90 # 2 significant digits: 1.0, 1.1, ... 9.9 x 10^n.
+
+#-----------------------------------------------------------------------------
+def getPercentile(sortedList, pct):
+    """ Get the percentile value (linear interpolation between the closest ranks)
+        of a sorted value list.
+        Args:
+            sortedList (list): ascending sorted values.
+            pct (float): percentile 0-100.
+        Returns:
+            float: the percentile value, None if the list is empty.
+    """
+    if not sortedList: return None
+    rank = (len(sortedList) - 1) * pct / 100.0
+    lowIdx = int(rank)
+    highIdx = min(lowIdx + 1, len(sortedList) - 1)
+    return sortedList[lowIdx] + (sortedList[highIdx] - sortedList[lowIdx]) * (rank - lowIdx)
+
+#-----------------------------------------------------------------------------
+def getCounterDelta(crtVal, prevVal):
+    """ Get the increase of a monotonic (32 or 64 bits) kernel counter between two
+        reads. If the value decreased, the counter wrapped if the increase across
+        the wrap is smaller than half of the counter range, otherwise the counter 
+        was reset (such as the interface re-created) and counts from 0.
+    """
+    if crtVal >= prevVal: return crtVal - prevVal
+    for bits in (32, 64):
+        if prevVal < 2**bits:
+            delta = crtVal + 2**bits - prevVal
+            return delta if delta < 2**(bits - 1) else crtVal
+    return crtVal
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class rollingWindow(object):
+    """ Keep the last <size> samples of a metric and summarize them as percentiles.
+        Example:
+            window = rollingWindow(size=60)
+            window.add(12.3)
+            window.getPercentiles() -> {'p50': 12.3, 'p90': 12.3, 'p99': 12.3}
+    """
+    def __init__(self, size=DEF_WINDOW_SZ) -> None:
+        self.samples = deque(maxlen=max(1, int(size)))
+
+    def add(self, val):
+        """ Add a sample, None value is ignored."""
+        if val is not None: self.samples.append(val)
+
+    def getCount(self):
+        return len(self.samples)
+
+    def getPercentiles(self, pctList=DEF_PERCENTILES):
+        """ Returns:
+                dict: {'p<pct>': <value or None if no sample>, ...}
+        """
+        sortedList = sorted(self.samples)
+        return {'p%s' %str(pct): getPercentile(sortedList, pct) for pct in pctList}
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class logLinearHistogram(object):
+    """ Log-linear fixed buckets histogram: every decade [10^n, 10^(n+1)) is split
+        in 90 linear buckets (2 significant digits), so the relative error of the
+        quantile is smaller than 5%. The memory is constant (one counter array) 
+        and two histograms with the same layout are merged by adding the counters.
+        Bucket 0 counts the values under the min decade (include 0), the last 
+        bucket counts the values over the max decade.
+        Example:
+            hist = logLinearHistogram()
+            hist.add(1.25)
+            hist.getQuantiles() -> {'p50': 1.25, ...}
+    """
+    def __init__(self, minExp=HIST_MIN_EXP, maxExp=HIST_MAX_EXP) -> None:
+        self.minExp = int(minExp)
+        self.maxExp = int(maxExp)
+        self.bucketCount = (self.maxExp - self.minExp) * HIST_BUCKETS_PER_DECADE + 2
+        self.counts = array('L', bytes(array('L').itemsize * self.bucketCount))
+        self.total = 0
+
+    def _getIndex(self, val):
+        if val < 10**self.minExp: return 0
+        exp = int(math.floor(math.log10(val)))
+        if exp >= self.maxExp: return self.bucketCount - 1
+        mant = min(99, max(10, int(val / 10**(exp - 1))))
+        return (exp - self.minExp) * HIST_BUCKETS_PER_DECADE + (mant - 10) + 1
+
+    def _getBucketRange(self, idx):
+        """ Return the (lower, upper) value bound of a bucket."""
+        if idx == 0: return (0.0, float(10**self.minExp))
+        if idx >= self.bucketCount - 1: return (float(10**self.maxExp), float(10**self.maxExp))
+        exp, mantIdx = divmod(idx - 1, HIST_BUCKETS_PER_DECADE)
+        unit = 10.0**(exp + self.minExp - 1)
+        return ((mantIdx + 10) * unit, (mantIdx + 11) * unit)
+
+    def add(self, val, count=1):
+        """ Add a sample, None value is ignored."""
+        if val is None: return
+        self.counts[self._getIndex(val)] += count
+        self.total += count
+
+    def merge(self, other):
+        """ Add the counters of another histogram with the same layout."""
+        if (other.minExp, other.maxExp) != (self.minExp, self.maxExp):
+            raise ValueError("Can not merge histograms with different buckets layout.")
+        for idx, count in enumerate(other.counts):
+            if count: self.counts[idx] += count
+        self.total += other.total
+        return self
+
+    def getQuantile(self, pct):
+        """ Get the percentile (0-100) value as the middle of the bucket it 
+            falls in, None if the histogram is empty.
+        """
+        if not self.total: return None
+        rank = max(1, int(math.ceil(self.total * pct / 100.0)))
+        crtSum = 0
+        for idx, count in enumerate(self.counts):
+            crtSum += count
+            if crtSum >= rank:
+                lower, upper = self._getBucketRange(idx)
+                return (lower + upper) / 2
+        return None
+
+    def getQuantiles(self, pctList=DEF_PERCENTILES):
+        """ Returns:
+                dict: {'p<pct>': <value or None>, ...}
+        """
+        return {'p%s' %str(pct): self.getQuantile(pct) for pct in pctList}
+
+    def toDict(self):
+        """ Convert to a json serializable dict with the none zero buckets only."""
+        return {'minExp': self.minExp, 
+                'maxExp': self.maxExp, 
+                'buckets': {str(idx): count for idx, count in enumerate(self.counts) if count}}
+
+    @classmethod
+    def fromDict(cls, dataDict):
+        """ Rebuild the histogram from the toDict() result."""
+        hist = cls(minExp=dataDict['minExp'], maxExp=dataDict['maxExp'])
+        for idx, count in dataDict['buckets'].items():
+            hist.counts[int(idx)] += int(count)
+            hist.total += int(count)
+        return hist
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class ringBuffer(object):
+    """ Fixed size ring buffer of (timestamp, value) samples stored in two 
+        preallocated array('d'), no object is created per sample. The total added
+        count is used as the read cursor, so a reader gets the samples added 
+        since its last read by getValues(cursor).
+        Example:
+            buf = ringBuffer(size=3600)
+            buf.add(12.3)
+            vals, cursor = buf.getValues(0)
+            summarize(vals) -> {'count': 1, 'min': 12.3, 'mean': 12.3, 'max': 12.3, 'p95': 12.3}
+    """
+    def __init__(self, size=DEF_RING_SZ) -> None:
+        self.size = max(1, int(size))
+        self.values = array('d', bytes(array('d').itemsize * self.size))
+        self.times = array('d', bytes(array('d').itemsize * self.size))
+        self.count = 0  # total samples added.
+
+    def add(self, val, timestamp=0.0):
+        """ Add a sample, None value is ignored."""
+        if val is None: return
+        idx = self.count % self.size
+        self.values[idx] = val
+        self.times[idx] = timestamp
+        self.count += 1
+
+    def _getRange(self, cursor):
+        """ Return the array (start, end) index slices of the samples added after 
+            the cursor, the samples overwritten are skipped.
+        """
+        cursor = max(int(cursor), self.count - self.size, 0)
+        startIdx, endIdx = cursor % self.size, self.count % self.size
+        if cursor == self.count: return []
+        if startIdx < endIdx: return [(startIdx, endIdx)]
+        return [(startIdx, self.size), (0, endIdx)]
+
+    def getValues(self, cursor=0):
+        """ Get the values added after the cursor (0: all the kept values).
+            Returns:
+                tuple: (array('d') of values in time order, new cursor)
+        """
+        count = self.count
+        vals = array('d')
+        for startIdx, endIdx in self._getRange(cursor):
+            vals.extend(self.values[startIdx:endIdx])
+        return vals, count
+
+    def getSamples(self, cursor=0):
+        """ Returns:
+                tuple: (array('d') of timestamps, array('d') of values, new cursor)
+        """
+        count = self.count
+        times, vals = array('d'), array('d')
+        for startIdx, endIdx in self._getRange(cursor):
+            times.extend(self.times[startIdx:endIdx])
+            vals.extend(self.values[startIdx:endIdx])
+        return times, vals, count
+
+#-----------------------------------------------------------------------------
+def summarize(vals, pct=95):
+    """ Summarize a window of values, the min/max/sum run in C over the array 
+        and only the percentile needs a sort.
+        Returns:
+            dict: {'count': <int>, 'min': <val>, 'mean': <val>, 'max': <val>, 'p95': <val>}
+                  the values are None if the window is empty.
+    """
+    pctKey = 'p%s' %str(pct)
+    if not vals: return {'count': 0, 'min': None, 'mean': None, 'max': None, pctKey: None}
+    return {'count': len(vals),
+            'min': min(vals),
+            'mean': math.fsum(vals) / len(vals),
+            'max': max(vals),
+            pctKey: getPercentile(sorted(vals), pct)}
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class historyTier(object):
+    """ One history tier: a shared timestamps array('d') ring and per field 
+        array('d') rings (NaN if the field has no value at the slot). A rollup
+        tier keeps the min/mean/max of the samples in each <step> sec bucket.
+    """
+    def __init__(self, name, step, size, retention) -> None:
+        self.name = name
+        self.step = step
+        self.size = size
+        self.retention = retention
+        self.times = array('d', [math.nan]) * size
+        self.fieldDict = {}     # field -> array('d') (raw) or (min, mean, max) arrays (rollup)
+        self.count = 0
+        self._bucket = None     # (bucket start time, {field: [min, sum, max, count]}) of the open bucket.
+
+    def _newRing(self):
+        return array('d', [math.nan]) * self.size
+
+    def _getRings(self, field):
+        if field not in self.fieldDict:
+            self.fieldDict[field] = self._newRing() if self.step == 0 else tuple(self._newRing() for _ in range(3))
+        return self.fieldDict[field]
+
+    def _writeSlot(self, timestamp, valDict):
+        idx = self.count % self.size
+        self.times[idx] = timestamp
+        for field, rings in self.fieldDict.items():
+            vals = valDict.get(field)
+            if self.step == 0:
+                rings[idx] = math.nan if vals is None else vals
+            else:
+                for ring, val in zip(rings, vals if vals else (math.nan,)*3): ring[idx] = val
+        self.count += 1
+
+    def add(self, timestamp, valDict):
+        """ Add a sample {field: value} (the fields must be already allowed)."""
+        if self.step == 0:
+            for field in valDict: self._getRings(field)
+            self._writeSlot(timestamp, valDict)
+            return
+        bucketT = timestamp - timestamp % self.step
+        if self._bucket and self._bucket[0] != bucketT: self.flush()
+        if self._bucket is None: self._bucket = (bucketT, {})
+        accDict = self._bucket[1]
+        for field, val in valDict.items():
+            acc = accDict.get(field)
+            if acc is None:
+                accDict[field] = [val, val, val, 1]
+            else:
+                acc[0], acc[2] = min(acc[0], val), max(acc[2], val)
+                acc[1] += val
+                acc[3] += 1
+
+    def flush(self):
+        """ Write the open rollup bucket in the rings."""
+        if self._bucket is None: return
+        bucketT, accDict = self._bucket
+        for field in accDict: self._getRings(field)
+        self._writeSlot(bucketT, {field: (acc[0], acc[1]/acc[3], acc[2]) for field, acc in accDict.items()})
+        self._bucket = None
+
+    def getOldest(self):
+        """ Return the oldest timestamp kept in the tier (the open bucket included)."""
+        if self.count:
+            return self.times[self.count % self.size] if self.count >= self.size else self.times[0]
+        return self._bucket[0] if self._bucket else None
+
+    def isCovering(self, startT, now):
+        """ Check whether the tier keeps the data from startT: the oldest kept 
+            sample is not after startT or the tier never lost a sample (not 
+            wrapped and all the samples inside the retention).
+        """
+        oldest = self.getOldest()
+        if oldest is None: return False
+        if max(oldest, now - self.retention) <= startT: return True
+        return self.count <= self.size and oldest >= now - self.retention
+
+    def query(self, startT, endT, fieldList, limit):
+        """ Query the slots and the open rollup bucket in the time range.
+            Returns:
+                tuple: (times list, {field: [val] or {'min': [], 'mean': [], 'max': []}}, more flag)
+        """
+        firstIdx = max(0, self.count - self.size)
+        idxList = []
+        for count in range(firstIdx, self.count):
+            timestamp = self.times[count % self.size]
+            if startT <= timestamp <= endT:
+                if len(idxList) == limit: return self._collect(idxList, fieldList, False) + (True,)
+                idxList.append(count % self.size)
+        openFlg = self._bucket is not None and startT <= self._bucket[0] <= endT
+        if openFlg and len(idxList) == limit: return self._collect(idxList, fieldList, False) + (True,)
+        return self._collect(idxList, fieldList, openFlg) + (False,)
+
+    def _collect(self, idxList, fieldList, openFlg):
+        """ Collect the slots' values, add the open bucket's current min/mean/max 
+            at the end if openFlg is set.
+        """
+        toVal = lambda val: None if math.isnan(val) else val
+        timeList = [self.times[idx] for idx in idxList]
+        accDict = {}
+        if openFlg:
+            timeList.append(self._bucket[0])
+            accDict = self._bucket[1]
+        resultDict = {}
+        for field in fieldList:
+            rings = self.fieldDict.get(field)
+            acc = accDict.get(field)
+            if rings is None and acc is None: continue
+            if self.step == 0:
+                resultDict[field] = [toVal(rings[idx]) for idx in idxList]
+                continue
+            valDict = {key: [toVal(ring[idx]) for idx in idxList] if rings else [None]*len(idxList)
+                       for key, ring in zip(('min', 'mean', 'max'), rings or (None,)*3)}
+            if openFlg:
+                for key, val in zip(('min', 'mean', 'max'), (acc[0], acc[1]/acc[3], acc[2]) if acc else (None,)*3):
+                    valDict[key].append(val)
+            resultDict[field] = valDict
+        return timeList, resultDict
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class tieredHistory(object):
+    """ Bounded memory history of the numeric metrics: the raw samples for 1 
+        hour, 1 minute min/mean/max rollups for 24 hours and 10 minutes rollups
+        for 7 days. The memory is limited by the slots of each tier and the max
+        number of fields (new fields over the limit are ignored and recorded in
+        droppedSet), with the default setting a field uses < 90KB.
+        Example:
+            history = tieredHistory()
+            history.add(time.time(), {'cpu': 12.5, 'ram': 40.1})
+            history.query(startT, endT, ['cpu']) -> {'tier': 'raw', 'times': [...], 'fields': {'cpu': [...]}, ...}
+    """
+    def __init__(self, tierList=HISTORY_TIERS, maxFields=HISTORY_MAX_FIELDS) -> None:
+        self.tierList = [historyTier(*tierCfg) for tierCfg in tierList]
+        self.maxFields = maxFields
+        self.fieldSet = set()
+        self.droppedSet = set() # new fields ignored as over the max fields limit.
+        self.lastTime = None
+
+    def add(self, timestamp, valDict):
+        """ Add a sample of the fields' values (the not numeric values are ignored)."""
+        sampleDict = {}
+        for field, val in valDict.items():
+            if val is None or isinstance(val, bool) or not isinstance(val, (int, float)): continue
+            if field not in self.fieldSet:
+                if len(self.fieldSet) >= self.maxFields:
+                    self.droppedSet.add(field)
+                    continue
+                self.fieldSet.add(field)
+            sampleDict[field] = float(val)
+        for tier in self.tierList: tier.add(timestamp, sampleDict)
+        self.lastTime = timestamp
+
+    def getFields(self):
+        return sorted(self.fieldSet)
+
+    def query(self, startT=None, endT=None, fieldList=None, limit=HISTORY_MAX_POINTS):
+        """ Get the history of the fields in the time range from the finest tier 
+            which still keeps the range start (the current rollup bucket is 
+            included).
+            Args:
+                startT (float, optional): range start timestamp. Defaults to None (1 hour ago).
+                endT (float, optional): range end timestamp. Defaults to None (now).
+                fieldList (list, optional): fields or parent field names. Defaults to None (all).
+                limit (int, optional): max points returned. Defaults to HISTORY_MAX_POINTS.
+            Returns:
+                dict: {'tier': <tier name>, 'step': <rollup sec>, 'from':, 'to':, 
+                       'times': [...], 'fields': {...}, 'next': <start time of the next page> or None}
+        """
+        now = self.lastTime if self.lastTime else 0
+        endT = now if endT is None else float(endT)
+        startT = endT - 3600 if startT is None else float(startT)
+        if fieldList:
+            # a field name also selects its sub fields: 'cpu' -> 'cpu', 'cpu.0', 'cpu.1' ...
+            fieldList = [field for field in self.getFields() 
+                         if any(field == name or field.startswith(name + '.') for name in fieldList)]
+        else:
+            fieldList = self.getFields()
+        # the finest tier keeping the data from the range start, else the tier
+        # keeping the oldest data.
+        chosenTier = None
+        for tier in self.tierList:
+            if tier.isCovering(startT, now):
+                chosenTier = tier
+                break
+        if chosenTier is None:
+            oldestList = [(tier.getOldest(), idx) for idx, tier in enumerate(self.tierList) if tier.getOldest() is not None]
+            chosenTier = self.tierList[min(oldestList)[1]] if oldestList else self.tierList[0]
+        timeList, resultDict, moreFlg = chosenTier.query(max(startT, now - chosenTier.retention), 
+                                                         endT, fieldList, max(1, int(limit)))
+        return {'tier': chosenTier.name, 'step': chosenTier.step, 'from': startT, 'to': endT,
+                'times': timeList, 'fields': resultDict, 
+                'next': (timeList[-1] + max(chosenTier.step, 1e-6)) if moreFlg and timeList else None}
@@ -3,25 +3,67 @@
 #
 # Purpose:     This module is prober function module used to check the target 
 #              nodes service state through the network connection. The service
-#              can be checked contents: NTP, http, https, FTP
+#              can be checked contents: NTP, http, https, FTP, TCP ports scan and
+#              batch ICMP ping, path tracing, multi-server NTP time quality. The 
+#              target names are resolved through a shared TTL-aware DNS cache.
 #
 # Author:      Yuancheng Liu
 #
-# Version:     v_0.2
+# Version:     v_0.2.1
 # Created:     2023/03/11
 # Copyright:   n.a
 # License:     n.a
 #-----------------------------------------------------------------------------
 
+import os
+import time
+import errno
 import socket
+import struct
+import queue
+import hashlib
+import selectors
+import threading
 import urllib.request
+from urllib.parse import urlsplit
+from statistics import median
+from collections import deque
 
 import ntplib
 import http.client
 from ftplib import FTP
 
 from pythonping import ping
+
+from metricStats import rollingWindow, logLinearHistogram
+
 DEF_TIMEOUT = 3 
+MAX_INFLIGHT = 1000     # max number of TCP connect() kept in flight by the ports scanner.
+# connect_ex() return codes which mean the non-blocking connection is on going.
+CONN_PENDING_CODES = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035) # 10035: WSAEWOULDBLOCK
+ICMP_ECHO_REQ = 8
+ICMP_ECHO_REP = 0
+ICMP_HEADER_FMT = '!BBHHH'  # type, code, checksum, id, sequence
+ICMP_PAYLOAD_SZ = 56        # same payload size as the linux <ping> cmd.
+ICMP_RCVBUF_SZ = 4*1024*1024
+ICMP_DEST_UNREACH = 3
+ICMP_TIME_EXCEEDED = 11
+TRACE_MAX_HOPS = 30
+TRACE_UDP_PORT = 33434      # base destination port of the UDP trace probes (same as <traceroute>).
+NTP_PORT = 123
+NTP_EPOCH_DELTA = 2208988800 # seconds between 1900-01-01 (NTP) and 1970-01-01 (unix).
+NTP_PACKET_FMT = '!BBbbII4s8I' # LI/VN/Mode, stratum, poll, precision, root delay, root dispersion, 
+                               # ref id, ref/origin/receive/transmit timestamps.
+NTP_DRIFT_WINDOW = 32       # number of offset samples used to estimate the clock drift.
+DNS_TTL = 300           # sec a resolved address is cached.
+DNS_NEG_TTL = 30        # sec a resolve failure is cached.
+DNS_STALE_TTL = 3600    # sec an expired address can still be used if the resolver fails.
+DNS_REFRESH_RATIO = 0.8 # refresh the address in background after this part of the TTL passed.
+HTTP_IDLE_TIMEOUT = 60  # sec a kept alive http connection can be idle in the pool.
+HTTP_FRESH_INV = 600    # sec interval to force a fresh http connection to check the reconnection.
+HTTP_TIMING_WINDOW = 60 # number of http timing samples kept to calculate the percentiles.
+HTTP_PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer')
+FTP_PORT = 21
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
@@ -48,22 +90,214 @@ class Prober(object):
         elif logType == self._logInfo:
             self._debugLogger.info(msg)
 
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class dnsResolverCache(Prober):
+    """ Thread safe DNS resolve cache with positive and negative TTL. When a cached
+        address is close to expire, it will be refreshed by a background thread 
+        so the probe cycles of a fixed set of targets don't wait for the resolver,
+        if the resolver fails the expired address is still used (serve-stale) so
+        a resolver failure will not be reported as the service failure.
+    """
+    def __init__(self, ttl=DNS_TTL, negTtl=DNS_NEG_TTL, staleTtl=DNS_STALE_TTL, 
+                 refreshRatio=DNS_REFRESH_RATIO, debugLogger=None) -> None:
+        super().__init__(debugLogger=debugLogger)
+        self.ttl = ttl
+        self.negTtl = negTtl
+        self.staleTtl = staleTtl
+        self.refreshRatio = refreshRatio
+        self._cacheDict = {}    # host -> [ipAddr/None, refreshTime, expireTime, staleUntil]
+        self._statDict = {'hit': 0, 'miss': 0, 'stale': 0, 'refresh': 0}
+        self._lock = threading.Lock()
+        self._refreshQueue = queue.Queue()
+        self._refreshSet = set()
+        self._refreshThread = None
+
+    def _lookup(self, host):
+        """ Call the system resolver, return (ipAddr/None, resolve time(ms))."""
+        startT = time.monotonic()
+        try:
+            ipAddr = socket.gethostbyname(host)
+        except Exception as err:
+            ipAddr = None
+        return (ipAddr, (time.monotonic() - startT)*1000)
+
+    def store(self, host, ipAddr):
+        """ Save the resolve result (None if failed), a failed resolve keeps the 
+            stale address. Returns the address should be used.
+        """
+        now = time.monotonic()
+        with self._lock:
+            oldEntry = self._cacheDict.get(host)
+            if ipAddr:
+                self._cacheDict[host] = [ipAddr, now + self.ttl*self.refreshRatio, now + self.ttl,
+                                         now + self.ttl + self.staleTtl]
+                return ipAddr
+            if oldEntry and oldEntry[0] and now < oldEntry[3]:
+                # Serve the stale address and retry after the negative TTL, the 
+                # stale limit (from the last successful resolve) is not extended.
+                self._statDict['stale'] += 1
+                oldEntry[1] = oldEntry[2] = min(now + self.negTtl, oldEntry[3])
+                return oldEntry[0]
+            self._cacheDict[host] = [None, now + self.negTtl, now + self.negTtl, now]
+            return None
+
+    def _scheduleRefresh(self, host):
+        with self._lock:
+            if host in self._refreshSet: return
+            self._refreshSet.add(host)
+            if self._refreshThread is None or not self._refreshThread.is_alive():
+                self._refreshThread = threading.Thread(target=self._refreshLoop, daemon=True)
+                self._refreshThread.start()
+        self._refreshQueue.put(host)
+
+    def _refreshLoop(self):
+        """ Background thread resolve the addresses going to expire."""
+        while True:
+            host = self._refreshQueue.get()
+            ipAddr, _ = self._lookup(host)
+            self.store(host, ipAddr)
+            with self._lock:
+                self._statDict['refresh'] += 1
+                self._refreshSet.discard(host)
+
+#-----------------------------------------------------------------------------
+    def resolve(self, host):
+        """ Resolve a host name to IPv4 address through the cache.
+            Args:
+                host (str): IP-address/domain-name
+            Returns:
+                tuple: (ipAddr or None if not resolvable, resolve time(ms))
+        """
+        startT = time.monotonic()
+        hitFlg, ipAddr = self.getCached(host)
+        if not hitFlg:
+            ipAddr, _ = self._lookup(host)
+            ipAddr = self.store(host, ipAddr)
+        return (ipAddr, (time.monotonic() - startT)*1000)
+
+    def getCached(self, host):
+        """ Look up the cache without calling the resolver, the address close to 
+            expire will be refreshed in background.
+            Returns:
+                tuple: (cache hit flag, ipAddr or None)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cacheDict.get(host)
+            if not entry or now >= entry[2]:
+                self._statDict['miss'] += 1
+                return (False, None)
+            self._statDict['hit'] += 1
+            ipAddr, refreshFlg = entry[0], entry[0] and now >= entry[1]
+        if refreshFlg: self._scheduleRefresh(host)
+        return (True, ipAddr)
+
+    def getStats(self):
+        """ Return the cache hit/miss/stale/background refresh counters."""
+        with self._lock:
+            statDict = dict(self._statDict)
+            statDict['size'] = len(self._cacheDict)
+        return statDict
+
+    def clear(self):
+        with self._lock:
+            self._cacheDict.clear()
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class httpConnPool(object):
+    """ Pool of the kept alive http/https connections indexed by (conn, target, port),
+        the connection idle longer than the idleTimeout will be closed, a fresh 
+        connection is forced every freshInterval to check the reconnection works.
+    """
+    def __init__(self, idleTimeout=HTTP_IDLE_TIMEOUT, freshInterval=HTTP_FRESH_INV) -> None:
+        self.idleTimeout = idleTimeout
+        self.freshInterval = freshInterval
+        self._connDict = {}     # key -> (connection, last used time)
+        self._latencyDict = {}  # key -> {'fresh': <ms>, 'warm': <ms>, 'freshTime': <time>}
+        self._lock = threading.Lock()
+
+    def _evictIdle(self, now):
+        for key in [key for key, (_, lastT) in self._connDict.items() if now - lastT > self.idleTimeout]:
+            self._connDict.pop(key)[0].close()
+
+    def getConn(self, key):
+        """ Take the kept alive connection out of the pool. 
+            Returns:
+                connection or None if no connection kept or need a fresh connection.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evictIdle(now)
+            conn, _ = self._connDict.pop(key, (None, None))
+            latencyDict = self._latencyDict.get(key)
+        if conn and (latencyDict is None or now - latencyDict['freshTime'] >= self.freshInterval):
+            conn.close()
+            conn = None
+        return conn
+
+    def putConn(self, key, conn):
+        """ Put the connection back to the pool after the request finished."""
+        with self._lock:
+            oldConn, _ = self._connDict.pop(key, (None, None))
+            if oldConn: oldConn.close()
+            self._connDict[key] = (conn, time.monotonic())
+
+    def record(self, key, reuseFlg, latency):
+        """ Record a request's latency(ms) of the fresh or warm connection, a 
+            failed request (latency None) keeps the last recorded latencies.
+            Returns:
+                dict: {'reuse': <warm request flag>, 'fresh': <ms>, 'warm': <ms>}
+        """
+        with self._lock:
+            latencyDict = self._latencyDict.setdefault(key, {'fresh': None, 'warm': None, 'freshTime': 0})
+            if latency is None:
+                pass
+            elif reuseFlg:
+                latencyDict['warm'] = latency
+            else:
+                latencyDict['fresh'] = latency
+                latencyDict['freshTime'] = time.monotonic()
+            return {'reuse': reuseFlg, 'fresh': latencyDict['fresh'], 'warm': latencyDict['warm']}
+
+    def close(self):
+        with self._lock:
+            for conn, _ in self._connDict.values(): conn.close()
+            self._connDict.clear()
+
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
 class networkServiceProber(Prober):
     """ 
     """
-    def __init__(self, debugLogger=None) -> None:
-        """ Init the obj, example: driver = networkServiceProber()"""
+    def __init__(self, debugLogger=None, dnsCache=None) -> None:
+        """ Init the obj, example: driver = networkServiceProber()
+            Args:
+                dnsCache (dnsResolverCache, optional): DNS cache shared with other 
+                    probers. Defaults to None (create a new one).
+        """
         super().__init__(debugLogger=debugLogger)
-        self.tcpPortChecker = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.dnsCache = dnsCache if dnsCache else dnsResolverCache(debugLogger=debugLogger)
+        self.httpPool = httpConnPool()
+        self.httpTimingDict = {} # (conn, target, port, '<req>:<par>') -> {'<phase>': rollingWindow, ...}
+        self.tcpLatencyDict = {} # '<target>:<port>' -> logLinearHistogram of the connect latency(ms)
+        self.pathHashDict = {}   # '<target>:<proto>' -> last traced path hash
+        self.ntpOffsetHistory = deque(maxlen=NTP_DRIFT_WINDOW) # (monotonic time, median offset)
+        self.ftpSessionDict = {}  # (ipAddr, port, user) -> kept login ftplib.FTP session
         self.ntpClient = ntplib.NTPClient()
+        self._lock = threading.Lock()
+        self._icmpId = os.getpid() & 0xFFFF
         
     def _parseTarget(self, target):
         """ Validate the input target IP-address/domain-name"""
         target = str(target).replace(' ', '')
         return '127.0.0.1' if target.lower() == 'localhost' else target
 
+    def _resolveTarget(self, target):
+        """ Resolve the target through the DNS cache, return (ipAddr/None, resolve time(ms))."""
+        return self.dnsCache.resolve(self._parseTarget(target))
+
 #-----------------------------------------------------------------------------
     def checkPing(self, target, timeout=0.5):
         """ Check whether the target is pingable (ICMP service avaliable).
@@ -75,6 +309,11 @@ class networkServiceProber(Prober):
         """
         target = self._parseTarget(target)
         resultDict = {'target': target, 'ping': None}
+        pingDict = self.pingTargets([target], timeout=timeout)
+        if pingDict is not None:
+            resultDict['ping'] = pingDict[target]['ping']
+            return resultDict
+        # No permission to open the ICMP socket, use pythonping instead.
         try:
             data = ping(target, timeout=timeout, verbose=False)
             if data.rtt_max_ms < timeout*1000:
@@ -83,6 +322,225 @@ class networkServiceProber(Prober):
             self._debugPrint("Error: checkPing(): target [%s] not pingable, " %target, logType=self._logWarning)
         return resultDict
 
+#-----------------------------------------------------------------------------
+    def pingTargets(self, targetList, count=3, timeout=0.5):
+        """ Ping a list of targets in one timeout window. All the echo requests 
+            are sent from one ICMP socket (raw socket or the unprivileged ICMP 
+            datagram socket), every request gets an unique sequence number so the
+            replies can be matched by the ICMP ID + sequence number.
+            Args:
+                targetList (list): [IP-address/domain-name, ...]
+                count (int, optional): echo requests sent to each target. Defaults to 3.
+                timeout (float, optional): time to wait the replies after the 
+                    last request is sent. Defaults to 0.5.
+            Returns:
+                dict(): {'<target>': {'ping': [min(ms), avg(ms), max(ms)] or None,
+                                      'loss': <lost requests percent 0.0-1.0>}, ...}, 
+                        None if the ICMP socket can not be created.
+        """
+        icmpSock, rawFlg = self._openIcmpSocket()
+        if icmpSock is None: return None
+        self._icmpId = (self._icmpId + 1) & 0xFFFF
+        icmpId = self._icmpId
+        resultDict = {}
+        rttDict = {}
+        ipDict = {}
+        for target in targetList:
+            target = self._parseTarget(target)
+            resultDict[target] = {'ping': None, 'loss': 1.0}
+            rttDict[target] = []
+            ipAddr, _ = self._resolveTarget(target)
+            if ipAddr is None:
+                self._debugPrint("Error: pingTargets(): Invalid host: [%s]" %target, logType=self._logWarning)
+                continue
+            ipDict[target] = ipAddr
+        # seq -> (target, ip, send time)
+        pendingDict = {}
+        seq = 0
+        try:
+            for _ in range(count):
+                for target, ipAddr in ipDict.items():
+                    seq = (seq + 1) & 0xFFFF
+                    try:
+                        icmpSock.sendto(self._buildEchoRequest(icmpId, seq), (ipAddr, 0))
+                        pendingDict[seq] = (target, ipAddr, time.monotonic())
+                    except OSError as err:
+                        self._debugPrint("Error: pingTargets(): send to [%s] failed: %s" %(target, str(err)), 
+                                         logType=self._logWarning)
+            deadline = time.monotonic() + timeout
+            while pendingDict:
+                remainT = deadline - time.monotonic()
+                if remainT <= 0: break
+                icmpSock.settimeout(remainT)
+                try:
+                    data, addr = icmpSock.recvfrom(1024)
+                except socket.timeout:
+                    break
+                recvT = time.monotonic()
+                # The raw socket receive the IP header, the datagram socket doesn't.
+                offset = (data[0] & 0x0F) * 4 if rawFlg else 0
+                if len(data) < offset + 8: continue
+                icmpType, _, _, replyId, replySeq = struct.unpack_from(ICMP_HEADER_FMT, data, offset)
+                # The kernel rewrite the ID to the socket's port for the datagram socket.
+                if icmpType != ICMP_ECHO_REP or (rawFlg and replyId != icmpId): continue
+                if replySeq not in pendingDict or pendingDict[replySeq][1] != addr[0]: continue
+                target, _, sendT = pendingDict.pop(replySeq)
+                rttDict[target].append((recvT - sendT)*1000)
+        except Exception as err:
+            self._debugPrint("Exception happens: %s" %str(err), logType=self._logException)
+        finally:
+            icmpSock.close()
+        for target, rttList in rttDict.items():
+            if target not in ipDict: continue
+            resultDict[target]['loss'] = 1 - len(rttList)/count if count else 1.0
+            if rttList:
+                resultDict[target]['ping'] = [min(rttList), sum(rttList)/len(rttList), max(rttList)]
+        return resultDict
+
+#-----------------------------------------------------------------------------
+    def tracePath(self, target, maxHops=TRACE_MAX_HOPS, timeout=1, proto='icmp'):
+        """ Trace the route to the target. The TTL-stepped probes of all the hops
+            are sent at the same time (not hop by hop) so the whole trace finishes
+            in about one timeout window. Needs the raw ICMP socket permission.
+            Args:
+                target (str): IP-address/domain-name
+                maxHops (int, optional): max TTL probed. Defaults to TRACE_MAX_HOPS.
+                timeout (float, optional): time to wait the replies. Defaults to 1 sec.
+                proto (str, optional): probe type 'icmp' (echo request) or 'udp' 
+                    (datagram to port 33434+TTL). Defaults to 'icmp'.
+            Returns:
+                dict: {'target': '<target>', 
+                       'reached': <bool>,
+                       'hops': [[<hop IP or None>, <rtt(ms) or None>], ...] # index = TTL-1
+                       'pathHash': <hash of the hops address>,
+                       'changed': <path hash different from last trace>}
+                      None if the raw ICMP socket can not be created.
+        """
+        target = self._parseTarget(target)
+        resultDict = {'target': target, 'reached': False, 'hops': [], 'pathHash': None, 'changed': False}
+        ipAddr, _ = self._resolveTarget(target)
+        if ipAddr is None:
+            self._debugPrint("Error: tracePath(): Invalid host: [%s]" %target, logType=self._logWarning)
+            return resultDict
+        icmpSock, rawFlg = self._openIcmpSocket()
+        if icmpSock is None: return None
+        if not rawFlg:
+            # The ICMP datagram socket doesn't deliver the ICMP error messages.
+            icmpSock.close()
+            self._debugPrint("Error: tracePath(): need raw socket permission.", logType=self._logWarning)
+            return None
+        udpSock = None
+        self._icmpId = (self._icmpId + 1) & 0xFFFF
+        icmpId = self._icmpId
+        hopList = [[None, None] for _ in range(maxHops)]
+        sendDict = {}   # ttl -> send time
+        destTtl = None
+        try:
+            if proto == 'udp':
+                udpSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                udpSock.bind(('', 0))
+                udpPort = udpSock.getsockname()[1]
+            for ttl in range(1, maxHops+1):
+                sendSock = udpSock if udpSock else icmpSock
+                sendSock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+                sendDict[ttl] = time.monotonic()
+                if udpSock:
+                    udpSock.sendto(b'\x00'*32, (ipAddr, TRACE_UDP_PORT + ttl))
+                else:
+                    icmpSock.sendto(self._buildEchoRequest(icmpId, ttl), (ipAddr, 0))
+            deadline = time.monotonic() + timeout
+            while True:
+                remainT = deadline - time.monotonic()
+                if remainT <= 0: break
+                # finished when all the hops before the target replied.
+                if destTtl and all(hop[0] for hop in hopList[:destTtl]): break
+                icmpSock.settimeout(remainT)
+                try:
+                    data, addr = icmpSock.recvfrom(1024)
+                except socket.timeout:
+                    break
+                recvT = time.monotonic()
+                ttl, destFlg = self._parseTraceReply(data, ipAddr, icmpId, udpPort if udpSock else None)
+                if ttl is None or ttl > maxHops or hopList[ttl-1][0]: continue
+                hopList[ttl-1] = [addr[0], (recvT - sendDict[ttl])*1000]
+                if destFlg and (destTtl is None or ttl < destTtl): destTtl = ttl
+        except Exception as err:
+            self._debugPrint("Exception happens: %s" %str(err), logType=self._logException)
+        finally:
+            icmpSock.close()
+            if udpSock: udpSock.close()
+        resultDict['reached'] = destTtl is not None
+        resultDict['hops'] = hopList[:destTtl] if destTtl else hopList
+        pathStr = ','.join([str(hop[0]) for hop in resultDict['hops']])
+        resultDict['pathHash'] = hashlib.sha1(pathStr.encode('utf-8')).hexdigest()[:16]
+        hashKey = ':'.join((target, proto))
+        lastHash = self.pathHashDict.get(hashKey)
+        resultDict['changed'] = lastHash is not None and lastHash != resultDict['pathHash']
+        self.pathHashDict[hashKey] = resultDict['pathHash']
+        return resultDict
+
+    def _parseTraceReply(self, data, destIp, icmpId, udpPort):
+        """ Parse the packet received by the raw ICMP socket.
+            Returns:
+                tuple: (probe TTL or None if not our probe's reply, destination reached flag)
+        """
+        offset = (data[0] & 0x0F) * 4
+        if len(data) < offset + 8: return (None, False)
+        icmpType, icmpCode, _, replyId, replySeq = struct.unpack_from(ICMP_HEADER_FMT, data, offset)
+        if icmpType == ICMP_ECHO_REP:
+            if udpPort is not None or replyId != icmpId: return (None, False)
+            return (replySeq, True)
+        if icmpType not in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACH): return (None, False)
+        # The ICMP error carries the original IP header + first 8 bytes of the probe.
+        origOffset = offset + 8
+        if len(data) < origOffset + 20: return (None, False)
+        origIhl = (data[origOffset] & 0x0F) * 4
+        if socket.inet_ntoa(data[origOffset+16:origOffset+20]) != destIp: return (None, False)
+        probeOffset = origOffset + origIhl
+        if len(data) < probeOffset + 8: return (None, False)
+        destFlg = icmpType == ICMP_DEST_UNREACH
+        if udpPort is None:
+            probeType, _, _, probeId, probeSeq = struct.unpack_from(ICMP_HEADER_FMT, data, probeOffset)
+            if probeType != ICMP_ECHO_REQ or probeId != icmpId: return (None, False)
+            return (probeSeq, destFlg)
+        srcPort, dstPort = struct.unpack_from('!HH', data, probeOffset)
+        if srcPort != udpPort: return (None, False)
+        return (dstPort - TRACE_UDP_PORT, destFlg)
+
+    def _openIcmpSocket(self):
+        """ Open a raw ICMP socket, fall back to the unprivileged ICMP datagram 
+            socket (linux net.ipv4.ping_group_range) if no permission.
+            Returns:
+                tuple: (socket, raw socket flag), (None, False) if both failed.
+        """
+        for sockType, rawFlg in ((socket.SOCK_RAW, True), (socket.SOCK_DGRAM, False)):
+            try:
+                icmpSock = socket.socket(socket.AF_INET, sockType, socket.IPPROTO_ICMP)
+            except (OSError, ValueError):
+                continue
+            try:
+                # Enlarge the receive buffer so the replies burst from a big cluster will not be dropped.
+                icmpSock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ICMP_RCVBUF_SZ)
+            except OSError:
+                pass
+            return (icmpSock, rawFlg)
+        return (None, False)
+
+    def _buildEchoRequest(self, icmpId, seq):
+        """ Build the ICMP echo request packet bytes."""
+        payload = struct.pack('!d', time.time()).ljust(ICMP_PAYLOAD_SZ, b'Q')
+        header = struct.pack(ICMP_HEADER_FMT, ICMP_ECHO_REQ, 0, 0, icmpId, seq)
+        checksum = self._getChecksum(header + payload)
+        return struct.pack(ICMP_HEADER_FMT, ICMP_ECHO_REQ, 0, checksum, icmpId, seq) + payload
+
+    def _getChecksum(self, data):
+        """ RFC 1071 internet checksum."""
+        if len(data) % 2: data += b'\x00'
+        total = sum(struct.unpack('!%dH' % (len(data)//2), data))
+        total = (total >> 16) + (total & 0xFFFF)
+        total += total >> 16
+        return ~total & 0xFFFF
+
 #----------------------------------------------------------------------------- 
     def checkTcpConn(self, target, portList, timeout=1):
         """ Check a target's TCP service's ports are connectable.
@@ -91,34 +549,148 @@ class networkServiceProber(Prober):
                 portList (list): [int, ...]
                 timeout (float, optional): TCP connection timeout. Defaults to 1 sec.
             Returns:
-                dict() : {'target': '<target>', '<port1>": True/Fase, ...}
+                dict() : {'target': '<target>', 'dns': <resolve time(ms)>, '<port1>": True/Fase, ...,
+                          'latency': {'<port1>': <connect time(ms) or None>, ...}}
         """
         resultDict = {'target': target}
-        try:
-            target = socket.gethostbyname(self._parseTarget(target)) # translate hostname to IPv4 if it is a doman
-        except:
+        ipAddr, resultDict['dns'] = self._resolveTarget(target)
+        if ipAddr is None:
             self._debugPrint("Error: checkTcpConn() Invalid host: [%s]" %str(target), logType=self._logError)
             return resultDict
-        
-        socket.setdefaulttimeout(timeout)
-        for port in portList:
-            resultDict[str(port)] = False
-            try:
-                result = self.tcpPortChecker.connect_ex((str(target), int(port)))
-                resultDict[str(port)] = result == 0
-            except socket.gaierror as err:
-                resultDict['target'] = None
-                self._debugPrint("Hostname [%s] Could Not Be Resolved." %str(target), logType=self._logError)
-                break
-            except socket.error:
-                resultDict['target'] = None
-                self._debugPrint("Host ip [%s] is not reponsed." %str(target), logType=self._logError)
-                break
-            except Exception as err:
-                self._debugPrint("Exception happens: %s" %str(err), logType=self._logException)
+        portsDict = self.scanTcpPorts({ipAddr: portList}, timeout=timeout).get(ipAddr) or {}
+        latencyDict = {}
+        for port, portState in portsDict.items():
+            resultDict[port] = portState['state'] == 'open'
+            latencyDict[port] = portState['latency'] if resultDict[port] else None
+            if resultDict[port]:
+                histKey = ':'.join((str(target), port))
+                if histKey not in self.tcpLatencyDict: self.tcpLatencyDict[histKey] = logLinearHistogram()
+                self.tcpLatencyDict[histKey].add(latencyDict[port])
+        resultDict['latency'] = latencyDict
+        return resultDict
+
+#----------------------------------------------------------------------------- 
+    def getTcpLatencyHist(self, rawFlg=True, resetFlg=False):
+        """ Get the TCP connect latency histograms recorded by checkTcpConn().
+            Args:
+                rawFlg (bool, optional): include the histogram buckets so the hub 
+                    can merge the same service's histograms from different agents. 
+                    Defaults to True.
+                resetFlg (bool, optional): clear the histograms after read. Defaults to False.
+            Returns:
+                dict: {'<target>:<port>': {'count': <samples>, 'p50': <ms>, 'p90': <ms>, 
+                                           'p99': <ms>, 'hist': <logLinearHistogram.toDict()>}, ...}
+        """
+        resultDict = {}
+        for histKey, hist in list(self.tcpLatencyDict.items()):
+            resultDict[histKey] = {'count': hist.total}
+            resultDict[histKey].update(hist.getQuantiles())
+            if rawFlg: resultDict[histKey]['hist'] = hist.toDict()
+        if resetFlg: self.tcpLatencyDict = {}
+        return resultDict
+
+#----------------------------------------------------------------------------- 
+    def scanTcpPorts(self, jobDict, timeout=1, maxInflight=MAX_INFLIGHT):
+        """ Scan a batch of TCP ports on several hosts concurrently. Every port is 
+            connected by its own non-blocking socket and the connections are 
+            multiplexed by the <selectors> (epoll/kqueue/select) so thousands of 
+            connect() can be kept in flight, all the ports share one deadline.
+            Args:
+                jobDict (dict): {'<host1>': [port1, port2, ...], ...}
+                timeout (float, optional): deadline of the whole scan. Defaults to 1 sec.
+                maxInflight (int, optional): max number of connections in flight.
+                    Defaults to MAX_INFLIGHT.
+            Returns:
+                dict(): {'<host1>': {'<port1>': {'state': <open/closed/timeout/error/skipped>,
+                                                 'latency': <connect time (ms) or None>}, 
+                                     ...}, 
+                         '<host2>': None, # host can not be resolved.
+                         ...}
+                'timeout': connect() started but not finished before the deadline.
+                'skipped': connect() not started before the deadline (too many 
+                           ports for the deadline/maxInflight).
+        """
+        resultDict = {}
+        jobQueue = deque()
+        for host, portList in jobDict.items():
+            hostKey = str(host)
+            ipAddr, _ = self._resolveTarget(host)
+            if ipAddr is None:
+                self._debugPrint("Hostname [%s] Could Not Be Resolved." %hostKey, logType=self._logError)
+                resultDict[hostKey] = None
                 continue
+            resultDict[hostKey] = {}
+            for port in portList:
+                resultDict[hostKey][str(port)] = {'state': 'skipped', 'latency': None}
+                jobQueue.append((hostKey, ipAddr, port))
+
+        selector = selectors.DefaultSelector()
+        deadline = time.monotonic() + timeout
+        inflight = 0
+        try:
+            while jobQueue or inflight:
+                # Fill the connection window.
+                while jobQueue and inflight < maxInflight and time.monotonic() < deadline:
+                    hostKey, ipAddr, port = jobQueue.popleft()
+                    portState = resultDict[hostKey][str(port)]
+                    try:
+                        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    except OSError as err:
+                        if not inflight:
+                            self._debugPrint("Can not create socket: %s" %str(err), logType=self._logError)
+                            portState['state'] = 'error'
+                            continue
+                        # Run out of file descriptors, wait for the in flight ones.
+                        jobQueue.appendleft((hostKey, ipAddr, port))
+                        break
+                    try:
+                        sock.setblocking(False)
+                        startT = time.monotonic()
+                        code = sock.connect_ex((ipAddr, int(port)))
+                    except (OSError, OverflowError, ValueError, TypeError) as err:
+                        # Invalid port, only this port's scan fails.
+                        self._debugPrint("Can not connect [%s:%s]: %s" %(hostKey, str(port), str(err)), 
+                                         logType=self._logWarning)
+                        portState['state'] = 'error'
+                        sock.close()
+                        continue
+                    if code in CONN_PENDING_CODES:
+                        portState['state'] = 'timeout' # till the connection finishes.
+                        selector.register(sock, selectors.EVENT_WRITE, (portState, startT))
+                        inflight += 1
+                        continue
+                    portState['latency'] = (time.monotonic() - startT)*1000
+                    portState['state'] = self._getConnState(code)
+                    sock.close()
+                remainT = deadline - time.monotonic()
+                if remainT <= 0 or not inflight: break
+                for key, _ in selector.select(remainT):
+                    sock = key.fileobj
+                    portState, startT = key.data
+                    portState['latency'] = (time.monotonic() - startT)*1000
+                    try:
+                        portState['state'] = self._getConnState(sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR))
+                    except OSError as err:
+                        portState['state'] = 'error'
+                    selector.unregister(sock)
+                    sock.close()
+                    inflight -= 1
+        except Exception as err:
+            self._debugPrint("Exception happens: %s" %str(err), logType=self._logException)
+        finally:
+            # Connections not finished before the deadline keep the 'timeout' state,
+            # the ports not started keep the 'skipped' state.
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
         return resultDict
 
+    def _getConnState(self, code):
+        """ Convert a socket connect error code to the port state string."""
+        if code == 0: return 'open'
+        if code == errno.ECONNREFUSED or code == 10061: return 'closed' # 10061: WSAECONNREFUSED
+        return 'error'
+
 #----------------------------------------------------------------------------- 
     def checkNtpConn(self, target, pingFlg=False, portFlg=False, ntpPort=123):
         """ Check whether a NTP(Network Time Protocol) service is avaliable. As if we use the nmap
@@ -132,97 +704,407 @@ class networkServiceProber(Prober):
                 ntpPort (int, optional): ntp port. Defaults to 123.
 
             Returns:
-                dict() : {'target': '<target>', 'ping': [...], 'ntp': <time offset> }
+                dict() : {'target': '<target>', 'dns': <resolve time(ms)>, 'ping': [...], 'ntp': <time offset> }
         """
         target = self._parseTarget(target)
-        resultDict = {'target': target, 'ping': None, 'ntp': None}
+        resultDict = {'target': target, 'dns': None, 'ping': None, 'ntp': None}
         # Check ping
         if pingFlg:resultDict.update(self.checkPing(target))
         # Check port Open
         if portFlg: resultDict.update(self.checkTcpConn(target, [ntpPort]))
+        ipAddr, resultDict['dns'] = self._resolveTarget(target)
+        if ipAddr is None:
+            self._debugPrint("Time server [%s] can not be resolved" % str(target), logType=self._logWarning)
+            return resultDict
         # Fetch time offset data
         try:
-            data = self.ntpClient.request(target, version=3)
+            data = self.ntpClient.request(ipAddr, version=3)
             resultDict['ntp'] = data.offset
         except Exception as err:
             self._debugPrint("Time server [%s] not response" % str(target), self._logException)
         return resultDict
 
 #----------------------------------------------------------------------------- 
-    def checkHttpConn(self, target, requestConfig, timeout=3):
+    def checkTimeQuality(self, serverList, timeout=1, ntpPort=NTP_PORT):
+        """ Query several NTP servers at the same time in one timeout window from
+            one UDP socket, take the median offset of the servers and estimate the
+            local clock drift by the linear regression of the last offsets.
+            Args:
+                serverList (list): [NTP server IP-address/domain-name, ...]
+                timeout (float, optional): time to wait the replies. Defaults to 1 sec.
+                ntpPort (int, optional): ntp port. Defaults to NTP_PORT.
+            Returns:
+                dict: {'target': 'ntpServers',
+                       'servers': {'<server>': {'offset': <sec>, 'delay': <sec>, 'stratum': <int>, 
+                                                'rootDelay': <sec>, 'rootDispersion': <sec>} or None, ...},
+                       'offset': <median offset(sec)>, 
+                       'rootDelay': <median root delay(sec)>,
+                       'rootDispersion': <median root dispersion(sec)>,
+                       'drift': <clock drift(ppm)> or None if not enough samples}
+        """
+        resultDict = {'target': 'ntpServers', 'servers': {}, 'offset': None, 
+                      'rootDelay': None, 'rootDispersion': None, 'drift': None}
+        pendingDict = {}    # ipAddr -> [server, ...]
+        for server in serverList:
+            server = self._parseTarget(server)
+            resultDict['servers'][server] = None
+            ipAddr, _ = self._resolveTarget(server)
+            if ipAddr is None:
+                self._debugPrint("Time server [%s] can not be resolved" % str(server), logType=self._logWarning)
+                continue
+            pendingDict.setdefault(ipAddr, []).append(server)
+        if not pendingDict: return resultDict
+        ntpSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sendDict = {}       # ipAddr -> (request bytes, send time)
+        try:
+            for ipAddr in pendingDict.keys():
+                origT = time.time()
+                request = self._buildNtpRequest(origT)
+                sendDict[ipAddr] = (request, origT)
+                try:
+                    ntpSock.sendto(request, (ipAddr, ntpPort))
+                except OSError as err:
+                    self._debugPrint("Time server [%s] send error: %s" %(ipAddr, str(err)), logType=self._logWarning)
+            deadline = time.monotonic() + timeout
+            while pendingDict:
+                remainT = deadline - time.monotonic()
+                if remainT <= 0: break
+                ntpSock.settimeout(remainT)
+                try:
+                    data, addr = ntpSock.recvfrom(1024)
+                except socket.timeout:
+                    break
+                except OSError:
+                    continue    # ICMP port unreachable from one of the servers.
+                destT = time.time()
+                if addr[0] not in pendingDict: continue
+                request, origT = sendDict[addr[0]]
+                # The server copies our transmit timestamp to the origin timestamp.
+                if data[24:32] != request[40:48]: continue
+                try:
+                    replyDict = self._parseNtpReply(data, origT, destT)
+                except ValueError as err:
+                    self._debugPrint("Time server [%s] reply invalid: %s" %(addr[0], str(err)), logType=self._logWarning)
+                    continue
+                for server in pendingDict.pop(addr[0]):
+                    resultDict['servers'][server] = replyDict
+        except Exception as err:
+            self._debugPrint("Exception happens: %s" %str(err), logType=self._logException)
+        finally:
+            ntpSock.close()
+        replyList = [replyDict for replyDict in resultDict['servers'].values() if replyDict]
+        if not replyList: return resultDict
+        for key in ('offset', 'rootDelay', 'rootDispersion'):
+            resultDict[key] = median([replyDict[key] for replyDict in replyList])
+        self.ntpOffsetHistory.append((time.monotonic(), resultDict['offset']))
+        resultDict['drift'] = self._getClockDrift()
+        return resultDict
+
+    def _getClockDrift(self):
+        """ Least squares slope of the offset history, in ppm (us per sec)."""
+        if len(self.ntpOffsetHistory) < 3: return None
+        baseT = self.ntpOffsetHistory[0][0]
+        timeList = [sample[0] - baseT for sample in self.ntpOffsetHistory]
+        offsetList = [sample[1] for sample in self.ntpOffsetHistory]
+        avgT = sum(timeList)/len(timeList)
+        avgOffset = sum(offsetList)/len(offsetList)
+        varT = sum((t - avgT)**2 for t in timeList)
+        if varT <= 0: return None
+        covar = sum((t - avgT)*(offset - avgOffset) for t, offset in zip(timeList, offsetList))
+        return covar / varT * 1e6
+
+    def _buildNtpRequest(self, origT):
+        """ Build a 48 bytes NTP v3 client mode request with the transmit timestamp."""
+        ntpT = origT + NTP_EPOCH_DELTA
+        packet = bytearray(48)
+        packet[0] = (0 << 6) | (3 << 3) | 3  # LI=0, VN=3, Mode=3 (client)
+        struct.pack_into('!II', packet, 40, int(ntpT), int((ntpT % 1) * 2**32))
+        return bytes(packet)
+
+    def _parseNtpReply(self, data, origT, destT):
+        """ Parse the NTP server reply, the clock offset and round trip delay are:
+            offset = ((recvT - origT) + (transT - destT)) / 2
+            delay = (destT - origT) - (transT - recvT)
+            Returns:
+                dict: {'offset': <sec>, 'delay': <sec>, 'stratum': <int>, 
+                       'rootDelay': <sec>, 'rootDispersion': <sec>}
+        """
+        if len(data) < 48: raise ValueError("NTP reply too short: %s bytes" %str(len(data)))
+        fieldList = struct.unpack(NTP_PACKET_FMT, data[:48])
+        stratum = fieldList[1]
+        if stratum == 0: raise ValueError("NTP kiss-of-death reply: %s" %str(fieldList[6]))
+        recvT = fieldList[11] + fieldList[12] / 2**32 - NTP_EPOCH_DELTA
+        transT = fieldList[13] + fieldList[14] / 2**32 - NTP_EPOCH_DELTA
+        return {'offset': ((recvT - origT) + (transT - destT)) / 2,
+                'delay': (destT - origT) - (transT - recvT),
+                'stratum': stratum,
+                'rootDelay': fieldList[4] / 2**16,
+                'rootDispersion': fieldList[5] / 2**16}
+
+#----------------------------------------------------------------------------- 
+    def checkHttpConn(self, target, requestConfig, timeout=3, poolFlg=False):
         """ Check a http/https service is connectable.
             Args:
                 target (str): IP-address/domain-name
                 requestConfig (dict): { 'conn': <'http'/'https'>, 
                                         'port': <int>, 
                                         'req':  <Request type str ('GET. 'HEAD'')>, 
-                                        'par' : <request parameter str('/')>}
+                                        'par' : <request parameter str('/')>,
+                                        'body': <bool, read the response body. Default False>}
                 timeout (int, optional): connection timeout. Defaults to 3.
+                poolFlg (bool, optional): whether keep the connection alive in the 
+                    pool and reuse it for the next check. Defaults to False.
 
             Returns:
                 dict: { target': target, 
                         'conn': 'http',
                         'port': 80 
-                        '<req>:<par>' :(status, reason)}
+                        'dns': <resolve time(ms)>,
+                        '<req>:<par>' :(status, reason),
+                        'timing': {'dns': <ms>, 'connect': <ms>, 'tls': <ms>, 'ttfb': <ms>, 
+                                   'transfer': <ms>, 'bytes': <body bytes>} (None if 
+                                   the phase is not executed or failed),
+                        'timingPct': {'<phase>': {'p50': <ms>, 'p90': <ms>, 'p99': <ms>}, ...}
+                                     (None if the request failed)}
+                      if poolFlg is set, these keys will be added:
+                        'reuse': <whether the kept alive connection is used>,
+                        'fresh': <last successful request latency(ms) on a new connection>,
+                        'warm': <last successful request latency(ms) on a kept alive connection>
         """
         target = self._parseTarget(target)
         #target = target.replace('http', 'https') if 'http://' in target else 'https://' + target
         resultDict = {  'target': target, 
                         'conn': 'http',
-                        'port': 80 }
+                        'port': 80,
+                        'dns': None }
         if 'conn' in requestConfig.keys(): resultDict['conn'] = str(requestConfig['conn']).lower()
         if 'port' in requestConfig.keys(): resultDict['port'] = int(requestConfig['port'])
-        conn = http.client.HTTPSConnection(target, resultDict['port'], timeout) if resultDict['conn'] == 'https' else http.client.HTTPConnection(
-            target, resultDict['port'], timeout)
         req = requestConfig['req'] if 'req' in requestConfig.keys() else 'HEAD'
         par = requestConfig['par'] if 'par' in requestConfig.keys() else '/'
-        resultDict[':'.join((req, par))] = None
-        try:
-            conn.request(req, par)
-            rst = conn.getresponse()
-            resultDict[':'.join((req, par))] = (rst.status, rst.reason)
-        except Exception as error:
-            self._debugPrint("Error when connect to the target: %s " %str(target), logType=self._logException)
-        if conn: conn.close()
+        bodyFlg = bool(requestConfig['body']) if 'body' in requestConfig.keys() else False
+        reqKey = ':'.join((req, par))
+        resultDict[reqKey] = None
+        ipAddr, resultDict['dns'] = self._resolveTarget(target)
+        resultDict['timing'] = dict.fromkeys(HTTP_PHASES + ('bytes',))
+        resultDict['timing']['dns'] = resultDict['dns']
+        resultDict['timingPct'] = None
+        if ipAddr is None:
+            self._debugPrint("Http target [%s] can not be resolved" %str(target), logType=self._logWarning)
+            return resultDict
+        poolKey = (resultDict['conn'], target, resultDict['port'])
+        conn = self.httpPool.getConn(poolKey) if poolFlg else None
+        reuseFlg = conn is not None
+        latency = None
+        while True:
+            if conn is None: conn = self._newHttpConn(resultDict['conn'], target, resultDict['port'], ipAddr, timeout)
+            timingDict = dict.fromkeys(HTTP_PHASES + ('bytes',))
+            timingDict['dns'] = resultDict['dns']
+            resultDict['timing'] = timingDict   # the phases not finished stay None if failed.
+            startT = time.monotonic()
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    timingDict['connect'] = conn.tcpConnTime
+                    if resultDict['conn'] == 'https':
+                        timingDict['tls'] = max(0, (time.monotonic() - startT)*1000 - conn.tcpConnTime)
+                reqT = time.monotonic()
+                conn.request(req, par)
+                rst = conn.getresponse()
+                timingDict['ttfb'] = (time.monotonic() - reqT)*1000
+                # Read the body so the connection can be used for the next request.
+                if poolFlg or bodyFlg: 
+                    bodyT = time.monotonic()
+                    timingDict['bytes'] = len(rst.read())
+                    timingDict['transfer'] = (time.monotonic() - bodyT)*1000
+                latency = (time.monotonic() - startT)*1000
+                resultDict[reqKey] = (rst.status, rst.reason)
+                resultDict['timingPct'] = self._addHttpTiming(poolKey + (reqKey,), timingDict)
+                if rst.will_close: 
+                    conn.close()
+                    conn = None
+                break
+            except Exception as error:
+                conn.close()
+                conn = None
+                # The kept alive connection may be closed by the server, retry with a fresh one.
+                if reuseFlg:
+                    reuseFlg = False
+                    continue
+                self._debugPrint("Error when connect to the target: %s " %str(target), logType=self._logException)
+                break
+        if poolFlg:
+            resultDict.update(self.httpPool.record(poolKey, reuseFlg, latency))
+            if conn: self.httpPool.putConn(poolKey, conn)
+        elif conn:
+            conn.close()
         return resultDict
 
+    def _newHttpConn(self, connType, target, port, ipAddr, timeout):
+        """ Create a http/https connection which connects to the resolved ipAddr."""
+        conn = http.client.HTTPSConnection(target, port, timeout=timeout) if connType == 'https' else http.client.HTTPConnection(
+            target, port, timeout=timeout)
+        conn.tcpConnTime = None
+        def _createConnection(address, *args):
+            # Connect to the cached address, the host name is still used for the Host header and TLS SNI.
+            startT = time.monotonic()
+            sock = socket.create_connection((ipAddr, address[1]), *args)
+            conn.tcpConnTime = (time.monotonic() - startT)*1000
+            return sock
+        conn._create_connection = _createConnection
+        return conn
+
+    def _addHttpTiming(self, key, timingDict):
+        """ Add the http phases timing to the rolling windows and return the percentiles."""
+        if key not in self.httpTimingDict:
+            self.httpTimingDict[key] = {phase: rollingWindow(size=HTTP_TIMING_WINDOW) for phase in HTTP_PHASES}
+        pctDict = {}
+        for phase, window in self.httpTimingDict[key].items():
+            window.add(timingDict[phase])
+            pctDict[phase] = window.getPercentiles()
+        return pctDict
+
 #----------------------------------------------------------------------------- 
-    def checkFtpConn(self, target, loginConfig=None, timeout=3):
+    def checkFtpConn(self, target, loginConfig=None, timeout=3, mode='login', ftpPort=FTP_PORT):
         """ Check a ftp service is connectable.
             Args:
                 target (str): IP-address/domain-name
                 loginConfig (dict, optional): {'user':<str>, 'password':<str>}. Defaults to None.
                 timeout (int, optional): connection timeout.. Defaults to 3.
-
+                mode (str, optional): 
+                    'banner': only connect, read the 220 greeting and QUIT, no login.
+                    'login': login in a new session then QUIT.
+                    'session': login once and keep the session, the following 
+                        checks send a NOOP on the kept session (re-login if broken).
+                    Defaults to 'login'.
+                ftpPort (int, optional): ftp port. Defaults to FTP_PORT.
             Returns:
-                _type_: { 'target': <target>, 'conn': False, 'login': <Login state> }
+                _type_: { 'target': <target>, 'dns': <resolve time(ms)>, 'conn': False, 'login': <Login state>,
+                          'connect': <tcp connect time(ms)>, 'greeting': <220 greeting time(ms)>,
+                          'reuse': <session reused flag>, 'noop': <NOOP reply time(ms)> }
         """
         target = self._parseTarget(target)
-        resultDict = { 'target': target, 'conn': False, 'login': False }
+        resultDict = { 'target': target, 'dns': None, 'conn': False, 'login': False, 
+                       'connect': None, 'greeting': None }
+        ipAddr, resultDict['dns'] = self._resolveTarget(target)
+        if ipAddr is None:
+            self._debugPrint("FTP server [%s] can not be resolved" %str(target), logType=self._logWarning)
+            return resultDict
+        sessionKey = (ipAddr, int(ftpPort), loginConfig['user'] if loginConfig else 'anonymous')
+        if mode == 'session':
+            resultDict.update({'reuse': False, 'noop': None})
+            with self._lock:
+                ftpClient = self.ftpSessionDict.pop(sessionKey, None)
+            if ftpClient:
+                try:
+                    startT = time.monotonic()
+                    ftpClient.voidcmd('NOOP')
+                    resultDict['noop'] = (time.monotonic() - startT)*1000
+                    resultDict.update({'conn': True, 'login': True, 'reuse': True})
+                    with self._lock:
+                        oldClient = self.ftpSessionDict.pop(sessionKey, None)
+                        self.ftpSessionDict[sessionKey] = ftpClient
+                    self._closeFtpSession(oldClient)
+                    return resultDict
+                except Exception as err:
+                    self._debugPrint("FTP session [%s] broken, reconnect: %s" %(str(target), str(err)), logType=self._logWarning)
+                    self._closeFtpSession(ftpClient, quitFlg=False)
+        ftpClient = None
         try:
-            ftpClient = FTP(target, timeout=timeout)
+            ftpClient = self._openFtpSession(ipAddr, ftpPort, timeout, resultDict)
             resultDict['conn'] = True
-            # try to login to confirm 
-            logResp = ftpClient.login(user=loginConfig['user'], passwd=loginConfig['password']) if loginConfig else ftpClient.login()
-            resultDict['login'] = logResp
+            if mode != 'banner':
+                # try to login to confirm 
+                logResp = ftpClient.login(user=loginConfig['user'], passwd=loginConfig['password']) if loginConfig else ftpClient.login()
+                resultDict['login'] = logResp
+                if mode == 'session':
+                    with self._lock:
+                        oldClient = self.ftpSessionDict.pop(sessionKey, None)
+                        self.ftpSessionDict[sessionKey] = ftpClient
+                    self._closeFtpSession(oldClient)
+                    ftpClient = None
         except Exception as err:
             self._debugPrint("Error to connect to the FTP server: %s" %str(err), self._logException)
+        finally:
+            self._closeFtpSession(ftpClient)
         return resultDict
 
+    def _openFtpSession(self, ipAddr, port, timeout, resultDict):
+        """ Connect the ftp server and read the greeting, the tcp connect and 
+            greeting time (ms) are saved in the resultDict.
+            Returns:
+                ftplib.FTP: the connected ftp client (not login).
+        """
+        startT = time.monotonic()
+        sock = socket.create_connection((ipAddr, int(port)), timeout=timeout)
+        connT = time.monotonic()
+        resultDict['connect'] = (connT - startT)*1000
+        # Same as the FTP.connect() but use the connected socket.
+        ftpClient = FTP(timeout=timeout)
+        ftpClient.host, ftpClient.port = ipAddr, int(port)
+        ftpClient.sock = sock
+        ftpClient.af = sock.family
+        ftpClient.file = sock.makefile('r', encoding=ftpClient.encoding)
+        try:
+            ftpClient.welcome = ftpClient.getresp()
+        except Exception:
+            ftpClient.close()
+            raise
+        resultDict['greeting'] = (time.monotonic() - connT)*1000
+        return ftpClient
+
+    def _closeFtpSession(self, ftpClient, quitFlg=True):
+        """ Close the ftp session by QUIT (close the socket directly if failed)."""
+        if ftpClient is None: return
+        try:
+            if quitFlg: ftpClient.quit()
+        except Exception:
+            pass
+        finally:
+            ftpClient.close()
+
+    def closeFtpSessions(self):
+        """ Close all the kept ftp sessions."""
+        with self._lock:
+            sessionList = list(self.ftpSessionDict.values())
+            self.ftpSessionDict.clear()
+        for ftpClient in sessionList: self._closeFtpSession(ftpClient)
+
 #----------------------------------------------------------------------------- 
-    def checkUrlsConn(self, urlList):
-        """ Check whether a list of url can be opened.
+    def checkUrlsConn(self, urlList, timeout=3):
+        """ Check whether a list of url can be opened, the http/https url host 
+            is resolved through the DNS cache and opened if the server replies 
+            a status code smaller than 400.
             Args:
                     urlList (list): urllist
+                    timeout (int, optional): connection timeout. Defaults to 3.
             Returns:
-                dict: {target: 'urlList', <url1>:<state>, ...}
+                dict: {target: 'urlList', <url1>:<state>, ..., 
+                       'dns': {<url1>: <resolve time(ms)>, ...}}
         """
-        resultDict = { 'target': 'urlList' }
+        resultDict = { 'target': 'urlList', 'dns': {} }
         for url in urlList:
             resultDict[str(url)] = False
+            resultDict['dns'][str(url)] = None
+            urlParts = urlsplit(str(url))
             try:
-                _ = urllib.request.urlopen(url)
-                resultDict[str(url)] = True
+                if urlParts.scheme.lower() not in ('http', 'https') or not urlParts.hostname:
+                    _ = urllib.request.urlopen(url, timeout=timeout)
+                    resultDict[str(url)] = True
+                    continue
+                ipAddr, resultDict['dns'][str(url)] = self._resolveTarget(urlParts.hostname)
+                if ipAddr is None:
+                    self._debugPrint("Url [%s] host can not be resolved" %url, logType=self._logWarning)
+                    continue
+                httpsFlg = urlParts.scheme.lower() == 'https'
+                par = urlParts.path or '/'
+                if urlParts.query: par += '?' + urlParts.query
+                conn = self._newHttpConn('https' if httpsFlg else 'http', urlParts.hostname, 
+                                         urlParts.port or (443 if httpsFlg else 80), ipAddr, timeout)
+                try:
+                    conn.request('GET', par)
+                    resultDict[str(url)] = conn.getresponse().status < 400
+                finally:
+                    conn.close()
             except Exception as err:
                 self._debugPrint("Url [%s] can not be opened" %url, self._logWarning)
         return resultDict
@@ -250,9 +1132,8 @@ def testCase(mode):
     driver = networkServiceProber(debugLogger=Log)
     if mode == 0:
         result = driver.checkPing('172.18.178.6')
-    if mode == 1:
+    elif mode == 1:
         result = driver.checkTcpConn('172.18.178.6', [22, 23])
-
     elif mode ==2:
         result = driver.checkNtpConn('0.sg.pool.ntp.org', pingFlg=False, portFlg=False)
     
@@ -279,6 +1160,43 @@ def testCase(mode):
     elif mode == 5:
         testList = ['https://www.google.com/', '123123']
         result = driver.checkUrlsConn(testList)
+    elif mode == 6:
+        jobDict = {'127.0.0.1': list(range(1, 1025)), 'localhost': [22, 80, 3000]}
+        startT = time.time()
+        result = driver.scanTcpPorts(jobDict, timeout=1)
+        result = {host: {port: state for port, state in ports.items() if state['state'] == 'open'} 
+                  if ports else ports for host, ports in result.items()}
+        print("Scan time used: %s sec" %str(time.time() - startT))
+    elif mode == 7:
+        targetList = ['127.0.0.1', '8.8.8.8', '1.1.1.1', '172.18.178.6']
+        startT = time.time()
+        result = driver.pingTargets(targetList, count=3, timeout=0.5)
+        print("Ping time used: %s sec" %str(time.time() - startT))
+    elif mode == 8:
+        for _ in range(3):
+            result = driver.checkTcpConn('localhost', [22, 80])
+            print(result)
+        result = driver.dnsCache.getStats()
+    elif mode == 9:
+        testhttpCofig = {'port': 3000, 'conn': 'http', 'req': 'GET', 'par': '/'}
+        for _ in range(3):
+            result = driver.checkHttpConn('127.0.0.1', testhttpCofig, poolFlg=True)
+            print(result)
+    elif mode == 10:
+        startT = time.time()
+        result = driver.tracePath('8.8.8.8', timeout=1)
+        print("Trace time used: %s sec" %str(time.time() - startT))
+    elif mode == 11:
+        serverList = ['0.sg.pool.ntp.org', '1.sg.pool.ntp.org', '2.sg.pool.ntp.org', 'time.google.com']
+        for _ in range(3):
+            result = driver.checkTimeQuality(serverList)
+            print(result)
+            time.sleep(1)
+    elif mode == 12:
+        for ftpMode in ('banner', 'login', 'session', 'session'):
+            result = driver.checkFtpConn('ftp.pureftpd.org', mode=ftpMode)
+            print(result)
+        driver.closeFtpSessions()
     print(result)
 
 
@@ -0,0 +1,480 @@
+#-----------------------------------------------------------------------------
+# Name:        networkServiceProberAsync.py
+#
+# Purpose:     This module is the asyncio version of the <networkServiceProber>,
+#              all the service checks (ping, TCP, NTP, http, https, FTP, URL)
+#              are implemented on the asyncio streams and datagram endpoints,
+#              so hundreds of service endpoints can be probed concurrently in
+#              one thread with a cap on the number of open sockets.
+#
+# Author:      Yuancheng Liu
+#
+# Version:     v_0.1
+# Created:     2023/04/02
+# Copyright:   n.a
+# License:     n.a
+#-----------------------------------------------------------------------------
+
+import ssl
+import time
+import socket
+import struct
+import asyncio
+from urllib.parse import urlsplit
+
+from metricStats import logLinearHistogram
+from networkServiceProber import networkServiceProber, ping, DEF_TIMEOUT, \
+    ICMP_HEADER_FMT, ICMP_ECHO_REP, NTP_PORT, FTP_PORT, HTTP_PHASES
+
+MAX_OPEN_SOCKETS = 256      # default cap of the sockets opened at the same time.
+
+#-----------------------------------------------------------------------------
+async def gatherWithLimit(coroList, limit=MAX_OPEN_SOCKETS):
+    """ Run a list of coroutines concurrently with at most <limit> of them
+        running at the same time.
+        Args:
+            coroList (list): [coroutine, ...]
+            limit (int, optional): max coroutines running. Defaults to MAX_OPEN_SOCKETS.
+        Returns:
+            list: results under the coroList sequence, the exception raised by
+                a coroutine will be put in the list as its result.
+    """
+    semaphore = asyncio.Semaphore(max(1, int(limit)))
+    async def _runWithLimit(coro):
+        async with semaphore:
+            return await coro
+    return await asyncio.gather(*[_runWithLimit(coro) for coro in coroList],
+                                return_exceptions=True)
+
+#-----------------------------------------------------------------------------
+class _ntpProtocol(asyncio.DatagramProtocol):
+    """ Datagram protocol to receive one NTP reply, the reply is accepted only 
+        if its origin timestamp is the transmit timestamp of our request.
+    """
+    def __init__(self, future):
+        self.future = future
+        self.transStamp = None  # transmit timestamp bytes of the request sent.
+
+    def datagram_received(self, data, addr):
+        if self.transStamp is None or data[24:32] != self.transStamp: return
+        if not self.future.done(): self.future.set_result((data, time.time()))
+
+    def error_received(self, exc):
+        if not self.future.done(): self.future.set_exception(exc)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class networkServiceProberAsync(networkServiceProber):
+    """ Asyncio variant of the networkServiceProber, all the check<Service>Async()
+        functions are coroutines and return the same result dict as the sync
+        check<Service>() function. Example:
+            driver = networkServiceProberAsync(maxSockets=100)
+            resultList = driver.runChecks([driver.checkHttpConnAsync('127.0.0.1', {'port': 80}),
+                                           driver.checkNtpConnAsync('0.sg.pool.ntp.org')])
+    """
+    def __init__(self, debugLogger=None, maxSockets=MAX_OPEN_SOCKETS) -> None:
+        super().__init__(debugLogger=debugLogger)
+        self.maxSockets = max(1, int(maxSockets))
+        self._sockLimiter = None     # (event loop, semaphore) the semaphore bound to.
+
+    def _getSockLimiter(self):
+        """ Return the semaphore limits the open sockets in the running loop."""
+        loop = asyncio.get_event_loop()
+        if self._sockLimiter is None or self._sockLimiter[0] is not loop:
+            self._sockLimiter = (loop, asyncio.Semaphore(self.maxSockets))
+        return self._sockLimiter[1]
+
+    async def _resolveTargetAsync(self, target):
+        """ Async version of _resolveTarget(), the cache miss is resolved by the
+            event loop resolver. Returns (ipAddr/None, resolve time(ms)).
+        """
+        host = self._parseTarget(target)
+        startT = time.monotonic()
+        hitFlg, ipAddr = self.dnsCache.getCached(host)
+        if not hitFlg:
+            try:
+                addrInfo = await asyncio.get_event_loop().getaddrinfo(host, None, family=socket.AF_INET)
+                ipAddr = addrInfo[0][4][0]
+            except Exception as err:
+                ipAddr = None
+            ipAddr = self.dnsCache.store(host, ipAddr)
+        return (ipAddr, (time.monotonic() - startT)*1000)
+
+#-----------------------------------------------------------------------------
+    def runChecks(self, coroList, limit=None):
+        """ Sync entry to run a list of check coroutines in a new event loop.
+            Args:
+                coroList (list): [check<Service>Async() coroutine, ...]
+                limit (int, optional): max checks running. Defaults to the
+                    max open sockets number.
+            Returns:
+                list: the checks' result under the coroList sequence.
+        """
+        return asyncio.run(gatherWithLimit(coroList, limit=limit or self.maxSockets))
+
+#-----------------------------------------------------------------------------
+    async def checkPingAsync(self, target, timeout=0.5):
+        """ Async version of checkPing().
+            Returns:
+                dict(): {'target': '<target>', 'ping': [min(ms), avg(ms), max(ms)]} if pingable.
+        """
+        target = self._parseTarget(target)
+        resultDict = {'target': target, 'ping': None}
+        pingDict = await self.pingTargetsAsync([target], timeout=timeout)
+        if pingDict is not None:
+            resultDict['ping'] = pingDict[target]['ping']
+            return resultDict
+        # No permission to open the ICMP socket, use pythonping in the executor.
+        try:
+            loop = asyncio.get_event_loop()
+            data = await loop.run_in_executor(None, lambda: ping(target, timeout=timeout, verbose=False))
+            if data.rtt_max_ms < timeout*1000:
+                resultDict['ping'] = [data.rtt_min_ms, data.rtt_avg_ms, data.rtt_max_ms]
+        except Exception as err:
+            self._debugPrint("Error: checkPingAsync(): target [%s] not pingable, " %target, logType=self._logWarning)
+        return resultDict
+
+#-----------------------------------------------------------------------------
+    async def pingTargetsAsync(self, targetList, count=3, timeout=0.5):
+        """ Async version of pingTargets(), the ICMP socket is read by the event
+            loop instead of blocking the thread.
+            Returns:
+                dict(): {'<target>': {'ping': [min(ms), avg(ms), max(ms)] or None,
+                                      'loss': <lost requests percent 0.0-1.0>}, ...},
+                        None if the ICMP socket can not be created.
+        """
+        loop = asyncio.get_event_loop()
+        async with self._getSockLimiter():
+            icmpSock, rawFlg = self._openIcmpSocket()
+            if icmpSock is None: return None
+            icmpSock.setblocking(False)
+            self._icmpId = (self._icmpId + 1) & 0xFFFF
+            icmpId = self._icmpId
+            resultDict, rttDict, ipDict = {}, {}, {}
+            targetList = [self._parseTarget(target) for target in targetList]
+            resolveList = await asyncio.gather(*[self._resolveTargetAsync(target) for target in targetList])
+            for target, (ipAddr, _) in zip(targetList, resolveList):
+                resultDict[target] = {'ping': None, 'loss': 1.0}
+                rttDict[target] = []
+                if ipAddr is None:
+                    self._debugPrint("Error: pingTargetsAsync(): Invalid host: [%s]" %target, logType=self._logWarning)
+                    continue
+                ipDict[target] = ipAddr
+            pendingDict = {}
+            replyQueue = asyncio.Queue()
+            def _onReadable():
+                try:
+                    while True: replyQueue.put_nowait((icmpSock.recvfrom(1024), time.monotonic()))
+                except (BlockingIOError, InterruptedError):
+                    pass
+            loop.add_reader(icmpSock.fileno(), _onReadable)
+            seq = 0
+            try:
+                for _ in range(count):
+                    for target, ipAddr in ipDict.items():
+                        seq = (seq + 1) & 0xFFFF
+                        try:
+                            icmpSock.sendto(self._buildEchoRequest(icmpId, seq), (ipAddr, 0))
+                            pendingDict[seq] = (target, ipAddr, time.monotonic())
+                        except OSError as err:
+                            self._debugPrint("Error: pingTargetsAsync(): send to [%s] failed: %s" %(target, str(err)),
+                                             logType=self._logWarning)
+                deadline = time.monotonic() + timeout
+                while pendingDict:
+                    remainT = deadline - time.monotonic()
+                    if remainT <= 0: break
+                    try:
+                        (data, addr), recvT = await asyncio.wait_for(replyQueue.get(), remainT)
+                    except asyncio.TimeoutError:
+                        break
+                    offset = (data[0] & 0x0F) * 4 if rawFlg else 0
+                    if len(data) < offset + 8: continue
+                    icmpType, _, _, replyId, replySeq = struct.unpack_from(ICMP_HEADER_FMT, data, offset)
+                    if icmpType != ICMP_ECHO_REP or (rawFlg and replyId != icmpId): continue
+                    if replySeq not in pendingDict or pendingDict[replySeq][1] != addr[0]: continue
+                    target, _, sendT = pendingDict.pop(replySeq)
+                    rttDict[target].append((recvT - sendT)*1000)
+            finally:
+                loop.remove_reader(icmpSock.fileno())
+                icmpSock.close()
+        for target, rttList in rttDict.items():
+            if target not in ipDict: continue
+            resultDict[target]['loss'] = 1 - len(rttList)/count if count else 1.0
+            if rttList:
+                resultDict[target]['ping'] = [min(rttList), sum(rttList)/len(rttList), max(rttList)]
+        return resultDict
+
+#-----------------------------------------------------------------------------
+    async def checkTcpConnAsync(self, target, portList, timeout=1):
+        """ Async version of checkTcpConn(), all the ports are connected concurrently.
+            Returns:
+                dict() : {'target': '<target>', 'dns': <resolve time(ms)>, '<port1>": True/False, ...,
+                          'latency': {'<port1>': <connect time(ms) or None>, ...}}
+        """
+        resultDict = {'target': target}
+        ipAddr, resultDict['dns'] = await self._resolveTargetAsync(target)
+        if ipAddr is None:
+            self._debugPrint("Error: checkTcpConnAsync() Invalid host: [%s]" %str(target), logType=self._logError)
+            return resultDict
+        async def _checkPort(port):
+            async with self._getSockLimiter():
+                try:
+                    startT = time.monotonic()
+                    _, writer = await asyncio.wait_for(asyncio.open_connection(ipAddr, int(port)), timeout)
+                    latency = (time.monotonic() - startT)*1000
+                    writer.close()
+                    return latency
+                except Exception:
+                    return None
+        latencyList = await asyncio.gather(*[_checkPort(port) for port in portList])
+        latencyDict = {}
+        for port, latency in zip(portList, latencyList):
+            port = str(port)
+            resultDict[port] = latency is not None
+            latencyDict[port] = latency
+            if resultDict[port]:
+                histKey = ':'.join((str(target), port))
+                if histKey not in self.tcpLatencyDict: self.tcpLatencyDict[histKey] = logLinearHistogram()
+                self.tcpLatencyDict[histKey].add(latency)
+        resultDict['latency'] = latencyDict
+        return resultDict
+
+#-----------------------------------------------------------------------------
+    async def checkNtpConnAsync(self, target, pingFlg=False, portFlg=False, ntpPort=NTP_PORT,
+                                timeout=DEF_TIMEOUT):
+        """ Async version of checkNtpConn(), the NTP(v3) request is sent through
+            an asyncio datagram endpoint.
+            Returns:
+                dict() : {'target': '<target>', 'dns': <resolve time(ms)>, 'ping': [...], 'ntp': <time offset> }
+        """
+        target = self._parseTarget(target)
+        resultDict = {'target': target, 'dns': None, 'ping': None, 'ntp': None}
+        if pingFlg: resultDict.update(await self.checkPingAsync(target))
+        if portFlg: resultDict.update(await self.checkTcpConnAsync(target, [ntpPort]))
+        ipAddr, resultDict['dns'] = await self._resolveTargetAsync(target)
+        if ipAddr is None:
+            self._debugPrint("Time server [%s] can not be resolved" % str(target), logType=self._logWarning)
+            return resultDict
+        loop = asyncio.get_event_loop()
+        async with self._getSockLimiter():
+            transport = None
+            try:
+                future = loop.create_future()
+                transport, protocol = await loop.create_datagram_endpoint(lambda: _ntpProtocol(future),
+                                                                          remote_addr=(ipAddr, ntpPort))
+                origT = time.time()
+                request = self._buildNtpRequest(origT)
+                protocol.transStamp = request[40:48]
+                transport.sendto(request)
+                data, destT = await asyncio.wait_for(future, timeout)
+                resultDict['ntp'] = self._parseNtpReply(data, origT, destT)['offset']
+            except Exception as err:
+                self._debugPrint("Time server [%s] not response" % str(target), logType=self._logWarning)
+            finally:
+                if transport: transport.close()
+        return resultDict
+
+#-----------------------------------------------------------------------------
+    async def _httpRequestAsync(self, host, port, httpsFlg, req, par, timeout, ipAddr=None, 
+                                timingDict=None, bodyFlg=False):
+        """ Send one http(s) request with the asyncio stream and return the
+            response status line. If the ipAddr is given, connect to it and use
+            the host for the Host header and TLS SNI.
+            Args:
+                timingDict (dict, optional): filled with the 'connect', 'tls', 
+                    'ttfb' (and 'transfer', 'bytes' if bodyFlg) phases like checkHttpConn().
+                bodyFlg (bool, optional): read the whole response body. Defaults to False.
+            Returns:
+                tuple: (status, reason)
+        """
+        if timingDict is None: timingDict = {}
+        loop = asyncio.get_event_loop()
+        async with self._getSockLimiter():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                startT = time.monotonic()
+                await asyncio.wait_for(loop.sock_connect(sock, (ipAddr or host, port)), timeout)
+                timingDict['connect'] = (time.monotonic() - startT)*1000
+                tlsT = time.monotonic()
+                sslCtx = ssl.create_default_context() if httpsFlg else None
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(
+                    sock=sock, ssl=sslCtx, server_hostname=host if httpsFlg else None), timeout)
+                if httpsFlg: timingDict['tls'] = (time.monotonic() - tlsT)*1000
+            except BaseException:
+                sock.close()
+                raise
+            try:
+                hostHeader = host if port in (80, 443) else '%s:%s' %(host, str(port))
+                reqStr = '%s %s HTTP/1.1\r\nHost: %s\r\nAccept: */*\r\nConnection: close\r\n\r\n' %(
+                    req, par or '/', hostHeader)
+                reqT = time.monotonic()
+                writer.write(reqStr.encode('iso-8859-1'))
+                await writer.drain()
+                statusLine = await asyncio.wait_for(reader.readline(), timeout)
+                timingDict['ttfb'] = (time.monotonic() - reqT)*1000
+                if bodyFlg:
+                    # the server closes the connection after the response (Connection: close).
+                    bodyT = time.monotonic()
+                    rspData = await asyncio.wait_for(reader.read(), timeout)
+                    timingDict['bytes'] = len(rspData.split(b'\r\n\r\n', 1)[1]) if b'\r\n\r\n' in rspData else 0
+                    timingDict['transfer'] = (time.monotonic() - bodyT)*1000
+            finally:
+                writer.close()
+            parts = statusLine.decode('iso-8859-1').strip().split(' ', 2)
+            if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+                raise ValueError("Invalid http status line: %s" %str(statusLine))
+            return (int(parts[1]), parts[2] if len(parts) > 2 else '')
+
+    async def checkHttpConnAsync(self, target, requestConfig, timeout=DEF_TIMEOUT):
+        """ Async version of checkHttpConn().
+            Returns:
+                dict: { target': target,
+                        'conn': 'http',
+                        'port': 80
+                        'dns': <resolve time(ms)>,
+                        '<req>:<par>' :(status, reason),
+                        'timing': {'dns': <ms>, 'connect': <ms>, 'tls': <ms>, 'ttfb': <ms>, 
+                                   'transfer': <ms>, 'bytes': <body bytes>},
+                        'timingPct': {'<phase>': {'p50': <ms>, 'p90': <ms>, 'p99': <ms>}, ...}}
+        """
+        target = self._parseTarget(target)
+        resultDict = {  'target': target,
+                        'conn': 'http',
+                        'port': 80,
+                        'dns': None }
+        if 'conn' in requestConfig.keys(): resultDict['conn'] = str(requestConfig['conn']).lower()
+        if 'port' in requestConfig.keys(): resultDict['port'] = int(requestConfig['port'])
+        req = requestConfig['req'] if 'req' in requestConfig.keys() else 'HEAD'
+        par = requestConfig['par'] if 'par' in requestConfig.keys() else '/'
+        bodyFlg = bool(requestConfig['body']) if 'body' in requestConfig.keys() else False
+        reqKey = ':'.join((req, par))
+        resultDict[reqKey] = None
+        ipAddr, resultDict['dns'] = await self._resolveTargetAsync(target)
+        timingDict = resultDict['timing'] = dict.fromkeys(HTTP_PHASES + ('bytes',))
+        timingDict['dns'] = resultDict['dns']
+        resultDict['timingPct'] = None
+        if ipAddr is None:
+            self._debugPrint("Http target [%s] can not be resolved" %str(target), logType=self._logWarning)
+            return resultDict
+        try:
+            resultDict[reqKey] = await self._httpRequestAsync(
+                target, resultDict['port'], resultDict['conn'] == 'https', req, par, timeout, ipAddr=ipAddr,
+                timingDict=timingDict, bodyFlg=bodyFlg)
+            poolKey = (resultDict['conn'], target, resultDict['port'])
+            resultDict['timingPct'] = self._addHttpTiming(poolKey + (reqKey,), timingDict)
+        except Exception as error:
+            self._debugPrint("Error when connect to the target: %s " %str(target), logType=self._logWarning)
+        return resultDict
+
+#-----------------------------------------------------------------------------
+    async def _readFtpReply(self, reader, timeout):
+        """ Read a (multi-line) FTP reply, return the last line string."""
+        line = (await asyncio.wait_for(reader.readline(), timeout)).decode('utf-8', 'replace').rstrip('\r\n')
+        if len(line) > 3 and line[3] == '-':
+            code = line[:3]
+            while True:
+                nextLine = (await asyncio.wait_for(reader.readline(), timeout)).decode('utf-8', 'replace')
+                if not nextLine: break
+                line = nextLine.rstrip('\r\n')
+                if line[:3] == code and line[3:4] == ' ': break
+        return line
+
+    async def checkFtpConnAsync(self, target, loginConfig=None, timeout=DEF_TIMEOUT, 
+                                bannerFlg=False, ftpPort=FTP_PORT):
+        """ Async version of checkFtpConn(), the session is closed by QUIT after
+            the login check (or after the greeting if bannerFlg is True).
+            Returns:
+                dict: { 'target': <target>, 'dns': <resolve time(ms)>, 'conn': False, 'login': <Login state>,
+                        'connect': <tcp connect time(ms)>, 'greeting': <220 greeting time(ms)> }
+        """
+        target = self._parseTarget(target)
+        resultDict = { 'target': target, 'dns': None, 'conn': False, 'login': False, 
+                       'connect': None, 'greeting': None }
+        user = loginConfig['user'] if loginConfig else 'anonymous'
+        passwd = loginConfig['password'] if loginConfig else 'anonymous@'
+        ipAddr, resultDict['dns'] = await self._resolveTargetAsync(target)
+        if ipAddr is None:
+            self._debugPrint("FTP server [%s] can not be resolved" %str(target), logType=self._logWarning)
+            return resultDict
+        async with self._getSockLimiter():
+            writer = None
+            try:
+                startT = time.monotonic()
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(ipAddr, ftpPort), timeout)
+                connT = time.monotonic()
+                resultDict['connect'] = (connT - startT)*1000
+                greeting = await self._readFtpReply(reader, timeout)
+                if not greeting.startswith('2'): raise ConnectionError(greeting)
+                resultDict['greeting'] = (time.monotonic() - connT)*1000
+                resultDict['conn'] = True
+                if not bannerFlg:
+                    writer.write(('USER %s\r\n' %user).encode('utf-8'))
+                    reply = await self._readFtpReply(reader, timeout)
+                    if reply.startswith('3'):
+                        writer.write(('PASS %s\r\n' %passwd).encode('utf-8'))
+                        reply = await self._readFtpReply(reader, timeout)
+                    if reply.startswith('2'): resultDict['login'] = reply
+                writer.write(b'QUIT\r\n')
+                await writer.drain()
+            except Exception as err:
+                self._debugPrint("Error to connect to the FTP server: %s" %str(err), logType=self._logWarning)
+            finally:
+                if writer: writer.close()
+        return resultDict
+
+#-----------------------------------------------------------------------------
+    async def checkUrlsConnAsync(self, urlList, timeout=DEF_TIMEOUT):
+        """ Async version of checkUrlsConn(), all the urls are checked concurrently.
+            A url is opened if the server replies a status code smaller than 400.
+            Returns:
+                dict: {target: 'urlList', <url1>:<state>, ..., 
+                       'dns': {<url1>: <resolve time(ms)>, ...}}
+        """
+        resultDict = { 'target': 'urlList', 'dns': dict.fromkeys(str(url) for url in urlList) }
+        async def _checkUrl(url):
+            try:
+                urlParts = urlsplit(str(url))
+                httpsFlg = urlParts.scheme.lower() == 'https'
+                if urlParts.scheme.lower() not in ('http', 'https') or not urlParts.hostname:
+                    raise ValueError("unknown url type: %s" %str(url))
+                port = urlParts.port or (443 if httpsFlg else 80)
+                par = urlParts.path or '/'
+                if urlParts.query: par += '?' + urlParts.query
+                ipAddr, resultDict['dns'][str(url)] = await self._resolveTargetAsync(urlParts.hostname)
+                if ipAddr is None: raise ValueError("host can not be resolved: %s" %urlParts.hostname)
+                status, _ = await self._httpRequestAsync(urlParts.hostname, port, httpsFlg, 'GET', par, 
+                                                         timeout, ipAddr=ipAddr)
+                return status < 400
+            except Exception as err:
+                self._debugPrint("Url [%s] can not be opened" %url, logType=self._logWarning)
+                return False
+        stateList = await asyncio.gather(*[_checkUrl(url) for url in urlList])
+        for url, state in zip(urlList, stateList):
+            resultDict[str(url)] = state
+        return resultDict
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode):
+    driver = networkServiceProberAsync(maxSockets=64)
+    if mode == 0:
+        coroList = [driver.checkPingAsync('127.0.0.1'),
+                    driver.checkTcpConnAsync('127.0.0.1', [22, 80, 3000]),
+                    driver.checkNtpConnAsync('0.sg.pool.ntp.org'),
+                    driver.checkHttpConnAsync('127.0.0.1', {'port': 3000, 'conn': 'http', 'req': 'HEAD', 'par': '/'}),
+                    driver.checkFtpConnAsync('ftp.pureftpd.org'),
+                    driver.checkUrlsConnAsync(['https://www.google.com/', '123123'])]
+    elif mode == 1:
+        # probe many endpoints concurrently with a cap on open sockets.
+        coroList = [driver.checkHttpConnAsync('127.0.0.1', {'port': port}, timeout=1)
+                    for port in range(8000, 8200)]
+    startT = time.time()
+    result = driver.runChecks(coroList)
+    print("Time used: %s sec" %str(time.time() - startT))
+    print(result)
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(0)
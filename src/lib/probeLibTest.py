@@ -0,0 +1,190 @@
+#!/usr/bin/python
+#-----------------------------------------------------------------------------
+# Name:        probeLibTest.py
+#
+# Purpose:     This module will provide the test cases of the probe lib modules
+#              which can be checked without the network service targets:
+#              - <localServiceProber.py> /proc connections count, cgroup v2 
+#                counters parsing (synthetic cgroupfs tree).
+#              - <reportSpool.py> torn tail truncation, CRC check, replay 
+#                cursor commit/replay.
+#              If any change is added in these modules, please run this test
+#              program (or pytest probeLibTest.py) to make sure they are still
+#              working.
+#
+# Author:      Yuancheng Liu
+#
+# Created:     2023/04/24
+# Version:     v_0.1
+# Copyright:   n.a
+# License:     n.a
+#-----------------------------------------------------------------------------
+
+import os
+import socket
+import struct
+import shutil
+import tempfile
+
+import localServiceProber
+import reportSpool
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testConnStates():
+    """ The /proc connections count is same as psutil's."""
+    collector = localServiceProber.procCollector()
+    sockList = []
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(256)
+    try:
+        for _ in range(200):
+            client = socket.create_connection(server.getsockname())
+            sockList.extend([client, server.accept()[0]])
+        for rstDict in (collector.getConnStates(), collector._getConnStatesPsutil()):
+            assert rstDict['tcp'].get('ESTABLISHED', 0) >= 400
+            assert rstDict['tcp'].get('LISTEN', 0) >= 1
+            assert rstDict['connCount'] == sum(rstDict['tcp'].values()) + sum(rstDict['udp'].values())
+    finally:
+        for sock in sockList: sock.close()
+        server.close()
+
+#-----------------------------------------------------------------------------
+def _writeGroup(rootDir, name, usage, throttled, mem, pids, ioLines):
+    os.makedirs(os.path.join(rootDir, name), exist_ok=True)
+    for fileName, data in (('cpu.stat', 'usage_usec %d\nuser_usec 0\nsystem_usec 0\nthrottled_usec %d\n' %(usage, throttled)),
+                           ('memory.current', '%d\n' %mem), ('pids.current', '%d\n' %pids),
+                           ('io.stat', ''.join(line + '\n' for line in ioLines))):
+        with open(os.path.join(rootDir, name, fileName), 'w') as fh: fh.write(data)
+
+def testCgroupCounters():
+    """ The cgroup files are parsed and the io counters of all the devices summed."""
+    rootDir = tempfile.mkdtemp()
+    collector = localServiceProber.cgroupCollector(root=rootDir)
+    try:
+        _writeGroup(rootDir, 'system.slice/a.service', 1500, 20, 4096, 3,
+                    ['8:0 rbytes=100 wbytes=200 rios=1 wios=2 dbytes=0 dios=0',
+                     '8:16 rbytes=1000 wbytes=2000 rios=10 wios=20 dbytes=0 dios=0'])
+        counterDict = collector._readCounters(collector._getReaders(os.path.join(rootDir, 'system.slice/a.service')))
+        assert counterDict == {'usage': 1500, 'throttled': 20, 'mem': 4096, 'pids': 3,
+                               'rbytes': 1100, 'wbytes': 2200, 'rios': 11, 'wios': 22}, counterDict
+    finally:
+        collector.close()
+        shutil.rmtree(rootDir)
+
+def testCgroupCollect():
+    """ The rates are None at the first collect and calculated from the counters 
+        increase after, the groups not matched any more are closed.
+    """
+    rootDir = tempfile.mkdtemp()
+    collector = localServiceProber.cgroupCollector(root=rootDir)
+    try:
+        for name in ('system.slice/a.service', 'system.slice/b.service', 'user.slice'):
+            _writeGroup(rootDir, name, 0, 0, 1024, 1, ['8:0 rbytes=0 wbytes=0 rios=0 wios=0 dbytes=0 dios=0'])
+        rstDict = collector.collect(['system.slice/*.service'])
+        assert sorted(rstDict.keys()) == ['system.slice/a.service', 'system.slice/b.service'], rstDict
+        groupDict = rstDict['system.slice/a.service']
+        assert groupDict['mem'] == 1024 and groupDict['pids'] == 1
+        assert groupDict['cpu'] is None and groupDict['readBps'] is None
+        _writeGroup(rootDir, 'system.slice/a.service', 1000000, 0, 2048, 2,
+                    ['8:0 rbytes=4096 wbytes=0 rios=1 wios=0 dbytes=0 dios=0'])
+        groupDict = collector.collect(['system.slice/*.service'])['system.slice/a.service']
+        assert groupDict['mem'] == 2048 and groupDict['pids'] == 2
+        assert groupDict['cpu'] > 0 and groupDict['readBps'] > 0 and groupDict['readIops'] > 0
+        assert groupDict['writeBps'] == 0 and groupDict['throttled'] == 0
+        collector.collect(['system.slice/a.service'])
+        assert list(collector.readerDict.keys()) == [os.path.join(rootDir, 'system.slice/a.service')]
+    finally:
+        collector.close()
+        shutil.rmtree(rootDir)
+
+#-----------------------------------------------------------------------------
+def _openSpool(spoolDir):
+    return reportSpool.reportSpool(spoolDir, debugPrint=lambda msg: None)
+
+def _readAll(spool):
+    return [data for _, data in spool.readBatch(100)]
+
+def testSpoolTornTail():
+    """ A torn record at the segment end is truncated when the spool is opened again."""
+    spoolDir = tempfile.mkdtemp()
+    try:
+        spool = _openSpool(spoolDir)
+        for idx in range(3): spool.append(b'report %d' %idx)
+        spool.close()
+        segPath = spool._segPath(spool.segList[-1])
+        validSz = os.path.getsize(segPath)
+        # a record header with 2 of the 8 payload bytes written.
+        with open(segPath, 'ab') as f: f.write(struct.pack(reportSpool.RECORD_HEADER_FMT, 8, 0) + b're')
+        spool = _openSpool(spoolDir)
+        assert os.path.getsize(segPath) == validSz
+        assert _readAll(spool) == [b'report 0', b'report 1', b'report 2']
+        spool.append(b'report 3')
+        assert _readAll(spool)[-1] == b'report 3'
+        spool.close()
+    finally:
+        shutil.rmtree(spoolDir)
+
+def testSpoolCrcCheck():
+    """ A record which payload not matches its CRC is dropped with the records after."""
+    spoolDir = tempfile.mkdtemp()
+    try:
+        spool = _openSpool(spoolDir)
+        for idx in range(3): spool.append(b'report %d' %idx)
+        spool.close()
+        segPath = spool._segPath(spool.segList[-1])
+        with open(segPath, 'r+b') as f:
+            f.seek(reportSpool.RECORD_HEADER_SZ*2 + len(b'report 0') + 1)
+            f.write(b'X')   # change the 2nd record's payload.
+        spool = _openSpool(spoolDir)
+        assert _readAll(spool) == [b'report 0']
+        assert os.path.getsize(segPath) == reportSpool.RECORD_HEADER_SZ + len(b'report 0')
+        spool.close()
+    finally:
+        shutil.rmtree(spoolDir)
+
+def testSpoolCursor():
+    """ The not committed records are replayed after the spool is opened again."""
+    spoolDir = tempfile.mkdtemp()
+    try:
+        spool = _openSpool(spoolDir)
+        for idx in range(5): spool.append(b'report %d' %idx)
+        recordList = spool.readBatch(2)
+        assert [data for _, data in recordList] == [b'report 0', b'report 1']
+        assert _readAll(spool)[0] == b'report 0'    # read doesn't move the cursor.
+        spool.commit(recordList[-1][0])
+        spool.close()
+        spool = _openSpool(spoolDir)
+        assert _readAll(spool) == [b'report 2', b'report 3', b'report 4']
+        spool.readBatch(1)  # read but not committed.
+        spool.close()
+        spool = _openSpool(spoolDir)
+        recordList = spool.readBatch(100)
+        assert [data for _, data in recordList] == [b'report 2', b'report 3', b'report 4']
+        spool.commit(recordList[-1][0])
+        assert spool.readBatch(100) == [] and spool.getPendingSize() == 0
+        spool.close()
+    finally:
+        shutil.rmtree(spoolDir)
+
+#-----------------------------------------------------------------------------
+TEST_LIST = (testConnStates, testCgroupCounters, testCgroupCollect, 
+             testSpoolTornTail, testSpoolCrcCheck, testSpoolCursor)
+
+def runTests():
+    testResultList = []
+    for testFunc in TEST_LIST:
+        try:
+            testFunc()
+            print("[o] %s pass." %testFunc.__name__)
+            testResultList.append(True)
+        except AssertionError as err:
+            print("[x] %s error: %s" %(testFunc.__name__, str(err)))
+            testResultList.append(False)
+    print(" => All test finished: %s/%s" % (str(testResultList.count(True)), str(len(testResultList))))
+    return all(testResultList)
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    runTests()
@@ -0,0 +1,253 @@
+#-----------------------------------------------------------------------------
+# Name:        reportSpool.py
+#
+# Purpose:     This module provides an append-only on-disk spool (store and
+#              forward queue) for the reports which can not be sent now:
+#              - records: <length><crc32><payload> appended in segment files,
+#                a torn record at the end (crash during write) is truncated
+#                when the spool is opened again.
+#              - fsync batching: fsync every N records or T seconds.
+#              - size cap: the oldest segments are evicted first.
+#              - replay cursor: (segment, offset) of the first not acknowledged
+#                record, saved atomically so the records are resent after restart.
+#
+# Author:      Yuancheng Liu
+#
+# Version:     v_0.1
+# Created:     2023/04/21
+# Copyright:   n.a
+# License:     n.a
+#-----------------------------------------------------------------------------
+
+import os
+import time
+import zlib
+import struct
+import threading
+
+RECORD_HEADER_FMT = '!II'   # payload length, payload crc32
+RECORD_HEADER_SZ = struct.calcsize(RECORD_HEADER_FMT)
+SEG_PREFIX = 'spool_'
+SEG_EXT = '.dat'
+CURSOR_FILE = 'cursor'
+SEGMENT_SZ = 1024*1024          # roll to a new segment file after 1MB.
+SPOOL_MAX_SZ = 64*1024*1024     # spool size cap.
+FSYNC_COUNT = 32                # fsync after 32 records
+FSYNC_INV = 1.0                 # or 1 sec.
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class reportSpool(object):
+    """ Append-only spool of the records (bytes) with a replay cursor.
+        Example:
+            spool = reportSpool('spoolDir')
+            spool.append(b'report')
+            recordList = spool.readBatch(10) -> [(<cursor after the record>, b'report'), ...]
+            spool.commit(recordList[-1][0]) # records acknowledged.
+    """
+    def __init__(self, spoolDir, maxSize=SPOOL_MAX_SZ, segmentSize=SEGMENT_SZ,
+                 fsyncCount=FSYNC_COUNT, fsyncInv=FSYNC_INV, debugPrint=None) -> None:
+        self.spoolDir = spoolDir
+        self.maxSize = int(maxSize)
+        # keep at least 4 segments under the cap so the eviction is not the whole spool.
+        self.segmentSize = max(RECORD_HEADER_SZ, min(int(segmentSize), self.maxSize//4))
+        self.fsyncCount = fsyncCount
+        self.fsyncInv = fsyncInv
+        self._debugPrint = debugPrint if debugPrint else print
+        self._lock = threading.Lock()
+        self.evictCount = 0     # evicted not acknowledged records.
+        self.unsynced = 0
+        self.lastSync = time.monotonic()
+        os.makedirs(spoolDir, exist_ok=True)
+        self.segList = sorted(int(name[len(SEG_PREFIX):-len(SEG_EXT)]) for name in os.listdir(spoolDir)
+                              if name.startswith(SEG_PREFIX) and name.endswith(SEG_EXT)
+                              and name[len(SEG_PREFIX):-len(SEG_EXT)].isdigit())
+        if not self.segList: self.segList.append(0)
+        self.segSizeDict = {segId: self._recover(segId) for segId in self.segList}
+        self.cursor = self._loadCursor()
+        self.writeFile = open(self._segPath(self.segList[-1]), 'ab')
+
+    #-----------------------------------------------------------------------------
+    def _segPath(self, segId):
+        return os.path.join(self.spoolDir, '%s%08d%s' %(SEG_PREFIX, segId, SEG_EXT))
+
+    def _recover(self, segId):
+        """ Check the records of the segment, truncate the torn/corrupted tail.
+            Returns:
+                int: the valid size of the segment.
+        """
+        path = self._segPath(segId)
+        if not os.path.exists(path): open(path, 'ab').close()
+        validSz = 0
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER_SZ)
+                if len(header) < RECORD_HEADER_SZ: break
+                length, crc = struct.unpack(RECORD_HEADER_FMT, header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc: break
+                validSz += RECORD_HEADER_SZ + length
+        if validSz < os.path.getsize(path):
+            self._debugPrint("Spool segment %s: truncate the broken tail at %d" %(path, validSz))
+            with open(path, 'r+b') as f: f.truncate(validSz)
+        return validSz
+
+    def _loadCursor(self):
+        try:
+            with open(os.path.join(self.spoolDir, CURSOR_FILE), 'r') as f:
+                segId, offset = (int(val) for val in f.read().split())
+        except (OSError, ValueError):
+            return (self.segList[0], 0)
+        if segId < self.segList[0]: return (self.segList[0], 0)
+        if segId not in self.segSizeDict: return (self.segList[-1], self.segSizeDict[self.segList[-1]])
+        return (segId, min(offset, self.segSizeDict[segId]))
+
+    def _saveCursor(self):
+        path = os.path.join(self.spoolDir, CURSOR_FILE)
+        with open(path + '.tmp', 'w') as f: f.write('%d %d' %self.cursor)
+        os.replace(path + '.tmp', path)
+
+    #-----------------------------------------------------------------------------
+    def append(self, data):
+        """ Append a record, fsync if the batch count/interval is reached."""
+        with self._lock:
+            if self.writeFile is None: return
+            segId = self.segList[-1]
+            if self.segSizeDict[segId] >= self.segmentSize:
+                self._sync()
+                self.writeFile.close()
+                segId += 1
+                self.segList.append(segId)
+                self.segSizeDict[segId] = 0
+                self.writeFile = open(self._segPath(segId), 'ab')
+            self.writeFile.write(struct.pack(RECORD_HEADER_FMT, len(data), zlib.crc32(data)) + data)
+            self.segSizeDict[segId] += RECORD_HEADER_SZ + len(data)
+            self.unsynced += 1
+            if self.unsynced >= self.fsyncCount or time.monotonic() - self.lastSync >= self.fsyncInv:
+                self._sync()
+            if self.getSize() > self.maxSize: self._evict()
+
+    def sync(self):
+        with self._lock: self._sync()
+
+    def _sync(self):
+        self.lastSync = time.monotonic()
+        if self.writeFile is None or not self.unsynced: return
+        self.writeFile.flush()
+        os.fsync(self.writeFile.fileno())
+        self.unsynced = 0
+
+    def _evict(self):
+        """ Remove the oldest segments (the writing one is kept) till the size is under the cap."""
+        while self.getSize() > self.maxSize and len(self.segList) > 1:
+            segId = self.segList.pop(0)
+            if self.cursor[0] <= segId:
+                self.evictCount += self._countRecords(segId, self.cursor[1] if self.cursor[0] == segId else 0)
+                self.cursor = (self.segList[0], 0)
+                self._saveCursor()
+            self._removeSeg(segId)
+
+    def _countRecords(self, segId, offset):
+        count = 0
+        with open(self._segPath(segId), 'rb') as f:
+            f.seek(offset)
+            while offset < self.segSizeDict[segId]:
+                length, _ = struct.unpack(RECORD_HEADER_FMT, f.read(RECORD_HEADER_SZ))
+                f.seek(length, os.SEEK_CUR)
+                offset += RECORD_HEADER_SZ + length
+                count += 1
+        return count
+
+    def _removeSeg(self, segId):
+        self.segSizeDict.pop(segId, None)
+        try:
+            os.remove(self._segPath(segId))
+        except OSError as err:
+            self._debugPrint("Remove spool segment %d error: %s" %(segId, str(err)))
+
+    #-----------------------------------------------------------------------------
+    def readBatch(self, maxCount, maxBytes=SEGMENT_SZ):
+        """ Read the records from the replay cursor (the cursor is not moved).
+            Returns:
+                list: [(<cursor after the record>, <record bytes>), ...]
+        """
+        recordList = []
+        with self._lock:
+            if self.writeFile is None: return recordList
+            self.writeFile.flush()
+            segId, offset = self.cursor
+            readSz = 0
+            for segId in self.segList[self.segList.index(segId):]:
+                if offset >= self.segSizeDict[segId]:
+                    offset = 0
+                    continue
+                with open(self._segPath(segId), 'rb') as f:
+                    f.seek(offset)
+                    while offset < self.segSizeDict[segId]:
+                        length, _ = struct.unpack(RECORD_HEADER_FMT, f.read(RECORD_HEADER_SZ))
+                        offset += RECORD_HEADER_SZ + length
+                        recordList.append(((segId, offset), f.read(length)))
+                        readSz += length
+                        if len(recordList) >= maxCount or readSz >= maxBytes: return recordList
+                offset = 0
+        return recordList
+
+    def commit(self, cursor):
+        """ Move the replay cursor after the acknowledged records and remove the
+            fully acknowledged segments.
+        """
+        with self._lock:
+            if self.writeFile is None or cursor[0] not in self.segSizeDict or cursor < self.cursor: return
+            self.cursor = cursor
+            while self.segList[0] < cursor[0]: self._removeSeg(self.segList.pop(0))
+            self._saveCursor()
+
+    #-----------------------------------------------------------------------------
+    def getSize(self):
+        return sum(self.segSizeDict.values())
+
+    def getPendingSize(self):
+        """ Bytes of the not acknowledged records."""
+        return sum(size for segId, size in self.segSizeDict.items() if segId >= self.cursor[0]) - self.cursor[1]
+
+    def getState(self):
+        return {'size': self.getSize(),
+                'pending': self.getPendingSize(),
+                'segments': len(self.segList),
+                'evicted': self.evictCount}
+
+    def close(self):
+        with self._lock:
+            if self.writeFile is None: return
+            self._sync()
+            self.writeFile.close()
+            self.writeFile = None
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+def testCase(mode):
+    import tempfile
+    spoolDir = tempfile.mkdtemp()
+    if mode == 0:
+        spool = reportSpool(spoolDir, maxSize=4096, segmentSize=1024)
+        for i in range(300): spool.append(b"report %03d" %i)
+        print(spool.getState())
+        recordList = spool.readBatch(5)
+        print([data for _, data in recordList])
+        spool.commit(recordList[-1][0])
+        spool.close()
+        # torn record at the end.
+        with open(spool._segPath(spool.segList[-1]), 'ab') as f: f.write(b'\x00\x00\x01')
+        spool = reportSpool(spoolDir, maxSize=4096, segmentSize=1024)
+        print([data for _, data in spool.readBatch(3)], spool.getState())
+        spool.close()
+    elif mode == 1:
+        spool = reportSpool(spoolDir)
+        startT = time.time()
+        for i in range(10000): spool.append(b'x'*1024)
+        print("append 10k x 1KB records: %.3f sec" %(time.time() - startT))
+        spool.close()
+
+#-----------------------------------------------------------------------------
+if __name__ == '__main__':
+    testCase(0)
@@ -195,8 +195,13 @@ class udpServer(object):
         return data
 
     #--udpServer-------------------------------------------------------------------
-    def serverStart(self, handler=None):
-        """ Start the UDP server to handle the incoming message."""
+    def serverStart(self, handler=None, quietPrefix=None):
+        """ Start the UDP server to handle the incoming message.
+            Args:
+                handler (function): message handler, its return is the reply.
+                quietPrefix (bytes): don't print the connection log of the 
+                    messages start with the prefix (such as high rate echo). 
+        """
         while not self.terminate:
             data, address = self.server.recvfrom(self.bufferSize)
             # Check whether the message is a big message
@@ -205,7 +210,8 @@ class udpServer(object):
                 _, _, size = bmMsg.split(';')
                 data = self.receiveChunk(int(size))
                 subData, _ = self.server.recvfrom(self.bufferSize)
-            print("Accepted connection from %s" % str(address))
+            if quietPrefix is None or not data.startswith(quietPrefix):
+                print("Accepted connection from %s" % str(address))
             msg = handler(data) if not handler is None else data
             if not msg is None:  # don't response client if the handler feed back is None
                 if not isinstance(msg, bytes): msg = str(msg).encode(CODE_FMT)
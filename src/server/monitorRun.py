@@ -13,13 +13,72 @@
 
 import time
 import json
+import ipaddress
+from array import array
 from statistics import mean 
 from collections import OrderedDict
 import monitorServerGlobal as gv
 from databaseHandler import  InfluxDB1Cli
+from metricStats import logLinearHistogram
 
 import commManager
 
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
+class peerLatencyMatrix(object):
+    """ N x N inter-agent latency matrix (row: source agent, column: destination
+        agent), the RTT(ms), jitter(ms) and loss values are kept in flat compact 
+        arrays ('d') and NaN means no data.
+    """
+    def __init__(self, nodeList) -> None:
+        self.nodeList = [str(node) for node in nodeList]   # ['<ip>:<port>', ...]
+        self.indexDict = {node: idx for idx, node in enumerate(self.nodeList)}
+        self.size = len(self.nodeList)
+        self.rtt = array('d', [float('nan')]) * (self.size * self.size)
+        self.jitter = array('d', self.rtt)
+        self.loss = array('d', self.rtt)
+
+    def updateRow(self, srcNode, peerResult):
+        """ Replace the source agent's row by its peers probe result:
+            {'<ip>:<port>': {'rtt': [min, avg, max], 'jitter': <ms>, 'loss': <0.0-1.0>}, ...}
+        """
+        if srcNode not in self.indexDict: return
+        rowStart = self.indexDict[srcNode] * self.size
+        for idx in range(rowStart, rowStart + self.size):
+            self.rtt[idx] = self.jitter[idx] = self.loss[idx] = float('nan')
+        for dstNode, peerDict in peerResult.items():
+            if dstNode not in self.indexDict or not isinstance(peerDict, dict): continue
+            idx = rowStart + self.indexDict[dstNode]
+            if peerDict.get('rtt'): self.rtt[idx] = float(peerDict['rtt'][1])
+            if peerDict.get('jitter') is not None: self.jitter[idx] = float(peerDict['jitter'])
+            if peerDict.get('loss') is not None: self.loss[idx] = float(peerDict['loss'])
+
+    def getCell(self, srcNode, dstNode):
+        """ Returns: tuple (rtt avg, jitter, loss) from srcNode to dstNode."""
+        idx = self.indexDict[srcNode] * self.size + self.indexDict[dstNode]
+        return (self.rtt[idx], self.jitter[idx], self.loss[idx])
+
+    def getCells(self):
+        """ Returns: list of the cells with data: [(srcNode, dstNode, rtt avg, jitter, loss), ...]"""
+        cellList = []
+        for srcIdx, srcNode in enumerate(self.nodeList):
+            for dstIdx, dstNode in enumerate(self.nodeList):
+                idx = srcIdx * self.size + dstIdx
+                if self.rtt[idx] == self.rtt[idx] or self.loss[idx] == self.loss[idx]:
+                    cellList.append((srcNode, dstNode, self.rtt[idx], self.jitter[idx], self.loss[idx]))
+        return cellList
+
+    def toDict(self):
+        """ Json serializable dict, the NaN value is converted to None."""
+        def _toList(data):
+            return [None if val != val else val for val in data]
+        return {'nodes': self.nodeList, 
+                'rtt': _toList(self.rtt), 
+                'jitter': _toList(self.jitter), 
+                'loss': _toList(self.loss)}
+
+#-----------------------------------------------------------------------------
+#-----------------------------------------------------------------------------
 class monitorRun(object):
 
     def __init__(self) -> None:
@@ -39,8 +98,14 @@ class monitorRun(object):
             self.dataDict[key] = {
                 'cpu': 0,
                 'ram': 0,
+                'cpuMax': 0,
+                'ramMax': 0,
                 'ping': 1000,
             }
+        self.latencyMatrix = peerLatencyMatrix([self._getNodeKey(ipAddr) for ipAddr in self.clientIPList])
+        self.onlineSet = set()  # agents replied the last data fetch.
+        self.rosterDict = {}    # node key -> roster acknowledged by the agent.
+        self.tcpLatencyDict = {} # merged tcp connect latency of the last cycle.
         self.scoreDBhandler = InfluxDB1Cli(ipAddr=gv.gScoreDBAddr, dbInfo=gv.gScoreDBInfo)
         self.terminate = False
 
@@ -52,18 +117,89 @@ class monitorRun(object):
             self.dataDict[key] = {
                 'cpu': 0,
                 'ram': 0,
+                'cpuMax': 0,
+                'ramMax': 0,
                 'ping': 1000,
             }
             resp = self.commMgr.fetchInfo(ipaddr, msg)
             if resp is None:
+                self.onlineSet.discard(ipaddr)
                 continue
             else:
+                self.onlineSet.add(ipaddr)
                 k, t, dataStr = resp
                 data = json.loads(dataStr)
                 self.dataDict[key]['ping'] = self._getPingVal(data)
                 self.dataDict[key]['cpu'] = self._getCpuUsage(data)
                 self.dataDict[key]['ram'] = self._getRamUsage(data)
+                self.dataDict[key]['cpuMax'] = self._getStatsVal(data, 'cpu', 'max')
+                self.dataDict[key]['ramMax'] = self._getStatsVal(data, 'ram', 'max')
+                peersVal = self._getPeersVal(data)
+                self.latencyMatrix.updateRow(self._getNodeKey(ipaddr), peersVal)
+                # agent restarted (no peer probed), push the roster again.
+                nodeKey = self._getNodeKey(ipaddr)
+                if len(peersVal) <= 1 and self.rosterDict.get(nodeKey): self.rosterDict.pop(nodeKey)
+
+    def _getNodeKey(self, ipAddr):
+        return ':'.join((str(ipAddr[0]), str(ipAddr[1])))
+
+    def _getRoster(self, ipAddr):
+        """ Peers of an agent: the other agents, the loopback addresses are only 
+            reachable from the hub host so they are not in the roster.
+        """
+        rosterList = []
+        for peerAddr in self.clientIPList:
+            if peerAddr == ipAddr: continue
+            try:
+                if ipaddress.ip_address(peerAddr[0]).is_loopback: continue
+            except ValueError:
+                pass    # host name
+            rosterList.append(list(peerAddr))
+        return rosterList
 
+    def pushRoster(self):
+        """ Send the peers list to the online agents for the inter-agent latency 
+            probe, only if the agent has not acknowledged the same roster.
+        """
+        for ipaddr in self.clientIPList:
+            if ipaddr not in self.onlineSet: continue
+            nodeKey = self._getNodeKey(ipaddr)
+            rosterList = self._getRoster(ipaddr)
+            if self.rosterDict.get(nodeKey) == rosterList: continue
+            msg = ';'.join(('POST', 'roster', json.dumps({'peers': rosterList})))
+            if self.commMgr.fetchInfo(ipaddr, msg) is not None: self.rosterDict[nodeKey] = rosterList
+
+    def fetchTcpLatency(self, resetFlg=True):
+        """ Fetch the TCP connect latency histograms from the online agents and 
+            merge the same service's ('<target>:<port>') histograms into one.
+            Args:
+                resetFlg (bool, optional): agents clear the histograms after read, so
+                    the result is the latency since the last fetch. Defaults to True.
+            Returns:
+                dict: {'<target>:<port>': {'count': <samples>, 'p50': <ms>, 'p90': <ms>, 'p99': <ms>}, ...}
+        """
+        msg = ';'.join(('GET', 'tcpHist', json.dumps({'reset': resetFlg})))
+        histDict = {}
+        for ipaddr in self.clientIPList:
+            if ipaddr not in self.onlineSet: continue
+            resp = self.commMgr.fetchInfo(ipaddr, msg)
+            if resp is None: continue
+            _, _, dataStr = resp
+            try:
+                for histKey, data in json.loads(dataStr).items():
+                    if 'hist' not in data: continue
+                    hist = logLinearHistogram.fromDict(data['hist'])
+                    if histKey in histDict:
+                        histDict[histKey].merge(hist)
+                    else:
+                        histDict[histKey] = hist
+            except Exception as err:
+                print("Agent [%s] tcp latency data format error: %s" %(str(ipaddr), str(err)))
+        resultDict = {}
+        for histKey, hist in histDict.items():
+            resultDict[histKey] = {'count': hist.total}
+            resultDict[histKey].update(hist.getQuantiles())
+        return resultDict
 
     def _getCpuUsage(self, valDict):
         val = valDict['local']['local-1']['result']['cpu']
@@ -73,6 +209,23 @@ class monitorRun(object):
         val = valDict['local']['local-1']['result']['ram']
         return 0 if val is None else val
 
+    def _getStatsVal(self, valDict, metric, statKey):
+        """ Get a summary value (min/mean/max/p95) of the agent's high frequency 
+            samples in the report window, 0 if not reported.
+        """
+        try:
+            val = valDict['local']['local-1']['result']['stats'][metric][statKey]
+        except Exception as err:
+            return 0
+        return 0 if val is None else val
+
+    def _getPeersVal(self, valDict):
+        try:
+            val = valDict['Peers']['Peers-1']['result']
+        except Exception as err:
+            return {}
+        return val if isinstance(val, dict) else {}
+
     def _getPingVal(self, valDict):
         val = valDict['Internet']['Internet-1']['result']['ping']
         if val is None or len(val) != 3:
@@ -86,18 +239,42 @@ class monitorRun(object):
             data = dataDict[key]
             dataFiled[key+'_cpu'] = float(data['cpu'])
             dataFiled[key+'_ram'] = float(data['ram'])
+            dataFiled[key+'_cpuMax'] = float(data['cpuMax'])
+            dataFiled[key+'_ramMax'] = float(data['ramMax'])
             dataFiled[key+'_ping'] = float(data['ping'])
         return dataFiled
 
+    def _convertTcpLatencyToInfluxField(self, latencyDict):
+        """ The merged tcp connect latency 'tcp_<target>:<port>_count/_p50/_p90/_p99'."""
+        dataFiled = {}
+        for histKey, valDict in latencyDict.items():
+            for key, val in valDict.items():
+                if val is not None: dataFiled['_'.join(('tcp', histKey, key))] = float(val)
+        return dataFiled
+
+    def _convertMatrixToInfluxField(self, matrix):
+        """ The peers latency matrix cells '<src>><dst>_rtt/_jitter/_loss' and the
+            whole N x N matrix json string 'peerMatrix'.
+        """
+        dataFiled = {'peerMatrix': json.dumps(matrix.toDict())}
+        for srcNode, dstNode, rtt, jitter, loss in matrix.getCells():
+            cellKey = '>'.join((srcNode, dstNode))
+            for key, val in (('_rtt', rtt), ('_jitter', jitter), ('_loss', loss)):
+                if val == val: dataFiled[cellKey+key] = float(val)
+        return dataFiled
 
     def updateDB(self):
         dataFiled = self._convertToInfluxField(self.dataDict)
+        dataFiled.update(self._convertMatrixToInfluxField(self.latencyMatrix))
+        dataFiled.update(self._convertTcpLatencyToInfluxField(self.tcpLatencyDict))
         self.scoreDBhandler.insertFields(gv.gMeasurement, dataFiled)
 
     def run(self):
         while not self.terminate:
             print("start to fetch data from clients")
             self.fetchAgentsData()
+            self.pushRoster()
+            self.tcpLatencyDict = self.fetchTcpLatency()
             print(self.dataDict)
             self.updateDB()
             time.sleep(5)